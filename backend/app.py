@@ -1,19 +1,50 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
-from core.constants import SESSION_SECRET
+from core.constants import SESSION_SECRET, TRASH_PURGE_ENABLED
+from core.auth_utils import user_cache, profile_cache
 from core.database import mongo
+from core.metrics import MetricsMiddleware, registry
+from core.security import security_manager
+from core.trash_purge import trash_purge_worker
 from routers.auth import auth_router
 from contextlib import asynccontextmanager
 from routers.drive import drive_router
 from routers.google_auth import google_auth_router
 from routers.user import user_router
 
+cache_entries = registry.gauge("cache_entries", "Entries held by the in-process caches", ("cache",))
+cache_hits = registry.gauge("cache_hits", "Hits on the in-process caches since start", ("cache",))
+cache_misses = registry.gauge("cache_misses", "Misses on the in-process caches since start", ("cache",))
+trash_purge_progress = registry.gauge("trash_purge", "Progress of the trash purge worker", ("stat",))
+
+
+def collect_runtime_metrics():
+    caches = {"token": security_manager.token_cache, "user": user_cache, "profile": profile_cache}
+    for cache_name, cache in caches.items():
+        stats = cache.stats()
+        cache_entries.set(stats["size"], cache=cache_name)
+        cache_hits.set(stats["hits"], cache=cache_name)
+        cache_misses.set(stats["misses"], cache=cache_name)
+    for stat, value in trash_purge_worker.stats().items():
+        trash_purge_progress.set(float(value or 0), stat=stat)
+
+
+registry.add_collector(collect_runtime_metrics)
+
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     await mongo.connect()
+    await mongo.ensure_indexes()
+    await mongo.warm_up()
+    security_manager.start_hash_pool()
+    if TRASH_PURGE_ENABLED:
+        trash_purge_worker.start()
     yield
+    await trash_purge_worker.stop()
+    security_manager.shutdown_hash_pool()
     await mongo.disconnect()
 
 app = FastAPI(lifespan=lifespan)
@@ -29,6 +60,7 @@ app.add_middleware(
     SessionMiddleware,
     secret_key=SESSION_SECRET
 )
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth_router)
 app.include_router(user_router)
@@ -37,3 +69,8 @@ app.include_router(google_auth_router)
 @app.get('/')
 async def root():
     return {"message": "Welcome to Cloud Drive"}
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,81 @@
+"""
+Per-request authentication overhead with and without the token and user caches.
+
+Token verification needs no database. The user record lookup runs against
+MONGO_DB_URI when it is set and is skipped otherwise.
+
+    python -m benchmarks.auth_overhead_benchmark --iterations 20000
+"""
+import os
+
+os.environ.setdefault("MONGO_DB_NAME", "cloud-drive-benchmark")
+
+import argparse
+import asyncio
+import json
+import time
+from core.auth_utils import get_user_record, user_cache
+from core.constants import JwtTokenScope, DATABASE_URL
+from core.database import mongo
+from core.security import security_manager
+
+EMAIL = "benchmark@clouddrive.com"
+
+
+def time_token_decoding(iterations: int, cached: bool):
+    token = security_manager.create_access_token(EMAIL, JwtTokenScope.auth)
+    security_manager.token_cache.clear()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        if not cached:
+            security_manager.token_cache.clear()
+        security_manager.decode_access_token(token, JwtTokenScope.auth)
+    return (time.perf_counter() - start) / iterations
+
+
+async def time_user_lookup(iterations: int, cached: bool):
+    user_cache.clear()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        if not cached:
+            user_cache.clear()
+        await get_user_record(EMAIL)
+    return (time.perf_counter() - start) / iterations
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    for cached in (False, True):
+        per_request = time_token_decoding(args.iterations, cached)
+        print(json.dumps({
+            "step": "decode_access_token",
+            "cached": cached,
+            "us_per_request": round(per_request * 1e6, 2),
+            **security_manager.token_cache.stats(),
+        }))
+
+    if not DATABASE_URL:
+        return
+
+    await mongo.connect()
+    try:
+        await mongo.users.update_one({"email": EMAIL}, {"$set": {"username": "benchmark"}}, upsert=True)
+        lookups = max(1, args.iterations // 20)
+        for cached in (False, True):
+            per_request = await time_user_lookup(lookups, cached)
+            print(json.dumps({
+                "step": "get_user_record",
+                "cached": cached,
+                "us_per_request": round(per_request * 1e6, 2),
+                **user_cache.stats(),
+            }))
+        await mongo.users.delete_one({"email": EMAIL})
+    finally:
+        await mongo.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Uploading a folder of small files one request at a time against one bulk request.
+
+The per-file path creates every folder through /drive/create-folder and every file
+through /drive/upload-file, the bulk path sends them all to /drive/upload-files with
+their relative paths. Round trips are read from the mongo_commands_total metric.
+
+    python -m benchmarks.bulk_upload_benchmark --files 5000 --folders 50 --file-kb 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from benchmarks.common import benchmark_client
+from core.metrics import mongo_commands
+
+
+def round_trips():
+    return sum(mongo_commands.values.values())
+
+
+async def upload_per_file(client, headers, parent_id, relative_paths, payloads):
+    folder_ids = {}
+    for relative_path in relative_paths:
+        folder_name = relative_path.split("/")[0]
+        if folder_name not in folder_ids:
+            response = await client.post(
+                "/drive/create-folder", headers=headers, json={"parent_id": parent_id, "name": folder_name}
+            )
+            response.raise_for_status()
+            folder_ids[folder_name] = response.json()["new_folder"]
+
+    for relative_path, payload in zip(relative_paths, payloads):
+        folder_name, file_name = relative_path.split("/")
+        response = await client.post(
+            f"/drive/upload-file/{folder_ids[folder_name]}",
+            params={"file_name": file_name},
+            headers=headers,
+            content=payload,
+        )
+        response.raise_for_status()
+
+
+async def upload_bulk(client, headers, parent_id, relative_paths, payloads):
+    response = await client.post(
+        f"/drive/upload-files/{parent_id}",
+        headers=headers,
+        files=[("files", (relative_path, payload)) for relative_path, payload in zip(relative_paths, payloads)],
+    )
+    response.raise_for_status()
+    failed = [result for result in response.json()["results"] if "error" in result]
+    if failed:
+        raise RuntimeError(f"{len(failed)} files failed, first: {failed[0]}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--folders", type=int, default=50)
+    parser.add_argument("--file-kb", type=int, default=4)
+    args = parser.parse_args()
+
+    relative_paths = [f"folder-{index % args.folders}/file-{index}.bin" for index in range(args.files)]
+    # Distinct payloads, so that deduplication doesn't hide the storage cost
+    payloads = [os.urandom(args.file_kb * 1024) for _ in range(args.files)]
+
+    results = []
+    for mode, upload in (("per-file", upload_per_file), ("bulk", upload_bulk)):
+        async with benchmark_client() as (client, headers, root_id):
+            round_trips_before = round_trips()
+            start = time.perf_counter()
+            await upload(client, headers, root_id, relative_paths, payloads)
+            elapsed = time.perf_counter() - start
+            results.append({
+                "mode": mode,
+                "seconds": round(elapsed, 3),
+                "files_per_second": round(args.files / elapsed, 1),
+                "round_trips": round_trips() - round_trips_before,
+            })
+
+    print(json.dumps({"files": args.files, "folders": args.folders, "file_kb": args.file_kb, "results": results}))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""
+Latency of the first burst of requests after startup, with and without the pool warm-up.
+
+Each mode runs in a fresh process so that it starts with an empty connection pool. The
+cold mode turns the warm-up and minPoolSize off, the warm mode uses the configured
+settings. Right after startup a burst of concurrent list-content requests is sent, the
+first requests of a cold process wait for connections to open.
+
+    python -m benchmarks.cold_start_benchmark --burst 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+COLD_ENVIRONMENT = {"MONGO_WARM_CONNECTIONS": "0", "MONGO_MIN_POOL_SIZE": "0"}
+
+
+async def run_burst(burst: int):
+    from benchmarks.common import benchmark_client, percentiles
+
+    started = time.perf_counter()
+    async with benchmark_client() as (client, headers, root_id):
+        startup_seconds = time.perf_counter() - started
+
+        async def request_once():
+            start = time.perf_counter()
+            response = await client.get(f"/drive/list-content/{root_id}", headers=headers)
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        latencies = await asyncio.gather(*(request_once() for _ in range(burst)))
+
+    return {"startup_seconds": round(startup_seconds, 3), "requests": burst, **percentiles(latencies)}
+
+
+def run_mode(mode: str, burst: int) -> dict:
+    environment = {**os.environ, **(COLD_ENVIRONMENT if mode == "cold" else {})}
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.cold_start_benchmark", "--mode", mode, "--burst", str(burst)],
+        env=environment, capture_output=True, text=True, check=True,
+    )
+    return {"mode": mode, **json.loads(completed.stdout.strip().splitlines()[-1])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--burst", type=int, default=200, help="Concurrent requests right after startup")
+    parser.add_argument("--mode", choices=["cold", "warm"], help="Run one mode in this process")
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(asyncio.run(run_burst(args.burst))))
+        return
+
+    print(json.dumps({"results": [run_mode(mode, args.burst) for mode in ("cold", "warm")]}))
+
+
+if __name__ == "__main__":
+    main()
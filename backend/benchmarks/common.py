@@ -0,0 +1,77 @@
+"""
+Shared setup for benchmarks that drive the FastAPI app in-process.
+
+Benchmarks run against MONGO_DB_URI; MONGO_DB_NAME defaults to a scratch database so
+that real drive data is never touched.
+"""
+import os
+
+os.environ.setdefault("MONGO_DB_NAME", "cloud-drive-benchmark")
+
+import statistics
+import uuid
+from contextlib import asynccontextmanager
+from httpx import ASGITransport, AsyncClient
+from app import app
+from core.auth_utils import create_user
+from core.constants import JwtTokenScope
+from core.database import mongo
+from core.file_utils import delete_owner_records
+from core.security import security_manager
+from models.db_models import UserModel
+
+
+async def create_benchmark_user():
+    """
+    :return: The new user's email, auth headers and drive root id
+    """
+    email = f"benchmark-{uuid.uuid4().hex}@clouddrive.com"
+    await create_user(UserModel(email=email, username="benchmark", password=""))
+    user_record = await mongo.users.find_one({"email": email})
+    token = security_manager.create_access_token(email, JwtTokenScope.auth)
+    return email, {"Authorization": f"Bearer {token}"}, user_record["drive_root_id"]
+
+
+async def delete_benchmark_user(email: str):
+    await delete_owner_records(email)
+    await mongo.users.delete_one({"email": email})
+
+
+@asynccontextmanager
+async def benchmark_app():
+    """
+    Start the app against the scratch database.
+
+    :return: A client sending requests to the app in-process
+    """
+    async with app.router.lifespan_context(app):
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            yield client
+
+
+@asynccontextmanager
+async def benchmark_client():
+    """
+    Start the app against the scratch database and create a throwaway user.
+
+    :return: The client, its auth headers and the user's drive root id
+    """
+    async with benchmark_app() as client:
+        email, headers, drive_root_id = await create_benchmark_user()
+        try:
+            yield client, headers, drive_root_id
+        finally:
+            await delete_benchmark_user(email)
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        value = round(samples[0] * 1000, 3) if samples else None
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    cut_points = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_ms": round(cut_points[49] * 1000, 3),
+        "p95_ms": round(cut_points[94] * 1000, 3),
+        "p99_ms": round(cut_points[98] * 1000, 3),
+    }
@@ -0,0 +1,85 @@
+"""
+Dedup ratio of content-addressed blob storage on a test corpus.
+
+Uploads every file of the corpus once per simulated user through /drive/upload-file
+and compares the logical bytes in the files records with the bytes actually held by
+distinct blobs. Without --corpus a synthetic corpus with repeated installers, photos
+and documents is generated.
+
+    python -m benchmarks.dedup_benchmark [--corpus DIR] [--users 3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+from pathlib import Path
+from urllib.parse import quote
+from benchmarks.common import benchmark_client
+from core.database import mongo
+
+
+def synthetic_corpus(seed: int = 0):
+    generator = random.Random(seed)
+    shared = {
+        "installer.dmg": generator.randbytes(8 * 1024 * 1024),
+        "photo.jpg": generator.randbytes(2 * 1024 * 1024),
+        "slides.pdf": generator.randbytes(1024 * 1024),
+    }
+    corpus = []
+    for index in range(30):
+        name, payload = generator.choice(list(shared.items()))
+        corpus.append((f"copy-{index}-{name}", payload))
+    for index in range(20):
+        corpus.append((f"unique-{index}.bin", generator.randbytes(256 * 1024)))
+    return corpus
+
+
+def directory_corpus(corpus_dir: Path):
+    return [
+        (str(path.relative_to(corpus_dir)).replace(os.sep, "_"), path.read_bytes())
+        for path in sorted(corpus_dir.rglob("*")) if path.is_file()
+    ]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", type=Path, help="Directory to upload, a synthetic corpus if unset")
+    parser.add_argument("--users", type=int, default=3, help="Number of users uploading the same corpus")
+    args = parser.parse_args()
+
+    corpus = directory_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    async with benchmark_client() as (client, headers, root_id):
+        content_hashes = set()
+        logical_bytes = 0
+        for user_index in range(args.users):
+            folder = await client.post(
+                "/drive/create-folder", headers=headers, json={"parent_id": root_id, "name": f"user-{user_index}"}
+            )
+            folder_id = folder.json()["new_folder"]
+            for file_name, payload in corpus:
+                response = await client.post(
+                    f"/drive/upload-file/{folder_id}?file_name={quote(file_name)}",
+                    headers=headers,
+                    content=payload,
+                )
+                response.raise_for_status()
+                record = await mongo.files.find_one({"parent_id": folder_id, "name": file_name})
+                content_hashes.add(record["content_hash"])
+                logical_bytes += record["size"]
+
+        physical_bytes = 0
+        async for blob in mongo.blobs.find({"_id": {"$in": list(content_hashes)}}, {"size": 1}):
+            physical_bytes += blob["size"]
+
+        print(json.dumps({
+            "files": len(corpus) * args.users,
+            "distinct_blobs": len(content_hashes),
+            "logical_mb": round(logical_bytes / (1024 * 1024), 2),
+            "physical_mb": round(physical_bytes / (1024 * 1024), 2),
+            "dedup_ratio": round(logical_bytes / physical_bytes, 2) if physical_bytes else None,
+        }))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
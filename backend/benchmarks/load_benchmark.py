@@ -0,0 +1,256 @@
+"""
+Concurrent load on the drive endpoints, with throughput and latency per endpoint.
+
+Seeds synthetic users, each with a drive tree of the given depth and fan-out, then
+drives concurrent requests at list-content, upload-file, download-files,
+move-directory and move-to-trash in turn. Results are printed, and optionally
+written, as one JSON document tagged with the current commit so that runs can be
+compared between commits.
+
+Runs against MONGO_DB_URI, or against a throwaway local mongod with --mongod.
+
+    python -m benchmarks.load_benchmark --mongod mongod --users 4 --depth 3 --fanout 4 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+ENDPOINTS = ["list-content", "upload", "download-files", "move-directory", "trash"]
+
+
+@contextmanager
+def local_mongod(mongod_binary: str):
+    """
+    Start a mongod on a free port with a temporary data directory.
+
+    :return: Its connection string
+    """
+    data_dir = tempfile.mkdtemp(prefix="cloud-drive-benchmark-")
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen(
+        [mongod_binary, "--dbpath", data_dir, "--port", str(port), "--bind_ip", "127.0.0.1"],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        from pymongo import MongoClient
+        with MongoClient(f"mongodb://127.0.0.1:{port}", serverSelectionTimeoutMS=30000) as client:
+            client.admin.command("ping")
+        yield f"mongodb://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class SeededUser:
+    def __init__(self, email, headers, root_id):
+        self.email = email
+        self.headers = headers
+        self.root_id = root_id
+        self.folders = [root_id]
+        self.leaf_folders = [root_id]
+        self.files = []
+
+
+async def seed_user(depth: int, fanout: int, files_per_folder: int, payload: bytes) -> SeededUser:
+    """
+    Insert a user's tree in bulk. Every file links to the same blob.
+    """
+    from bson import ObjectId
+    from benchmarks.common import create_benchmark_user
+    from core.blob_store import store_blob
+    from core.database import mongo
+    from core.usage import add_usage
+
+    async def single_chunk():
+        yield payload
+
+    user = SeededUser(*await create_benchmark_user())
+    file_uri, content_hash, file_size = await store_blob(single_chunk(), "benchmark.txt", {"contentType": "text/plain"})
+    now = int(datetime.now(timezone.utc).timestamp())
+
+    documents = []
+    level = [(user.root_id, [])]
+    for current_depth in range(depth + 1):
+        next_level = []
+        for parent_id, parent_ancestors in level:
+            ancestors = [*parent_ancestors, parent_id]
+            for _ in range(files_per_folder):
+                file_id = ObjectId()
+                user.files.append(str(file_id))
+                documents.append({
+                    "_id": file_id, "parent_id": parent_id, "ancestors": ancestors, "owner": user.email,
+                    "name": f"file-{len(user.files)}.txt", "is_folder": False, "uri": file_uri,
+                    "content_hash": content_hash, "size": file_size, "last_modified": now, "type": "text/plain",
+                })
+            if current_depth == depth:
+                continue
+            for index in range(fanout):
+                folder_id = ObjectId()
+                next_level.append((str(folder_id), ancestors))
+                documents.append({
+                    "_id": folder_id, "parent_id": parent_id, "ancestors": ancestors, "owner": user.email,
+                    "name": f"folder-{index}", "is_folder": True, "last_modified": now, "type": "Folder",
+                })
+        if next_level:
+            user.folders += [folder_id for folder_id, _ in next_level]
+            user.leaf_folders = [folder_id for folder_id, _ in next_level]
+        level = next_level
+
+    for start in range(0, len(documents), 1000):
+        await mongo.files.insert_many(documents[start:start + 1000])
+    # store_blob already counted one reference
+    await mongo.blobs.update_one({"_id": content_hash}, {"$inc": {"ref_count": len(user.files) - 1}})
+    await add_usage(user.email, file_size * len(user.files), len(user.files))
+    return user
+
+
+async def run_endpoint(client, users, endpoint: str, concurrency: int, requests_per_endpoint: int, payload: bytes):
+    latencies = []
+    status_codes = {}
+    # Files handed out once, so moves and trashing never collide
+    movable_files = {user.email: random.sample(user.files, len(user.files)) for user in users}
+    remaining = requests_per_endpoint
+
+    async def request_once(user):
+        if endpoint == "list-content":
+            return await client.get(f"/drive/list-content/{random.choice(user.folders)}", headers=user.headers)
+        if endpoint == "upload":
+            return await client.post(
+                f"/drive/upload-file/{random.choice(user.folders)}",
+                params={"file_name": f"upload-{uuid.uuid4().hex}.bin"},
+                headers=user.headers,
+                content=payload,
+            )
+        if endpoint == "download-files":
+            # Consume the whole archive, it is produced while being read
+            async with client.stream(
+                "POST", "/drive/download-files", headers=user.headers,
+                json={"files": [random.choice(user.leaf_folders)]},
+            ) as response:
+                async for _ in response.aiter_bytes():
+                    ...
+                return response
+        if not movable_files[user.email]:
+            return None
+        file_id = movable_files[user.email].pop()
+        if endpoint == "move-directory":
+            return await client.post(
+                "/drive/move-directory", headers=user.headers,
+                json={"files": [file_id], "new_parent_id": random.choice(user.folders)},
+            )
+        user.files.remove(file_id)
+        return await client.post("/drive/move-to-trash", headers=user.headers, json={"files": [file_id]})
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await request_once(random.choice(users))
+            if response is None:
+                return
+            latencies.append(time.perf_counter() - start)
+            status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    from benchmarks.common import percentiles
+    return {
+        "endpoint": endpoint,
+        "requests": len(latencies),
+        "errors": sum(count for status_code, count in status_codes.items() if status_code >= 400),
+        "status_codes": status_codes,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        **percentiles(latencies),
+    }
+
+
+async def run(args):
+    from benchmarks.common import benchmark_app, delete_benchmark_user
+
+    payload = os.urandom(args.upload_kb * 1024)
+    async with benchmark_app() as client:
+        seeded_at = time.perf_counter()
+        users = [
+            await seed_user(args.depth, args.fanout, args.files_per_folder, payload)
+            for _ in range(args.users)
+        ]
+        seed_seconds = time.perf_counter() - seeded_at
+        try:
+            results = [
+                await run_endpoint(client, users, endpoint, args.concurrency, args.requests, payload)
+                for endpoint in args.endpoints
+            ]
+        finally:
+            for user in users:
+                await delete_benchmark_user(user.email)
+
+    return {
+        "commit": current_commit(),
+        "config": {
+            "users": args.users, "depth": args.depth, "fanout": args.fanout,
+            "files_per_folder": args.files_per_folder, "concurrency": args.concurrency,
+            "requests": args.requests, "upload_kb": args.upload_kb,
+        },
+        "files_per_user": len(users[0].files) if users else 0,
+        "seed_seconds": round(seed_seconds, 3),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongod", help="mongod binary to start a throwaway server with, MONGO_DB_URI if unset")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--depth", type=int, default=3, help="Folder levels below each drive root")
+    parser.add_argument("--fanout", type=int, default=4, help="Sub-folders per folder")
+    parser.add_argument("--files-per-folder", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint")
+    parser.add_argument("--upload-kb", type=int, default=64)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--output", type=Path, help="Also write the report to this file")
+    args = parser.parse_args()
+
+    # The app reads its configuration on import, so the database must be chosen first
+    os.environ.setdefault("MONGO_DB_NAME", "cloud-drive-benchmark")
+    if args.mongod:
+        with local_mongod(args.mongod) as mongo_uri:
+            os.environ["MONGO_DB_URI"] = mongo_uri
+            report = asyncio.run(run(args))
+    else:
+        report = asyncio.run(run(args))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        args.output.write_text(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Drive endpoint latency while a storm of logins is being verified.
+
+Runs list-content requests at a steady rate, alone and then next to concurrent
+/auth/login calls. "inline" verifies passwords on the event loop like before,
+"pool" uses the bounded hashing pool.
+
+    python -m benchmarks.login_storm_benchmark --login-concurrency 16 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import time
+from bson import ObjectId
+from benchmarks.common import benchmark_client, percentiles
+from core.database import mongo
+from core.security import security_manager
+
+PASSWORD = "benchmark-password"
+
+
+async def drive_traffic(client, headers, root_id, stop: asyncio.Event, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get(f"/drive/list-content/{root_id}", headers=headers)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.005)
+
+
+async def login_storm(client, email, stop: asyncio.Event, outcomes):
+    while not stop.is_set():
+        response = await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+        outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+
+
+async def run_scenario(client, headers, root_id, email, login_concurrency, seconds):
+    stop = asyncio.Event()
+    latencies = []
+    outcomes = {}
+    tasks = [asyncio.create_task(drive_traffic(client, headers, root_id, stop, latencies))]
+    tasks += [
+        asyncio.create_task(login_storm(client, email, stop, outcomes))
+        for _ in range(login_concurrency)
+    ]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return {"drive_requests": len(latencies), **percentiles(latencies), "login_status_codes": outcomes}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--login-concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    async with benchmark_client() as (client, headers, root_id):
+        email = (await mongo.files.find_one({"_id": ObjectId(root_id)}))["owner"]
+        await mongo.users.update_one({"email": email}, {"$set": {"password": security_manager.hash_password(PASSWORD)}})
+
+        pooled_verify = security_manager.verify_password_async
+
+        async def inline_verify(password, hashed_password):
+            return security_manager.verify_password(password, hashed_password)
+
+        scenarios = [("idle", 0, pooled_verify), ("storm-inline", args.login_concurrency, inline_verify),
+                     ("storm-pool", args.login_concurrency, pooled_verify)]
+        for name, login_concurrency, verify in scenarios:
+            security_manager.verify_password_async = verify
+            result = await run_scenario(client, headers, root_id, email, login_concurrency, args.seconds)
+            print(json.dumps({"scenario": name, "login_concurrency": login_concurrency, **result}))
+        del security_manager.verify_password_async
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""
+Wall time and MongoDB round trips of restoring a large folder from the trash.
+
+Seeds a trashed folder of roughly the requested number of nodes for a throwaway user
+and restores it through /drive/restore-from-trash. Round trips are read from the
+mongo_commands_total metric.
+
+    python -m benchmarks.restore_benchmark --nodes 10000 --fanout 10
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from bson import ObjectId
+from benchmarks.common import benchmark_client
+from core.database import mongo
+from core.metrics import mongo_commands
+
+
+async def seed_trashed_folder(root_id: str, node_count: int, fanout: int) -> str:
+    owner = (await mongo.files.find_one({"_id": ObjectId(root_id)}))["owner"]
+    time_trashed = int(datetime.now(timezone.utc).timestamp())
+    folder_id = ObjectId()
+    documents = [{
+        "_id": folder_id, "parent_id": root_id, "ancestors": [root_id], "owner": owner,
+        "name": "restored", "is_folder": True, "time_trashed": time_trashed,
+    }]
+    level = [(str(folder_id), [root_id, str(folder_id)])]
+    while len(documents) < node_count:
+        next_level = []
+        for parent_id, ancestors in level:
+            for index in range(fanout):
+                if len(documents) >= node_count:
+                    break
+                child_id = ObjectId()
+                documents.append({
+                    "_id": child_id, "parent_id": parent_id, "ancestors": ancestors, "owner": owner,
+                    "name": f"node-{index}", "is_folder": True, "time_trashed": time_trashed,
+                })
+                next_level.append((str(child_id), [*ancestors, str(child_id)]))
+        level = next_level
+
+    for start in range(0, len(documents), 10000):
+        await mongo.trash.insert_many(documents[start:start + 10000])
+    return str(folder_id)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--fanout", type=int, default=10)
+    args = parser.parse_args()
+
+    async with benchmark_client() as (client, headers, root_id):
+        folder_id = await seed_trashed_folder(root_id, args.nodes, args.fanout)
+
+        round_trips_before = sum(mongo_commands.values.values())
+        start = time.perf_counter()
+        response = await client.post("/drive/restore-from-trash", headers=headers, json={"files": [folder_id]})
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+
+        restored_count = await mongo.files.count_documents({"ancestors": folder_id}) + 1
+        print(json.dumps({
+            "nodes": args.nodes,
+            "fanout": args.fanout,
+            "restored": restored_count,
+            "seconds": round(elapsed, 3),
+            "round_trips": sum(mongo_commands.values.values()) - round_trips_before,
+        }))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
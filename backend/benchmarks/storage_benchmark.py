@@ -0,0 +1,99 @@
+"""
+Download throughput of the GridFS and local-disk storage engines.
+
+Writes the same random payload through each engine, links it to a files record and
+downloads it through /drive/download, whole and in ranges. The local engine is
+rooted in a temporary directory unless STORAGE_LOCAL_ROOT is set.
+
+The in-process client has no zero-copy extension, so local files are still read in
+chunks here. The numbers compare the engines, not what a sendfile-capable server gives.
+
+    python -m benchmarks.storage_benchmark --size-mb 64 --downloads 20 --range-kb 1024
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from bson import ObjectId
+from benchmarks.common import benchmark_client, percentiles
+from core.database import mongo
+from core.storage import file_storage, LocalEngine, GRIDFS_BACKEND, LOCAL_BACKEND
+from models.db_models import DriveModel
+
+
+async def seed_file(engine, root_id: str, payload: bytes) -> str:
+    owner = (await mongo.files.find_one({"_id": ObjectId(root_id)}))["owner"]
+    writer = await engine.open_writer("benchmark.bin", {"contentType": "application/octet-stream"})
+    await writer.write(payload)
+    file_uri = await writer.commit(hashlib.sha256(payload).hexdigest())
+    file_record = DriveModel(
+        parent_id=root_id,
+        ancestors=[root_id],
+        owner=owner,
+        name=f"benchmark-{file_uri.replace('/', '_')}.bin",
+        uri=file_uri,
+        size=len(payload),
+        type="application/octet-stream",
+        last_modified=int(datetime.now(timezone.utc).timestamp()),
+    )
+    insertion_result = await mongo.files.insert_one(file_record.__dict__)
+    return str(insertion_result.inserted_id)
+
+
+async def time_downloads(client, headers, file_id: str, downloads: int, range_header: str | None):
+    request_headers = {**headers, "Range": range_header} if range_header else headers
+    latencies = []
+    received = 0
+    for _ in range(downloads):
+        start = time.perf_counter()
+        async with client.stream("GET", f"/drive/download/{file_id}", headers=request_headers) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "throughput_mb_s": round(received / sum(latencies) / 1024 ** 2, 1),
+        **percentiles(latencies),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--downloads", type=int, default=20)
+    parser.add_argument("--range-kb", type=int, default=1024)
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size_mb * 1024 ** 2)
+    range_size = args.range_kb * 1024
+    range_start = len(payload) // 2
+    range_header = f"bytes={range_start}-{range_start + range_size - 1}"
+
+    with tempfile.TemporaryDirectory() as local_root:
+        engines = {
+            GRIDFS_BACKEND: file_storage.engines[GRIDFS_BACKEND],
+            LOCAL_BACKEND: file_storage.engines[LOCAL_BACKEND],
+        }
+        if "STORAGE_LOCAL_ROOT" not in os.environ:
+            file_storage.engines[LOCAL_BACKEND] = engines[LOCAL_BACKEND] = LocalEngine(Path(local_root))
+
+        results = []
+        async with benchmark_client() as (client, headers, root_id):
+            for backend, engine in engines.items():
+                file_id = await seed_file(engine, root_id, payload)
+                results.append({
+                    "backend": backend,
+                    "whole": await time_downloads(client, headers, file_id, args.downloads, None),
+                    "range": await time_downloads(client, headers, file_id, args.downloads, range_header),
+                })
+
+    print(json.dumps({"size_mb": args.size_mb, "range_kb": args.range_kb, "results": results}))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+"""
+Round trips and wall time of trashing and deleting a synthetic subtree.
+
+Seeds a tree of the given depth and fan-out into a scratch database, then moves it to
+trash and deletes it permanently with both the previous depth-first implementation
+and move_files_to_trash. Requires MONGO_DB_URI; MONGO_DB_NAME defaults to a scratch
+database so that real drive data is never touched.
+
+    python -m benchmarks.trash_benchmark --depth 4 --fanout 10
+"""
+import os
+
+os.environ.setdefault("MONGO_DB_NAME", "cloud-drive-benchmark")
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from bson import ObjectId
+from gridfs import NoFile
+from pymongo import AsyncMongoClient
+from pymongo.monitoring import CommandListener
+from core.constants import DATABASE_URL
+from core.database import mongo
+from core.file_utils import move_files_to_trash
+
+OWNER = "benchmark@clouddrive.com"
+
+
+class RoundTripCounter(CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        ...
+
+    def failed(self, event):
+        ...
+
+
+async def seed_tree(depth: int, fanout: int) -> str:
+    # move_files_to_trash selects subtrees through ancestors, the legacy walk through parent_id
+    root_id = ObjectId()
+    documents = [{"_id": root_id, "parent_id": "", "ancestors": [], "owner": OWNER, "name": "root", "is_folder": True}]
+    level = [(str(root_id), [str(root_id)])]
+    for current_depth in range(depth):
+        next_level = []
+        for parent_id, ancestors in level:
+            for index in range(fanout):
+                is_folder = current_depth < depth - 1
+                child_id = ObjectId()
+                documents.append({
+                    "_id": child_id,
+                    "parent_id": parent_id,
+                    "ancestors": ancestors,
+                    "owner": OWNER,
+                    "name": f"node-{index}",
+                    "is_folder": is_folder,
+                })
+                if is_folder:
+                    next_level.append((str(child_id), [*ancestors, str(child_id)]))
+        level = next_level
+
+    for start in range(0, len(documents), 10000):
+        await mongo.files.insert_many(documents[start:start + 10000])
+    return str(root_id)
+
+
+async def legacy_move_files_to_trash(files_to_delete, permanent=False):
+    # The depth-first implementation this benchmark compares against
+    collection = mongo.trash if permanent else mongo.files
+    deleted_record_ids = set()
+    while len(files_to_delete) > 0:
+        current_top = files_to_delete.pop(-1)
+        current_top_id = ObjectId(current_top)
+        async for file_row in collection.find({"parent_id": str(current_top_id)}):
+            child_file_id = str(file_row["_id"])
+            if child_file_id not in deleted_record_ids:
+                files_to_delete.append(child_file_id)
+
+        delete_response = await collection.find_one_and_delete({"_id": current_top_id})
+        if delete_response:
+            deleted_record_ids.add(str(current_top_id))
+            if permanent:
+                if file_uri := delete_response.get("uri"):
+                    try:
+                        await mongo.file_bucket.delete(ObjectId(file_uri))
+                    except NoFile:
+                        ...
+            else:
+                delete_response["time_trashed"] = int(datetime.now(timezone.utc).timestamp())
+                await mongo.trash.insert_one(delete_response)
+
+
+async def run(implementation, depth: int, fanout: int, counter: RoundTripCounter):
+    root_id = await seed_tree(depth, fanout)
+    node_count = await mongo.files.count_documents({"owner": OWNER})
+    result = {"implementation": implementation.__name__, "depth": depth, "fanout": fanout, "nodes": node_count}
+
+    for phase, permanent in (("trash", False), ("delete", True)):
+        counter.count = 0
+        start = time.perf_counter()
+        await implementation([root_id], permanent=permanent)
+        result[f"{phase}_seconds"] = round(time.perf_counter() - start, 3)
+        result[f"{phase}_round_trips"] = counter.count
+
+    assert await mongo.files.count_documents({"owner": OWNER}) == 0
+    assert await mongo.trash.count_documents({"owner": OWNER}) == 0
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    counter = RoundTripCounter()
+    mongo._client = AsyncMongoClient(DATABASE_URL, event_listeners=[counter])
+    try:
+        implementations = [move_files_to_trash]
+        if not args.skip_legacy:
+            implementations.insert(0, legacy_move_files_to_trash)
+        for implementation in implementations:
+            print(json.dumps(await run(implementation, args.depth, args.fanout, counter)))
+    finally:
+        await mongo.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
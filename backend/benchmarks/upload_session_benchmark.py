@@ -0,0 +1,83 @@
+"""
+Upload throughput of a single request body vs upload sessions with parallel parts.
+
+    python -m benchmarks.upload_session_benchmark --size-mb 256 --parallel 1 4 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from benchmarks.common import benchmark_client
+
+
+async def upload_single_request(client, headers, root_id, payload: bytes):
+    response = await client.post(
+        f"/drive/upload-file/{root_id}",
+        params={"file_name": f"single-{uuid.uuid4().hex}.bin"},
+        headers=headers,
+        content=payload,
+    )
+    response.raise_for_status()
+
+
+async def upload_session(client, headers, root_id, payload: bytes, parallel: int):
+    response = await client.post(
+        "/drive/upload-sessions",
+        headers=headers,
+        json={"parent_id": root_id, "file_name": f"session-{uuid.uuid4().hex}.bin", "size": len(payload)},
+    )
+    response.raise_for_status()
+    session = response.json()
+    part_size = session["part_size"]
+    pending_parts = list(range(session["part_count"]))
+
+    async def worker():
+        while pending_parts:
+            part_number = pending_parts.pop(0)
+            part_response = await client.put(
+                f"/drive/upload-sessions/{session['session_id']}/parts/{part_number}",
+                headers=headers,
+                content=payload[part_number * part_size:(part_number + 1) * part_size],
+            )
+            part_response.raise_for_status()
+
+    await asyncio.gather(*(worker() for _ in range(parallel)))
+    response = await client.post(f"/drive/upload-sessions/{session['session_id']}/complete", headers=headers)
+    response.raise_for_status()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--parallel", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size_mb * 1024 * 1024)
+    async with benchmark_client() as (client, headers, root_id):
+        scenarios = [("single-request", lambda: upload_single_request(client, headers, root_id, payload))]
+        for parallel in args.parallel:
+            scenarios.append((
+                f"session-{parallel}-parts",
+                lambda parallel=parallel: upload_session(client, headers, root_id, payload, parallel),
+            ))
+
+        for name, run in scenarios:
+            durations = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                await run()
+                durations.append(time.perf_counter() - start)
+            best = min(durations)
+            print(json.dumps({
+                "scenario": name,
+                "size_mb": args.size_mb,
+                "best_seconds": round(best, 3),
+                "throughput_mb_s": round(args.size_mb / best, 1),
+            }))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
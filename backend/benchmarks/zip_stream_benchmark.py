@@ -0,0 +1,95 @@
+"""
+Peak RSS of building a drive download archive, in-memory vs streamed.
+
+Each run happens in a fresh process so ``ru_maxrss`` only reflects that run.
+The blob source mimics GridFS by handing out 255 KiB chunks.
+
+    python -m benchmarks.zip_stream_benchmark --sizes 64 256 1024
+"""
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import resource
+import time
+from zipfile import ZipFile, ZIP_DEFLATED
+from core.zip_stream import ZipEntry, stream_zip
+
+CHUNK_SIZE = 255 * 1024
+FILE_SIZE = 16 * 1024 * 1024
+
+
+async def _blob_chunks(size: int, chunk: bytes):
+    remaining = size
+    while remaining > 0:
+        yield chunk[:remaining]
+        remaining -= len(chunk)
+        await asyncio.sleep(0)
+
+
+async def _entries(archive_size: int, chunk: bytes):
+    for index in range(0, archive_size, FILE_SIZE):
+        size = min(FILE_SIZE, archive_size - index)
+        yield ZipEntry(path=f"folder/file-{index}.bin", chunks=_blob_chunks(size, chunk), size=size)
+
+
+async def _run_streamed(archive_size: int, chunk: bytes):
+    written = 0
+    first_byte = None
+    start = time.perf_counter()
+    async for part in stream_zip(_entries(archive_size, chunk)):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        written += len(part)
+    return written, first_byte
+
+
+async def _run_in_memory(archive_size: int, chunk: bytes):
+    # Mirrors the previous implementation: read each blob fully, then writestr
+    start = time.perf_counter()
+    io_stream = io.BytesIO()
+    with ZipFile(io_stream, "w", ZIP_DEFLATED) as zip_file:
+        async for entry in _entries(archive_size, chunk):
+            blob = b"".join([part async for part in entry.chunks])
+            zip_file.writestr(entry.path, blob)
+    return io_stream.getbuffer().nbytes, time.perf_counter() - start
+
+
+def _measure(mode: str, archive_size: int, queue):
+    chunk = os.urandom(CHUNK_SIZE)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    runner = _run_streamed if mode == "streamed" else _run_in_memory
+    start = time.perf_counter()
+    written, first_byte = asyncio.run(runner(archive_size, chunk))
+    queue.put({
+        "mode": mode,
+        "archive_mb": archive_size // (1024 * 1024),
+        "written_mb": round(written / (1024 * 1024), 1),
+        "seconds": round(time.perf_counter() - start, 3),
+        "time_to_first_byte": round(first_byte, 4),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024, 1),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256, 1024], help="Archive sizes in MiB")
+    parser.add_argument("--modes", nargs="+", default=["in-memory", "streamed"])
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        for mode in args.modes:
+            queue = context.Queue()
+            process = context.Process(target=_measure, args=(mode, size * 1024 * 1024, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
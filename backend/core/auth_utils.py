@@ -1,8 +1,46 @@
+from typing import Optional
 from fastapi import HTTPException
+from pydantic import EmailStr
 from pymongo.errors import DuplicateKeyError
+from core.cache import TTLCache
+from core.constants import USER_CACHE_SIZE, USER_CACHE_TTL, PROFILE_CACHE_SIZE
 from core.database import mongo
+from core.storage import profile_storage
 from models.db_models import UserModel, DriveModel
 
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# Small avatar variants by storage uri, they are immutable so entries only age out or go with the picture
+profile_cache = TTLCache(PROFILE_CACHE_SIZE, 24 * 60 * 60)
+
+
+async def get_user_record(email: EmailStr) -> Optional[dict]:
+    user_record = user_cache.get(email)
+    if user_record is None:
+        user_record = await mongo.users.find_one({"email": email})
+        if user_record is None:
+            return None
+        user_cache.set(email, user_record)
+
+    # Callers are free to modify their copy
+    return dict(user_record)
+
+
+def invalidate_user_record(email: EmailStr) -> None:
+    user_cache.pop(email)
+
+
+async def delete_profile_pictures(user_record: dict) -> None:
+    # The original upload and every resized variant
+    picture_ids = list(user_record.get("profile_variants", {}).values())
+    if profile_image_id := user_record.get("profile_image_id"):
+        picture_ids.append(profile_image_id)
+
+    for picture_id in picture_ids:
+        profile_cache.pop(picture_id)
+    if picture_ids:
+        await profile_storage.delete(picture_ids)
+
 
 async def create_user(new_user: UserModel):
     try:
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+from typing import AsyncIterator, Dict, List, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from core.compression import compressor
+from core.database import mongo
+from core.storage import file_storage
+
+# Blobs are keyed by the SHA-256 of their content and shared by every files record
+# that links to them. Each record holds one reference in ref_count.
+
+
+async def delete_blobs(file_uris: List[str]) -> None:
+    if not file_uris:
+        return
+    await file_storage.delete(file_uris)
+
+
+async def link_blob(content_hash: str, uploaded_uri: str, size: int) -> str:
+    """
+    Add a reference to the blob holding `content_hash`.
+
+    :param content_hash: SHA-256 of the uploaded content
+    :param uploaded_uri: Storage uri of the freshly uploaded copy
+    :param size: Size of the content
+    :return: The storage uri the files record should link to
+    """
+    while True:
+        # Blobs claimed by release_blobs are about to be deleted and can't be reused
+        existing_blob = await mongo.blobs.find_one_and_update(
+            {"_id": content_hash, "deleting": {"$exists": False}},
+            {"$inc": {"ref_count": 1}},
+        )
+        if existing_blob:
+            if existing_blob["uri"] != uploaded_uri:
+                await delete_blobs([uploaded_uri])
+            return existing_blob["uri"]
+
+        try:
+            await mongo.blobs.insert_one({"_id": content_hash, "uri": uploaded_uri, "size": size, "ref_count": 1})
+            return uploaded_uri
+        except DuplicateKeyError:
+            # Lost a race against another upload or a pending deletion, look again
+            await asyncio.sleep(0.01)
+
+
+async def add_blob_references(hash_counts: Dict[str, int]) -> None:
+    """
+    Add references to blobs that are already linked, for copies of existing records.
+
+    :param hash_counts: Number of references to add per content hash
+    """
+    if not hash_counts:
+        return
+
+    await mongo.blobs.bulk_write([
+        UpdateOne({"_id": content_hash}, {"$inc": {"ref_count": count}})
+        for content_hash, count in hash_counts.items()
+    ], ordered=False)
+
+
+async def release_blobs(hash_counts: Dict[str, int]) -> None:
+    """
+    Drop references and delete the blobs nobody links to anymore.
+
+    :param hash_counts: Number of references to drop per content hash
+    """
+    if not hash_counts:
+        return
+
+    await mongo.blobs.bulk_write([
+        UpdateOne({"_id": content_hash}, {"$inc": {"ref_count": -count}})
+        for content_hash, count in hash_counts.items()
+    ], ordered=False)
+
+    # Claim the orphans first so that a concurrent link_blob can't revive them
+    deletion_token = ObjectId()
+    await mongo.blobs.update_many(
+        {"_id": {"$in": list(hash_counts)}, "ref_count": {"$lte": 0}, "deleting": {"$exists": False}},
+        {"$set": {"deleting": deletion_token}},
+    )
+    orphaned_uris = [blob["uri"] async for blob in mongo.blobs.find({"deleting": deletion_token}, {"uri": 1})]
+    await delete_blobs(orphaned_uris)
+    await mongo.blobs.delete_many({"deleting": deletion_token})
+
+
+async def store_blob(
+    stream: AsyncIterator[bytes],
+    file_name: str,
+    metadata: dict,
+) -> Tuple[str, str, int]:
+    """
+    Upload a stream into storage, hashing and compressing it on the way, and deduplicate it.
+
+    :return: The linked storage uri, the content hash and the size
+    """
+    hasher = hashlib.sha256()
+    file_size = 0
+    codec = file_storage.storage_codec(metadata.get("contentType"))
+    chunk_compressor = compressor(codec) if codec else None
+    if codec:
+        metadata = {**metadata, "codec": codec}
+
+    writer = await file_storage.open_writer(file_name, metadata)
+    try:
+        async for chunk in stream:
+            hasher.update(chunk)
+            file_size += len(chunk)
+            await writer.write(chunk_compressor.compress(chunk) if chunk_compressor else chunk)
+        if chunk_compressor:
+            await writer.write(chunk_compressor.flush())
+    except BaseException:
+        await writer.abort()
+        raise
+    content_hash = hasher.hexdigest()
+    uploaded_uri = await writer.commit(content_hash)
+    return await link_blob(content_hash, uploaded_uri, file_size), content_hash, file_size
+
+
+async def hash_stored_blob(file_uri: str) -> str:
+    hasher = hashlib.sha256()
+    async for chunk in file_storage.iter_chunks(file_uri):
+        hasher.update(chunk)
+    return hasher.hexdigest()
@@ -0,0 +1,225 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Mapping, Tuple
+from bson import ObjectId
+from fastapi import HTTPException
+from pydantic import EmailStr
+from pymongo.errors import BulkWriteError
+from starlette.datastructures import UploadFile
+
+from core.blob_store import store_blob, release_blobs
+from core.changes import record_changes
+from core.constants import GRIDFS_CHUNK_SIZE, BULK_UPLOAD_CONCURRENCY
+from core.database import mongo
+from core.file_utils import get_mime_type, get_child_ancestors, resolve_name_conflicts
+from core.rollups import rollup_deltas, apply_rollup_deltas, top_level_records
+from core.usage import add_usage
+from models.db_models import DriveModel
+from models.drive_models import ChangeAction
+
+# Many files in one request. Blobs are stored first, then the folders of their relative
+# paths are found or created one level at a time, and the file records go in with one
+# insert_many. Every file gets its own result, so one bad file doesn't fail the rest.
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def split_relative_path(relative_path: str) -> List[str]:
+    """
+    :return: The folder names and the file name of a relative path, empty if it is not a valid one
+    """
+    path_parts = [part for part in relative_path.replace("\\", "/").split("/") if part not in ("", ".")]
+    if ".." in path_parts:
+        return []
+    return path_parts
+
+
+async def _read_upload(upload: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await upload.read(GRIDFS_CHUNK_SIZE):
+        yield chunk
+
+
+async def find_or_create_folders(
+    parent_record: Mapping,
+    folder_paths: Iterable[Tuple[str, ...]],
+    current_user: EmailStr,
+    last_modified: int,
+) -> Tuple[Dict[Tuple[str, ...], Mapping], List[dict]]:
+    """
+    Resolve relative folder paths below parent_record, reusing the folders that already exist.
+    Every level is inserted with one insert_many.
+
+    :return: The folder record of every path, and the records of the folders that were created,
+        already counted in the totals of their ancestors
+    """
+    folder_paths = set(folder_paths)
+    folders: Dict[Tuple[str, ...], Mapping] = {(): parent_record}
+    created_folders = []
+    created_ids = set()
+
+    for depth in range(1, max(map(len, folder_paths), default=0) + 1):
+        level_paths = sorted({folder_path[:depth] for folder_path in folder_paths if len(folder_path) >= depth})
+
+        # Only folders below an existing folder can exist already, one lookup per level
+        lookup_parents = {
+            str(folders[folder_path[:-1]]["_id"]) for folder_path in level_paths
+            if folders[folder_path[:-1]]["_id"] not in created_ids
+        }
+        existing_folders = {}
+        if lookup_parents:
+            existing_query = {
+                "parent_id": {"$in": list(lookup_parents)},
+                "name": {"$in": list({folder_path[-1] for folder_path in level_paths})},
+                "is_folder": True,
+            }
+            async for folder_row in mongo.files.find(existing_query, {"parent_id": 1, "name": 1, "ancestors": 1}):
+                existing_folders[(folder_row["parent_id"], folder_row["name"])] = folder_row
+
+        missing_paths = []
+        for folder_path in level_paths:
+            folder_key = (str(folders[folder_path[:-1]]["_id"]), folder_path[-1])
+            if folder_key in existing_folders:
+                folders[folder_path] = existing_folders[folder_key]
+            else:
+                missing_paths.append(folder_path)
+
+        # A file can hold the name of a missing folder, the new folder is numbered then
+        folder_names = await resolve_name_conflicts([
+            (str(folders[folder_path[:-1]]["_id"]), folder_path[-1], True) for folder_path in missing_paths
+        ])
+        level_folders = []
+        for folder_path, folder_name in zip(missing_paths, folder_names):
+            parent_folder = folders[folder_path[:-1]]
+            new_folder = DriveModel(
+                parent_id=str(parent_folder["_id"]),
+                ancestors=get_child_ancestors(parent_folder),
+                is_folder=True,
+                name=folder_name,
+                owner=current_user,
+                size=0,
+                item_count=0,
+                last_modified=last_modified,
+                type="Folder",
+            )
+            level_folders.append((folder_path, {**new_folder.__dict__, "_id": ObjectId()}))
+        if not level_folders:
+            continue
+
+        # Each level goes in before the next one is built on it. A folder created by a
+        # concurrent upload in the meantime is used instead of ours.
+        taken_positions = set()
+        try:
+            await mongo.files.insert_many([new_folder for _, new_folder in level_folders], ordered=False)
+        except BulkWriteError as e:
+            if any(write_error["code"] != DUPLICATE_KEY_ERROR for write_error in e.details["writeErrors"]):
+                raise
+            taken_positions = {write_error["index"] for write_error in e.details["writeErrors"]}
+        for position, (folder_path, new_folder) in enumerate(level_folders):
+            if position not in taken_positions:
+                folders[folder_path] = new_folder
+                created_folders.append(new_folder)
+                created_ids.add(new_folder["_id"])
+                continue
+            existing_folder = await mongo.files.find_one(
+                {"parent_id": new_folder["parent_id"], "name": new_folder["name"], "is_folder": True},
+                {"parent_id": 1, "name": 1, "ancestors": 1},
+            )
+            if existing_folder is None:
+                # The name went to a file instead, the upload can't be placed
+                raise HTTPException(status_code=409, detail="Folder names changed during the upload")
+            folders[folder_path] = existing_folder
+
+        # Counted right away, so folders left behind by a failed upload keep the totals right
+        level_created = [new_folder for position, (_, new_folder) in enumerate(level_folders)
+                         if position not in taken_positions]
+        await apply_rollup_deltas(mongo.files, rollup_deltas(level_created))
+
+    return folders, created_folders
+
+
+async def bulk_upload_files(parent_record: Mapping, uploads: List[UploadFile], current_user: EmailStr) -> List[dict]:
+    """
+    Store uploaded files below parent_record, creating the folders of their relative paths.
+
+    :param uploads: Files named by their path relative to parent_record
+    :return: The file_id and name, or the error, of every upload in order
+    """
+    results = [{"path": upload.filename or ""} for upload in uploads]
+    path_parts = [split_relative_path(upload.filename or "") for upload in uploads]
+    semaphore = asyncio.Semaphore(BULK_UPLOAD_CONCURRENCY)
+
+    async def store_upload(index: int):
+        async with semaphore:
+            metadata = {"contentType": get_mime_type(path_parts[index][-1])}
+            return await store_blob(_read_upload(uploads[index]), path_parts[index][-1], metadata)
+
+    valid_indexes = [index for index, parts in enumerate(path_parts) if parts]
+    for index in set(range(len(uploads))) - set(valid_indexes):
+        results[index]["error"] = "Invalid file path"
+
+    stored_blobs = {}
+    outcomes = await asyncio.gather(*(store_upload(index) for index in valid_indexes), return_exceptions=True)
+    for index, outcome in zip(valid_indexes, outcomes):
+        if isinstance(outcome, BaseException):
+            results[index]["error"] = "Failed to store file"
+        else:
+            stored_blobs[index] = outcome
+    if not stored_blobs:
+        return results
+
+    last_modified = int(datetime.now(timezone.utc).timestamp())
+    stored_indexes = sorted(stored_blobs)
+    try:
+        folders, created_folders = await find_or_create_folders(
+            parent_record, (tuple(path_parts[index][:-1]) for index in stored_indexes), current_user, last_modified
+        )
+
+        # Name conflicts within the batch and with existing files are numbered in one pass
+        file_names = await resolve_name_conflicts([
+            (str(folders[tuple(path_parts[index][:-1])]["_id"]), path_parts[index][-1], False)
+            for index in stored_indexes
+        ])
+        file_records = []
+        for index, file_name in zip(stored_indexes, file_names):
+            parent_folder = folders[tuple(path_parts[index][:-1])]
+            file_uri, content_hash, file_size = stored_blobs[index]
+            new_record = DriveModel(
+                parent_id=str(parent_folder["_id"]),
+                ancestors=get_child_ancestors(parent_folder),
+                is_folder=False,
+                name=file_name,
+                type=get_mime_type(file_name),
+                owner=current_user,
+                uri=file_uri,
+                content_hash=content_hash,
+                size=file_size,
+                last_modified=last_modified,
+            )
+            file_records.append({**new_record.__dict__, "_id": ObjectId()})
+
+        # A name taken since the lookup fails only its own file
+        failed_positions = set()
+        try:
+            await mongo.files.insert_many(file_records, ordered=False)
+        except BulkWriteError as e:
+            failed_positions = {write_error["index"] for write_error in e.details["writeErrors"]}
+    except BaseException:
+        # No record links to the stored blobs, drop the references they were given
+        await release_blobs(Counter(content_hash for _, content_hash, _ in stored_blobs.values()))
+        raise
+    await release_blobs(Counter(file_records[position]["content_hash"] for position in failed_positions))
+
+    inserted_records = []
+    for position, (index, file_record) in enumerate(zip(stored_indexes, file_records)):
+        if position in failed_positions:
+            results[index]["error"] = "File of the same name already exists"
+        else:
+            results[index].update(file_id=str(file_record["_id"]), name=file_record["name"])
+            inserted_records.append(file_record)
+
+    # The new folders were counted when they were created
+    await apply_rollup_deltas(mongo.files, rollup_deltas(inserted_records))
+    await add_usage(current_user, sum(file_record["size"] for file_record in inserted_records), len(inserted_records))
+    await record_changes(ChangeAction.CREATE, top_level_records([*created_folders, *inserted_records]))
+    return results
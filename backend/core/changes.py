@@ -0,0 +1,123 @@
+import asyncio
+import json
+import weakref
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, List, Mapping, Tuple
+from pydantic import EmailStr
+from pymongo import ReturnDocument
+from starlette.requests import Request
+from core.constants import CHANGE_GAP_GRACE, CHANGE_POLL_INTERVAL, CHANGE_HEARTBEAT_INTERVAL
+from core.database import mongo
+from models.drive_models import ChangeAction
+
+# Every user has a change sequence, change_seq on the user record holds the last number
+# handed out. Each mutation appends one change per top level record it touched.
+
+# Woken when this worker records a change, waiters also poll for other workers' changes
+_change_events: weakref.WeakValueDictionary[str, asyncio.Event] = weakref.WeakValueDictionary()
+
+
+def change_event(owner: EmailStr) -> asyncio.Event:
+    event = _change_events.get(owner)
+    if event is None:
+        event = _change_events[owner] = asyncio.Event()
+    return event
+
+
+async def record_changes(action: ChangeAction, file_records: Iterable[Mapping]) -> None:
+    records_by_owner = defaultdict(list)
+    for file_record in file_records:
+        records_by_owner[file_record["owner"]].append(file_record)
+
+    created_at = datetime.now(timezone.utc)
+    for owner, owner_records in records_by_owner.items():
+        # Reserve a block of sequence numbers for the whole batch
+        user_record = await mongo.users.find_one_and_update(
+            {"email": owner},
+            {"$inc": {"change_seq": len(owner_records)}},
+            projection={"change_seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if user_record is None:
+            continue
+
+        first_seq = user_record["change_seq"] - len(owner_records) + 1
+        await mongo.changes.insert_many([
+            {
+                "owner": owner,
+                "seq": first_seq + index,
+                "action": action.value,
+                "file_id": str(file_record["_id"]),
+                "parent_id": file_record.get("parent_id"),
+                "name": file_record.get("name"),
+                "is_folder": file_record.get("is_folder", False),
+                "created_at": created_at,
+            }
+            for index, file_record in enumerate(owner_records)
+        ], ordered=False)
+
+        if (event := _change_events.pop(owner, None)) is not None:
+            event.set()
+
+
+async def list_changes(owner: EmailStr, since: int, limit: int) -> Tuple[List[dict], int, bool]:
+    """
+    :return: The changes after `since`, the cursor to continue from and whether older changes expired.
+        After an expiry no changes are returned and the cursor is the latest sequence number,
+        the client resyncs and continues from there.
+    """
+    oldest_change = await mongo.changes.find_one({"owner": owner}, {"seq": 1}, sort=[("seq", 1)])
+    if since > 0 and (oldest_change is None or oldest_change["seq"] > since + 1):
+        # Changes after the cursor expired: the oldest one left is past it, or none is left
+        # although numbers were handed out since
+        user_record = await mongo.users.find_one({"email": owner}, {"change_seq": 1})
+        latest_seq = user_record.get("change_seq", 0) if user_record else 0
+        if oldest_change is not None or latest_seq > since:
+            return [], latest_seq, True
+
+    changes = []
+    cursor = since
+    now = datetime.now(timezone.utc)
+    changes_query = {"owner": owner, "seq": {"$gt": since}}
+    async for change in mongo.changes.find(changes_query, {"_id": 0, "owner": 0}).sort("seq", 1).limit(limit):
+        # A missing number is a change still being written, unless it was reserved long ago
+        change_time = change.pop("created_at").replace(tzinfo=timezone.utc)
+        if change["seq"] != cursor + 1 and (now - change_time).total_seconds() < CHANGE_GAP_GRACE:
+            break
+        change["time"] = int(change_time.timestamp())
+        changes.append(change)
+        cursor = change["seq"]
+    return changes, cursor, False
+
+
+async def wait_for_changes(owner: EmailStr, since: int, limit: int, timeout: float) -> Tuple[List[dict], int, bool]:
+    """
+    Like list_changes, but wait up to `timeout` seconds for a change if there is none yet.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        event = change_event(owner)
+        changes, cursor, expired = await list_changes(owner, since, limit)
+        remaining = deadline - loop.time()
+        if changes or expired or remaining <= 0:
+            return changes, cursor, expired
+        try:
+            await asyncio.wait_for(event.wait(), timeout=min(remaining, CHANGE_POLL_INTERVAL))
+        except asyncio.TimeoutError:
+            ...
+
+
+async def stream_changes(owner: EmailStr, since: int, limit: int, request: Request) -> AsyncIterator[str]:
+    # Server-sent events, the event id is the cursor so that reconnecting clients resume
+    cursor = since
+    while not await request.is_disconnected():
+        changes, cursor, expired = await wait_for_changes(owner, cursor, limit, CHANGE_HEARTBEAT_INTERVAL)
+        if expired:
+            # Reconnecting after the reset resumes from the latest change, not the expired cursor
+            yield f"id: {cursor}\nevent: reset\ndata: {{}}\n\n"
+        for change in changes:
+            yield f"id: {change['seq']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+        if not changes and not expired:
+            yield ": heartbeat\n\n"
@@ -0,0 +1,88 @@
+import zlib
+from typing import AsyncIterator
+from core.constants import STORAGE_COMPRESSION_ENABLED, STORAGE_COMPRESSION_LEVEL
+
+# Blobs of compressible types are stored compressed, the codec is recorded in the
+# GridFS metadata. Hashes, sizes and quotas always refer to the original content.
+
+ZLIB_CODEC = "zlib"
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/ld+json",
+    "application/xml",
+    "application/javascript",
+    "application/x-javascript",
+    "application/x-ndjson",
+    "application/x-yaml",
+    "application/yaml",
+    "application/sql",
+    "application/x-sh",
+    "application/x-tex",
+    "application/rtf",
+    "application/x-ipynb+json",
+    "image/svg+xml",
+    "image/bmp",
+    "image/x-ms-bmp",
+}
+
+# Already compressed, deflating them again only spends CPU
+PRECOMPRESSED_PREFIXES = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/vnd.openxmlformats-",
+    "application/vnd.oasis.opendocument.",
+)
+PRECOMPRESSED_TYPES = {
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/vnd.rar",
+    "application/x-tar",
+    "application/zstd",
+    "application/java-archive",
+    "application/epub+zip",
+    "application/pdf",
+}
+
+
+def storage_codec(mime_type: str | None) -> str | None:
+    """
+    :return: The codec to store a blob of this type with, None to store it as is
+    """
+    if not STORAGE_COMPRESSION_ENABLED or not mime_type:
+        return None
+    if mime_type.startswith("text/") or mime_type in COMPRESSIBLE_TYPES:
+        return ZLIB_CODEC
+    return None
+
+
+def is_precompressed(mime_type: str | None) -> bool:
+    if not mime_type:
+        return False
+    if mime_type in COMPRESSIBLE_TYPES:
+        return False
+    return mime_type in PRECOMPRESSED_TYPES or mime_type.startswith(PRECOMPRESSED_PREFIXES)
+
+
+def compressor(codec: str):
+    if codec != ZLIB_CODEC:
+        raise ValueError(f"Unknown codec {codec}")
+    return zlib.compressobj(STORAGE_COMPRESSION_LEVEL)
+
+
+async def decompress_chunks(chunks: AsyncIterator[bytes], codec: str) -> AsyncIterator[bytes]:
+    if codec != ZLIB_CODEC:
+        raise ValueError(f"Unknown codec {codec}")
+    decompressor = zlib.decompressobj()
+    async for chunk in chunks:
+        if decompressed := decompressor.decompress(chunk):
+            yield decompressed
+    if remainder := decompressor.flush():
+        yield remainder
@@ -13,21 +13,102 @@ FRONTEND_URL = os.getenv("FRONTEND_URL")
 
 # Database Config
 DATABASE_URL = os.getenv("MONGO_DB_URI")
-DATABASE_NAME = "cloud-drive-data"
+DATABASE_NAME = os.getenv("MONGO_DB_NAME", "cloud-drive-data")
+
+
+def _optional_int(name: str) -> int | None:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+# Connection pool. The pool size and the timeouts default to the pymongo values and the
+# optional settings are only passed when set. minPoolSize (pymongo: 0) and maxConnecting
+# (pymongo: 2) are raised so that the pool stays warm and refills quickly after bursts.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 10)) # Kept open in the background, even when idle
+MONGO_MAX_CONNECTING = int(os.getenv("MONGO_MAX_CONNECTING", 4)) # Connections opened at once while the pool grows
+MONGO_MAX_IDLE_TIME_MS = _optional_int("MONGO_MAX_IDLE_TIME_MS")
+MONGO_WAIT_QUEUE_TIMEOUT_MS = _optional_int("MONGO_WAIT_QUEUE_TIMEOUT_MS")
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 20000))
+MONGO_SOCKET_TIMEOUT_MS = _optional_int("MONGO_SOCKET_TIMEOUT_MS")
+# Wire compression in order of preference, e.g. "zstd,snappy,zlib". zstd and snappy need
+# the pymongo[zstd] and pymongo[snappy] extras, unavailable ones are skipped by pymongo.
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+MONGO_ZLIB_COMPRESSION_LEVEL = int(os.getenv("MONGO_ZLIB_COMPRESSION_LEVEL", -1))
+# Connections opened during startup so that the first requests don't wait for them
+MONGO_WARM_CONNECTIONS = int(os.getenv("MONGO_WARM_CONNECTIONS", MONGO_MIN_POOL_SIZE))
 
 class COLLECTIONS(str, Enum):
     USERS = "users"
     FILES = "files"
     TRASH = "trash"
+    UPLOAD_SESSIONS = "upload_sessions"
+    BLOBS = "blobs"
+    CHANGES = "changes"
 
 class BUCKETS(str, Enum):
     PROFILE_PICTURES = "profile_pictures"
     FILE_STORAGE = "file_storage"
 
+# Number of documents moved per bulk write when trashing or deleting a subtree
+TRASH_BATCH_SIZE = 1000
+
+# Largest page a listing endpoint returns
+MAX_PAGE_SIZE = 1000
+
+# Search matches substrings through the n-grams of the lowercased file names
+SEARCH_GRAM_SIZE = 3
+SEARCH_PAGE_SIZE = 50
+
+# Upload sessions, parts are a whole number of GridFS chunks
+GRIDFS_CHUNK_SIZE = 255 * 1024
+UPLOAD_PART_CHUNKS = int(os.getenv("UPLOAD_PART_CHUNKS", 32))
+UPLOAD_PART_SIZE = GRIDFS_CHUNK_SIZE * UPLOAD_PART_CHUNKS
+UPLOAD_SESSION_EXPIRATION = 24 * 60 * 60 # The expiration time in seconds
+
+# Bulk uploads, files are stored a few at a time
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", 10000))
+BULK_UPLOAD_CONCURRENCY = int(os.getenv("BULK_UPLOAD_CONCURRENCY", 8))
+
+# Trashed files are purged for good after the retention period by a background worker
+TRASH_RETENTION = int(os.getenv("TRASH_RETENTION_DAYS", 30)) * 24 * 60 * 60 # In seconds
+TRASH_PURGE_ENABLED = os.getenv("TRASH_PURGE_ENABLED", "true").lower() == "true"
+TRASH_PURGE_INTERVAL = int(os.getenv("TRASH_PURGE_INTERVAL", 10 * 60)) # Idle time between sweeps in seconds
+TRASH_PURGE_MIN_BATCH = 10
+TRASH_PURGE_MAX_BATCH = TRASH_BATCH_SIZE
+TRASH_PURGE_TARGET_BATCH_TIME = float(os.getenv("TRASH_PURGE_TARGET_BATCH_TIME", 0.25)) # In seconds
+TRASH_PURGE_DUTY_CYCLE = float(os.getenv("TRASH_PURGE_DUTY_CYCLE", 0.2)) # Share of the time spent purging
+
+# Where blob bytes are written, "gridfs" or "local" files below STORAGE_LOCAL_ROOT
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gridfs")
+# Resolved once at startup so that later changes of the working directory don't move it
+STORAGE_LOCAL_ROOT = pathlib.Path(os.getenv("STORAGE_LOCAL_ROOT", "storage")).resolve()
+
+# Compressible uploads are stored deflated
+STORAGE_COMPRESSION_ENABLED = os.getenv("STORAGE_COMPRESSION_ENABLED", "true").lower() == "true"
+STORAGE_COMPRESSION_LEVEL = int(os.getenv("STORAGE_COMPRESSION_LEVEL", 6)) # zlib level, 1 is fastest
+
+# Change feed for delta sync
+CHANGE_RETENTION = int(os.getenv("CHANGE_RETENTION_DAYS", 30)) * 24 * 60 * 60 # In seconds
+CHANGE_MAX_WAIT = 60 # Longest long poll in seconds
+CHANGE_POLL_INTERVAL = 2 # Changes from other workers are noticed within this many seconds
+CHANGE_GAP_GRACE = 5 # Seconds a missing sequence number is waited for before it is skipped
+CHANGE_HEARTBEAT_INTERVAL = 15 # Seconds between comments on an idle event stream
+
+# Storage quota per user in bytes, trashed files count towards it
+USER_STORAGE_QUOTA = int(os.getenv("USER_STORAGE_QUOTA", 15 * 1024 ** 3))
+
 # Password Config
 PASSWORD_MIN_LENGTH = 8
 PASSWORD_MAX_LENGTH = 32
 
+# Password hashing runs in a bounded worker pool, off the event loop
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "process") # "process" or "thread"
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 4 * PASSWORD_HASH_WORKERS))
+PASSWORD_HASH_ADMISSION_TIMEOUT = float(os.getenv("PASSWORD_HASH_ADMISSION_TIMEOUT", 2)) # In seconds
+
 # JWT Config
 JWT_TOKEN_EXPIRATION = 60 # The expiration time in minutes
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
@@ -39,6 +120,13 @@ class JwtTokenScope:
     password_reset = "password_reset"
 
 
+# Verified tokens and user records are cached per worker
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", 300)) # In seconds, never past the token's exp
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 30)) # In seconds
+
+
 # Email Config
 MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
 MAIL_USERNAME = os.getenv("MAIL_USERNAME")
@@ -70,6 +158,10 @@ PASSWORD_RESET_TEMPLATE = f"{FRONTEND_URL}/reset-password?token={{}}"
 # Profile pictures
 PROFILE_PICTURES_TEMPLATE = f"{{}}-profile"
 FALLBACK_PROFILE_PICTURE = ASSET_PATH / "profile_fallback.png"
+PROFILE_VARIANT_SIZES = (32, 64, 256) # Square avatar edge lengths in pixels
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", 2048)) # Variants kept in memory per worker
+PROFILE_CACHE_MAX_VARIANT = 64 # Largest variant kept in memory
+PROFILE_CACHE_CONTROL = "private, max-age=31536000, immutable"
 
 # Google Auth
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
@@ -1,18 +1,118 @@
-import gridfs
+import asyncio
+import logging
+from typing import Dict, List
 from gridfs import AsyncGridFSBucket
-from pymongo import AsyncMongoClient
-from core.constants import DATABASE_URL, DATABASE_NAME, COLLECTIONS, BUCKETS
+from pymongo import AsyncMongoClient, ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from core.constants import DATABASE_URL, DATABASE_NAME, COLLECTIONS, BUCKETS, CHANGE_RETENTION, \
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_CONNECTING, MONGO_MAX_IDLE_TIME_MS, \
+    MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS, \
+    MONGO_SOCKET_TIMEOUT_MS, MONGO_COMPRESSORS, MONGO_ZLIB_COMPRESSION_LEVEL, MONGO_WARM_CONNECTIONS
+from core.metrics import mongo_command_metrics
+from models.drive_models import SortField
+
+logger = logging.getLogger(__name__)
+
+# Every index the queries rely on, keyed by collection name
+INDEXES: Dict[str, List[IndexModel]] = {
+    COLLECTIONS.USERS: [
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    COLLECTIONS.FILES: [
+        # Drive roots all share an empty parent_id and are left out
+        IndexModel(
+            [("parent_id", ASCENDING), ("name", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"parent_id": {"$gt": ""}},
+        ),
+        IndexModel([("owner", ASCENDING), ("parent_id", ASCENDING)]),
+        IndexModel([("ancestors", ASCENDING)]),
+        # Prefix searches, and search results by name in order
+        IndexModel([("owner", ASCENDING), ("name_lower", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("owner", ASCENDING), ("name_grams", ASCENDING)]),
+    ],
+    COLLECTIONS.TRASH: [
+        IndexModel([("owner", ASCENDING), ("time_trashed", ASCENDING)]),
+        IndexModel([("ancestors", ASCENDING)]),
+        # Expired trash across all users, for the purge worker
+        IndexModel([("time_trashed", ASCENDING)]),
+    ],
+    COLLECTIONS.UPLOAD_SESSIONS: [
+        IndexModel([("created_at", ASCENDING)]),
+    ],
+    COLLECTIONS.CHANGES: [
+        IndexModel([("owner", ASCENDING), ("seq", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=CHANGE_RETENTION),
+    ],
+    COLLECTIONS.BLOBS: [
+        IndexModel([("deleting", ASCENDING)], sparse=True),
+    ],
+}
+# Keyset pagination sorts on (sort field, _id) within a folder or a user's trash
+for _sort_field in SortField:
+    INDEXES[COLLECTIONS.FILES].append(
+        IndexModel([("owner", ASCENDING), ("parent_id", ASCENDING), (_sort_field.value, ASCENDING), ("_id", ASCENDING)])
+    )
+    INDEXES[COLLECTIONS.TRASH].append(
+        IndexModel([("owner", ASCENDING), (_sort_field.value, ASCENDING), ("_id", ASCENDING)])
+    )
+for _bucket in BUCKETS:
+    INDEXES[f"{_bucket.name}.files"] = [
+        IndexModel([("filename", ASCENDING), ("uploadDate", ASCENDING)]),
+    ]
+    INDEXES[f"{_bucket.name}.chunks"] = [
+        IndexModel([("files_id", ASCENDING), ("n", ASCENDING)], unique=True),
+    ]
+
+
+def client_options() -> dict:
+    # Optional settings left unset aren't passed, pymongo applies its own defaults to them
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxConnecting": MONGO_MAX_CONNECTING,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+        options["zlibCompressionLevel"] = MONGO_ZLIB_COMPRESSION_LEVEL
+    return {name: value for name, value in options.items() if value is not None}
 
 
 class MongoDBClient:
     _client: AsyncMongoClient | None = None
-    _profile_bucket_instance: AsyncGridFSBucket | None = None
-    _file_storage_instance: AsyncGridFSBucket | None = None
+    _buckets: Dict[str, AsyncGridFSBucket] = {}
 
     async def connect(self):
-        self._client = AsyncMongoClient(DATABASE_URL)
+        self._client = AsyncMongoClient(DATABASE_URL, event_listeners=[mongo_command_metrics], **client_options())
+        self._buckets = {}
         await self._client.admin.command('ping')
 
+    async def warm_up(self, connection_count: int = MONGO_WARM_CONNECTIONS):
+        """
+        Open pool connections and load both GridFS buckets before the first requests need them.
+
+        :param connection_count: Connections to open, concurrent pings each check one out
+        """
+        await asyncio.gather(*(self._client.admin.command('ping') for _ in range(connection_count)))
+        for bucket in BUCKETS:
+            self.bucket(bucket.name)
+            # The first reads page the bucket indexes into the server cache
+            await self.database[f"{bucket.name}.files"].find_one({}, {"_id": 1})
+            await self.database[f"{bucket.name}.chunks"].find_one({}, {"_id": 1})
+
+    async def ensure_indexes(self):
+        for collection_name, indexes in INDEXES.items():
+            try:
+                await self.database[collection_name].create_indexes(indexes)
+            except OperationFailure as e:
+                # An existing index with different options or conflicting data, leave it to an operator
+                logger.error("Failed to ensure indexes on %s: %s", collection_name, e)
+
     async def disconnect(self):
         await self._client.close()
 
@@ -35,20 +135,37 @@ class MongoDBClient:
     def trash(self):
         return self.database[COLLECTIONS.TRASH]
 
+    def bucket(self, bucket_name: str) -> AsyncGridFSBucket:
+        if bucket_name not in self._buckets:
+            self._buckets[bucket_name] = AsyncGridFSBucket(self.database, bucket_name)
+        return self._buckets[bucket_name]
+
     @property
     def profile_bucket(self):
-        if self._profile_bucket_instance is not None:
-            return self._profile_bucket_instance
+        return self.bucket(BUCKETS.PROFILE_PICTURES.name)
+
+    @property
+    def blobs(self):
+        return self.database[COLLECTIONS.BLOBS]
 
-        self._profile_bucket_instance = gridfs.AsyncGridFSBucket(self.database, BUCKETS.PROFILE_PICTURES.name)
-        return self._profile_bucket_instance
+    @property
+    def changes(self):
+        return self.database[COLLECTIONS.CHANGES]
 
     @property
-    def file_bucket(self):
-        if self._file_storage_instance is not None:
-            return self._file_storage_instance
+    def upload_sessions(self):
+        return self.database[COLLECTIONS.UPLOAD_SESSIONS]
+
+    @property
+    def file_bucket_files(self):
+        return self.database[f"{BUCKETS.FILE_STORAGE.name}.files"]
 
-        self._file_storage_instance = gridfs.AsyncGridFSBucket(self.database, BUCKETS.FILE_STORAGE.name)
-        return self._file_storage_instance
+    @property
+    def file_bucket_chunks(self):
+        return self.database[f"{BUCKETS.FILE_STORAGE.name}.chunks"]
+
+    @property
+    def file_bucket(self):
+        return self.bucket(BUCKETS.FILE_STORAGE.name)
 
 mongo = MongoDBClient()
\ No newline at end of file
@@ -1,15 +1,27 @@
 import mimetypes
+import re
+from collections import Counter, defaultdict
 from datetime import datetime, timezone
-from typing import Annotated, List, Set
+from pathlib import Path
+from typing import Annotated, AsyncIterator, Dict, List, Mapping, Optional, Tuple
 from bson import ObjectId
 from fastapi import HTTPException, Depends
-from gridfs import NoFile
 from pydantic import EmailStr
 from pymongo.asynchronous.collection import AsyncCollection
 
+from core.auth_utils import get_user_record
+from core.blob_store import delete_blobs, release_blobs, add_blob_references, hash_stored_blob, link_blob
+from core.changes import record_changes
+from core.compression import is_precompressed
+from core.constants import TRASH_BATCH_SIZE
 from core.database import mongo
+from core.rollups import rollup_deltas, apply_rollup_deltas, top_level_records, trashed_ancestors
+from core.search import search_name_fields
+from core.usage import release_usage, add_usage, check_quota, get_remaining_quota
 from core.security import security_manager
-from models.drive_models import DeleteFilesRequest
+from core.storage import file_storage
+from core.zip_stream import ZipEntry
+from models.drive_models import DeleteFilesRequest, ChangeAction
 
 
 def get_mime_type(filename: str) -> str:
@@ -42,44 +54,473 @@ async def verify_parent_folder(
         raise HTTPException(status_code=404, detail="Folder not found")
     return parent_record
 
+async def get_file_path(file_id: str, current_user: EmailStr) -> List[dict]:
+    """
+    Load a file and every folder above it in one aggregation.
+
+    :return: The _id and name of the drive root, each folder below it and the file itself
+    """
+    path_pipeline = [
+        {"$match": {"_id": ObjectId(file_id)}},
+        {"$addFields": {"ancestor_ids": {"$map": {
+            "input": {"$ifNull": ["$ancestors", []]},
+            "in": {"$toObjectId": "$$this"},
+        }}}},
+        {"$lookup": {
+            "from": mongo.files.name,
+            "localField": "ancestor_ids",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"name": 1}}],
+            "as": "ancestor_records",
+        }},
+        {"$project": {"name": 1, "owner": 1, "ancestors": {"$ifNull": ["$ancestors", []]}, "ancestor_records": 1}},
+    ]
+    file_record = next(iter(await (await mongo.files.aggregate(path_pipeline)).to_list()), None)
+    if file_record is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    if file_record["owner"] != current_user:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    # $lookup doesn't keep the order of the ancestors
+    ancestor_names = {str(ancestor["_id"]): ancestor["name"] for ancestor in file_record["ancestor_records"]}
+    path = [{"_id": ancestor_id, "name": ancestor_names.get(ancestor_id)} for ancestor_id in file_record["ancestors"]]
+    path.append({"_id": str(file_record["_id"]), "name": file_record["name"]})
+    return path
+
+
+def get_child_ancestors(parent_record: Mapping) -> List[str]:
+    return [*parent_record.get("ancestors", []), str(parent_record["_id"])]
+
+
+def subtree_query(file_ids: List[str]) -> dict:
+    # The requested files and everything below them, served by the _id and ancestors indexes
+    return {
+        "$or": [
+            {"_id": {"$in": [ObjectId(file_id) for file_id in file_ids]}},
+            {"ancestors": {"$in": file_ids}},
+        ]
+    }
+
+
+def in_trash_operation(file_row: Mapping, root_stamps: Mapping[str, Optional[str]]) -> bool:
+    """
+    Whether a trashed record went to the trash together with one of the requested records.
+
+    Everything trashed in one go is stamped with the id of the top level record of that
+    operation in trash_root. Records below a requested one that were trashed on their own
+    before carry another stamp and stay where they are.
+
+    :param root_stamps: The trash_root of every requested record, by id
+    """
+    if str(file_row["_id"]) in root_stamps:
+        return True
+    return any(
+        ancestor_id in root_stamps and file_row.get("trash_root") == root_stamps[ancestor_id]
+        for ancestor_id in file_row.get("ancestors", [])
+    )
+
+
+async def load_trash_stamps(file_ids: List[str]) -> Dict[str, Optional[str]]:
+    return {
+        str(file_row["_id"]): file_row.get("trash_root")
+        async for file_row in mongo.trash.find(
+            {"_id": {"$in": [ObjectId(file_id) for file_id in file_ids]}}, {"trash_root": 1}
+        )
+    }
+
+
 async def move_files_to_trash(
     files_to_delete: List[str],
     permanent=False
-) -> None:
+) -> int:
+    """
+    Move files and their subtrees to the trash, or out of the trash for good.
+
+    :return: The number of records moved, descendants included
+    """
     if permanent:
         collection = mongo.trash
+        root_stamps = await load_trash_stamps(files_to_delete)
     else:
         collection = mongo.files
+        root_stamps = None
+
+    # Load the whole subtree with one query and move it in batches
+    batch: List[dict] = []
+    moved_count = 0
+    requested_ids = set(files_to_delete)
+    requested_records = []
+    async for file_row in collection.find(subtree_query(files_to_delete)):
+        if permanent and not in_trash_operation(file_row, root_stamps):
+            continue
+        if not permanent:
+            # The top level requested record holding this one, it is restored together with it
+            file_row["trash_root"] = next(
+                ancestor_id for ancestor_id in [*file_row.get("ancestors", []), str(file_row["_id"])]
+                if ancestor_id in requested_ids
+            )
+        batch.append(file_row)
+        if len(batch) >= TRASH_BATCH_SIZE:
+            moved_rows = await _move_batch_to_trash(collection, batch, permanent)
+            moved_count += len(moved_rows)
+            requested_records.extend(file_row for file_row in moved_rows if str(file_row["_id"]) in requested_ids)
+            batch = []
+
+    if batch:
+        moved_rows = await _move_batch_to_trash(collection, batch, permanent)
+        moved_count += len(moved_rows)
+        requested_records.extend(file_row for file_row in moved_rows if str(file_row["_id"]) in requested_ids)
+
+    # The folders left behind lose the totals of what was moved out of them. In the trash,
+    # only the folders trashed along with a record hold its totals.
+    requested_records = top_level_records(requested_records)
+    left_behind = [
+        {**file_row, "ancestors": trashed_ancestors(file_row)} if permanent else file_row
+        for file_row in requested_records
+    ]
+    await apply_rollup_deltas(collection, rollup_deltas(left_behind, sign=-1))
+    await record_changes(ChangeAction.DELETE if permanent else ChangeAction.TRASH, requested_records)
+    return moved_count
+
+
+async def delete_for_good(collection: AsyncCollection, file_ids: List[ObjectId]) -> List[dict]:
+    """
+    Permanently delete records, releasing their blobs and usage.
+
+    The records are claimed first, so that deletions running at the same time in other
+    requests or workers never release the same record twice.
+
+    :return: The records deleted by this call
+    """
+    deletion_token = ObjectId()
+    await collection.update_many(
+        {"_id": {"$in": file_ids}, "deleting": {"$exists": False}},
+        {"$set": {"deleting": deletion_token}},
+    )
+    claimed_rows = await collection.find({"_id": {"$in": file_ids}, "deleting": deletion_token}).to_list()
+    if not claimed_rows:
+        return []
+
+    await collection.delete_many({"_id": {"$in": [file_row["_id"] for file_row in claimed_rows]}})
+    # Deduplicated blobs are reference counted, older records own their blob outright
+    await release_blobs(Counter(file_row["content_hash"] for file_row in claimed_rows if file_row.get("content_hash")))
+    await delete_blobs([
+        file_row["uri"] for file_row in claimed_rows
+        if file_row.get("uri") and not file_row.get("content_hash")
+    ])
+    await release_usage(claimed_rows)
+    return claimed_rows
+
+
+async def delete_owner_records(owner: EmailStr) -> int:
+    """
+    Permanently delete every drive and trash record of an owner, for an account that goes away.
+
+    Trash stamps aren't followed here, the records are swept by owner so that nothing the
+    user trashed on its own is left behind.
+
+    :return: The number of records deleted
+    """
+    deleted_count = 0
+    for collection in (mongo.files, mongo.trash):
+        owner_query = {"owner": owner, "deleting": {"$exists": False}}
+        while file_ids := [
+            file_row["_id"] async for file_row in collection.find(owner_query, {"_id": 1}).limit(TRASH_BATCH_SIZE)
+        ]:
+            deleted_count += len(await delete_for_good(collection, file_ids))
+    return deleted_count
+
+
+async def _move_batch_to_trash(
+    collection: AsyncCollection,
+    batch: List[dict],
+    permanent: bool
+) -> List[dict]:
+    """
+    :return: The records moved, without those another permanent deletion claimed first
+    """
+    if permanent:
+        return await delete_for_good(collection, [file_row["_id"] for file_row in batch])
+
+    time_trashed = int(datetime.now(timezone.utc).timestamp())
+    for file_row in batch:
+        file_row["time_trashed"] = time_trashed
+    await mongo.trash.insert_many(batch)
+    await collection.delete_many({"_id": {"$in": [file_row["_id"] for file_row in batch]}})
+    return batch
+
+
+def _split_name(name: str, is_folder: bool) -> Tuple[str, str]:
+    suffix = "" if is_folder else Path(name).suffix
+    return (name[:-len(suffix)], suffix) if suffix else (name, "")
+
+
+async def resolve_name_conflicts(entries: List[Tuple[str, str, bool]]) -> List[str]:
+    """
+    Pick a free name for every new entry, numbering the ones that are already taken.
+
+    :param entries: The (parent_id, name, is_folder) of the entries about to be added
+    :return: The names to use, in the same order
+    """
+    if not entries:
+        return []
+
+    # Look up the names and their numbered variants in every target folder at once
+    name_patterns = []
+    for parent_id, name, is_folder in set(entries):
+        stem, suffix = _split_name(name, is_folder)
+        name_pattern = f"^{re.escape(stem)}( \\(\\d+\\))?{re.escape(suffix)}$"
+        name_patterns.append({"parent_id": parent_id, "name": {"$regex": name_pattern}})
+    taken_names = {
+        (file_row["parent_id"], file_row["name"])
+        async for file_row in mongo.files.find({"$or": name_patterns}, {"parent_id": 1, "name": 1})
+    }
+
+    resolved_names = []
+    for parent_id, name, is_folder in entries:
+        stem, suffix = _split_name(name, is_folder)
+        candidate, copy_number = name, 0
+        while (parent_id, candidate) in taken_names:
+            copy_number += 1
+            candidate = f"{stem} ({copy_number}){suffix}"
+        taken_names.add((parent_id, candidate))
+        resolved_names.append(candidate)
+    return resolved_names
+
+
+async def load_owned_subtree(collection: AsyncCollection, file_ids: List[str], current_user: EmailStr) -> List[dict]:
+    """
+    Load the requested files and everything below them, checking that they all belong to current_user.
+    """
+    subtree = await collection.find(subtree_query(file_ids)).to_list()
+    if set(file_ids) - {str(file_row["_id"]) for file_row in subtree}:
+        raise HTTPException(status_code=404, detail="File not found")
+    if any(file_row["owner"] != current_user for file_row in subtree):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return subtree
+
+
+def _rebase_ancestors(old_ancestors: List[str], root_ancestors: Mapping[str, List[str]]) -> List[str]:
+    # Swap everything above the top level record for the top level record's new ancestors
+    root_index = next(index for index, ancestor_id in enumerate(old_ancestors) if ancestor_id in root_ancestors)
+    return [*root_ancestors[old_ancestors[root_index]], *old_ancestors[root_index:]]
+
+
+async def _insert_by_level(file_rows: List[dict], source_collection: AsyncCollection | None = None) -> None:
+    """
+    Insert a tree into files, parents before their children, in bulk.
+
+    :param source_collection: The collection the records are moved out of, if any
+    """
+    levels: Dict[int, List[dict]] = defaultdict(list)
+    for file_row in file_rows:
+        levels[len(file_row["ancestors"])].append(file_row)
+
+    for level in sorted(levels):
+        level_rows = levels[level]
+        for start in range(0, len(level_rows), TRASH_BATCH_SIZE):
+            batch = level_rows[start:start + TRASH_BATCH_SIZE]
+            await mongo.files.insert_many(batch)
+            if source_collection is not None:
+                await source_collection.delete_many({"_id": {"$in": [file_row["_id"] for file_row in batch]}})
+
+
+async def restore_files_from_trash(file_ids: List[str], current_user: EmailStr) -> List[dict]:
+    """
+    Move trashed files and their subtrees back into the drive.
+
+    Files whose parent folder is gone go back to the drive root, and names that were
+    taken in the meantime are numbered.
+
+    :return: The file_id, parent_id and name of every restored top level file
+    """
+    subtree = await load_owned_subtree(mongo.trash, file_ids, current_user)
+    requested_ids = set(file_ids)
+    root_stamps = {
+        str(file_row["_id"]): file_row.get("trash_root") for file_row in subtree if str(file_row["_id"]) in requested_ids
+    }
+    subtree = [file_row for file_row in subtree if in_trash_operation(file_row, root_stamps)]
+    subtree_ids = {str(file_row["_id"]) for file_row in subtree}
+    restored_roots = [file_row for file_row in subtree if file_row["parent_id"] not in subtree_ids]
+
+    # Parents that are still in the drive, the others fall back to the drive root
+    drive_root_id = (await get_user_record(current_user))["drive_root_id"]
+    parent_ids = {file_row["parent_id"] for file_row in restored_roots} | {drive_root_id}
+    parent_records = {
+        str(parent_row["_id"]): parent_row
+        async for parent_row in mongo.files.find(
+            {"_id": {"$in": [ObjectId(parent_id) for parent_id in parent_ids]}, "owner": current_user, "is_folder": True},
+            {"ancestors": 1},
+        )
+    }
+    for file_row in restored_roots:
+        if file_row["parent_id"] not in parent_records:
+            file_row["parent_id"] = drive_root_id
+
+    # Folders still in the trash lose the restored totals
+    await apply_rollup_deltas(mongo.trash, rollup_deltas(
+        [{**file_row, "ancestors": trashed_ancestors(file_row)} for file_row in restored_roots], sign=-1
+    ))
+
+    restored_names = await resolve_name_conflicts(
+        [(file_row["parent_id"], file_row["name"], file_row.get("is_folder", False)) for file_row in restored_roots]
+    )
+    root_ancestors = {}
+    for file_row, restored_name in zip(restored_roots, restored_names):
+        file_row["name"] = restored_name
+        file_row.update(search_name_fields(restored_name))
+        file_row["ancestors"] = get_child_ancestors(parent_records[file_row["parent_id"]])
+        root_ancestors[str(file_row["_id"])] = file_row["ancestors"]
+
+    # Rebase the descendants onto their restored root
+    for file_row in subtree:
+        file_row.pop("time_trashed", None)
+        file_row.pop("trash_root", None)
+        if str(file_row["_id"]) not in root_ancestors:
+            file_row["ancestors"] = _rebase_ancestors(file_row["ancestors"], root_ancestors)
+
+    await _insert_by_level(subtree, source_collection=mongo.trash)
+    await apply_rollup_deltas(mongo.files, rollup_deltas(restored_roots))
+    await record_changes(ChangeAction.RESTORE, restored_roots)
+
+    return [
+        {"file_id": str(file_row["_id"]), "parent_id": file_row["parent_id"], "name": file_row["name"]}
+        for file_row in restored_roots
+    ]
+
+
+async def copy_files(file_ids: List[str], parent_record: Mapping, current_user: EmailStr) -> List[dict]:
+    """
+    Copy files and their subtrees into a folder. The copies share the blobs of the originals.
+
+    :return: The file_id and name of every top level copy
+    """
+    subtree = await load_owned_subtree(mongo.files, file_ids, current_user)
+    subtree_ids = {str(file_row["_id"]) for file_row in subtree}
+    if subtree_ids.intersection(get_child_ancestors(parent_record)):
+        raise HTTPException(status_code=409, detail="Can't copy a folder into itself")
+
+    copied_files = [file_row for file_row in subtree if not file_row.get("is_folder", False)]
+    copied_size = sum(file_row.get("size") or 0 for file_row in copied_files)
+    check_quota(await get_remaining_quota(current_user), copied_size)
+
+    # Older records own their blob outright, register it so that it can be shared
+    for file_row in copied_files:
+        if file_row.get("uri") and not file_row.get("content_hash"):
+            content_hash = await hash_stored_blob(file_row["uri"])
+            file_uri = await link_blob(content_hash, file_row["uri"], file_row.get("size") or 0)
+            await mongo.files.update_one(
+                {"_id": file_row["_id"]}, {"$set": {"uri": file_uri, "content_hash": content_hash}}
+            )
+            file_row.update(uri=file_uri, content_hash=content_hash)
+
+    # Every copy gets a new id, the top level ones land in the new parent under a free name
+    new_ids = {file_id: ObjectId() for file_id in subtree_ids}
+    copied_roots = [file_row for file_row in subtree if file_row["parent_id"] not in subtree_ids]
+    copied_names = await resolve_name_conflicts([
+        (str(parent_record["_id"]), file_row["name"], file_row.get("is_folder", False)) for file_row in copied_roots
+    ])
+    root_ancestors = {}
+    for file_row, copied_name in zip(copied_roots, copied_names):
+        file_row["name"] = copied_name
+        file_row.update(search_name_fields(copied_name))
+        file_row["parent_id"] = str(parent_record["_id"])
+        file_row["ancestors"] = get_child_ancestors(parent_record)
+        root_ancestors[str(file_row["_id"])] = file_row["ancestors"]
+
+    last_modified = int(datetime.now(timezone.utc).timestamp())
+    for file_row in subtree:
+        old_id = str(file_row["_id"])
+        if old_id not in root_ancestors:
+            rebased_ancestors = _rebase_ancestors(file_row["ancestors"], root_ancestors)
+            file_row["ancestors"] = [str(new_ids.get(ancestor_id, ancestor_id)) for ancestor_id in rebased_ancestors]
+            file_row["parent_id"] = str(new_ids[file_row["parent_id"]])
+        file_row["_id"] = new_ids[old_id]
+        file_row["last_modified"] = last_modified
+
+    await add_blob_references(Counter(file_row["content_hash"] for file_row in copied_files if file_row.get("uri")))
+    await _insert_by_level(subtree)
+    await apply_rollup_deltas(mongo.files, rollup_deltas(copied_roots))
+    await add_usage(current_user, copied_size, len(copied_files))
+    await record_changes(ChangeAction.CREATE, copied_roots)
+
+    return [{"file_id": str(file_row["_id"]), "name": file_row["name"]} for file_row in copied_roots]
+
+
+def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single byte range.
+
+    :param range_header: The Range header value
+    :param file_size: The size of the requested file
+    :return: The (start, end) range with an exclusive end, or None to send the whole file
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        # Unsupported units and multiple ranges are answered with the whole file
+        return None
+
+    start_str, _, end_str = range_header[len("bytes="):].strip().partition("-")
+    if not (start_str or end_str) or not all(value.isdigit() for value in (start_str, end_str) if value):
+        return None
+    if start_str and end_str and int(end_str) < int(start_str):
+        # An invalid range is ignored like an unsupported one, only valid ranges past the end get a 416
+        return None
+
+    if start_str:
+        start = int(start_str)
+        end = min(int(end_str) + 1, file_size) if end_str else file_size
+    else:
+        start = max(file_size - int(end_str), 0)
+        end = file_size
+
+    if start >= file_size or start >= end:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"},
+        )
+    return start, end
+
+
+async def iter_zip_entries(file_records: List[Mapping]) -> AsyncIterator[ZipEntry]:
+    root_paths = {str(file_record["_id"]): Path(file_record["name"]) for file_record in file_records}
+    folder_ids = [str(file_record["_id"]) for file_record in file_records if file_record.get("is_folder", False)]
+
+    # Resolve every folder name below the requested folders with one query
+    folder_names = {}
+    if folder_ids:
+        folder_query = {"ancestors": {"$in": folder_ids}, "is_folder": True}
+        async for folder in mongo.files.find(folder_query, {"name": 1}):
+            folder_names[str(folder["_id"])] = folder["name"]
+
+    def resolve_path(file_record: Mapping) -> Path:
+        file_ancestors = file_record.get("ancestors", [])
+        root_index = next(index for index, ancestor in enumerate(file_ancestors) if ancestor in root_paths)
+        path = root_paths[file_ancestors[root_index]]
+        for ancestor in file_ancestors[root_index + 1:]:
+            path = path / folder_names[ancestor]
+        return path / file_record["name"]
+
+    async def iter_files():
+        for file_record in file_records:
+            if not file_record.get("is_folder", False):
+                yield root_paths[str(file_record["_id"])], file_record
+        if folder_ids:
+            file_query = {"ancestors": {"$in": folder_ids}, "is_folder": False}
+            file_projection = {"name": 1, "ancestors": 1, "uri": 1, "size": 1, "last_modified": 1, "type": 1}
+            async for file_record in mongo.files.find(file_query, file_projection):
+                yield resolve_path(file_record), file_record
 
-    # Load records from DB
-    deleted_record_ids: Set[str] = set()
-
-    # Delete records using DFS
-    while len(files_to_delete) > 0:
-        current_top = files_to_delete.pop(-1)
-        current_top_id = ObjectId(current_top)
-
-        # Push children to stack
-        find_children_query = {"parent_id": str(current_top_id)}
-        async for file_row in collection.find(find_children_query):
-            child_file_id = str(file_row["_id"])
-            if child_file_id not in deleted_record_ids:
-                files_to_delete.append(child_file_id)
-
-        # Delete current top from the collection
-        delete_response = await collection.find_one_and_delete({"_id": current_top_id})
-        if delete_response:
-            deleted_record_ids.add(str(current_top_id))
-
-            if permanent:
-                if file_uri := delete_response.get("uri"):
-                    try:
-                        await mongo.file_bucket.delete(ObjectId(file_uri))
-                    except NoFile:
-                        ...
-            else:
-                delete_response["time_trashed"] = int(datetime.now(timezone.utc).timestamp())
-                await mongo.trash.insert_one(delete_response)
+    async for file_path, file_record in iter_files():
+        # Files without uri are still being uploaded
+        if file_uri := file_record.get("uri"):
+            yield ZipEntry(
+                path=file_path.as_posix(),
+                chunks=file_storage.iter_chunks(file_uri),
+                size=file_record.get("size"),
+                last_modified=file_record.get("last_modified"),
+                compress=not is_precompressed(file_record.get("type")),
+            )
 
 
 def verify_deletion_request(param: DeleteFilesRequest):
@@ -0,0 +1,29 @@
+import io
+from typing import Dict
+from core.constants import PROFILE_VARIANT_SIZES
+
+PROFILE_VARIANT_FORMAT = "PNG"
+PROFILE_VARIANT_MEDIA_TYPE = "image/png"
+
+
+def create_profile_variants(image_data: bytes) -> Dict[int, bytes]:
+    """
+    Render square avatar variants of an uploaded profile picture.
+
+    :param image_data: The original image
+    :return: The encoded variant per edge length, empty if the upload isn't an image Pillow can read
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            image = ImageOps.exif_transpose(image).convert("RGBA")
+            variants = {}
+            for size in PROFILE_VARIANT_SIZES:
+                variant = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+                output = io.BytesIO()
+                variant.save(output, PROFILE_VARIANT_FORMAT, optimize=True)
+                variants[size] = output.getvalue()
+            return variants
+    except (UnidentifiedImageError, OSError, ValueError):
+        return {}
@@ -0,0 +1,229 @@
+import bisect
+import contextvars
+import time
+from typing import Callable, Dict, List, Tuple
+from pymongo.monitoring import CommandListener, CommandStartedEvent, CommandSucceededEvent, CommandFailedEvent
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Metrics are kept per worker in memory and rendered in the Prometheus text format
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+UNMATCHED_ROUTE = "unmatched"
+NO_ROUTE = "none"
+
+# The route template of the request being served, to attribute database commands to it
+current_route: contextvars.ContextVar[str] = contextvars.ContextVar("current_route", default=NO_ROUTE)
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], **extra: str) -> str:
+    pairs = [*zip(label_names, label_values), *extra.items()]
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[label_name]) for label_name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+        # Per label set: the count of each bucket (non-cumulative, +Inf last), and the sum
+        self.observations: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        if key not in self.observations:
+            self.observations[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        bucket_counts, total = self.observations[key]
+        bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, (bucket_counts, total) in self.observations.items():
+            cumulative = 0
+            for upper_bound, bucket_count in zip([*self.buckets, "+Inf"], bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.label_names, label_values, le=upper_bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {total[0]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """
+        :param collector: Called before every render, to refresh gauges read from elsewhere
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency, until the response body is sent", ("method", "route")
+)
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests being served", ("method", "route")
+)
+mongo_commands = registry.counter(
+    "mongo_commands_total", "MongoDB commands by collection and calling route", ("command", "collection", "route")
+)
+mongo_command_failures = registry.counter(
+    "mongo_command_failures_total", "Failed MongoDB commands", ("command", "collection", "route")
+)
+mongo_command_duration = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command", "collection", "route")
+)
+
+
+def resolve_route(scope: Scope) -> str:
+    # Label by the route template so that ids don't blow up the cardinality
+    partial_match = None
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial_match is None:
+            partial_match = route.path
+    return partial_match or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        route = resolve_route(scope)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        route_token = current_route.set(route)
+        http_requests_in_flight.inc(method=method, route=route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_duration.observe(time.perf_counter() - started, method=method, route=route)
+            http_requests_in_flight.dec(method=method, route=route)
+            http_requests.inc(method=method, route=route, status=status_code)
+            current_route.reset(route_token)
+
+
+class MongoCommandMetrics(CommandListener):
+    """
+    Counts and times every MongoDB command, per collection and per calling route.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple, Tuple[str, str]] = {}
+
+    @staticmethod
+    def _collection(event: CommandStartedEvent) -> str:
+        # Most commands name their collection as their first value, getMore has its own field
+        target = event.command.get("collection") if event.command_name == "getMore" else \
+            event.command.get(event.command_name)
+        return target if isinstance(target, str) else event.database_name
+
+    def started(self, event: CommandStartedEvent) -> None:
+        self._pending[(event.connection_id, event.request_id)] = (self._collection(event), current_route.get())
+
+    def _finish(self, event: CommandSucceededEvent | CommandFailedEvent, failed: bool) -> None:
+        collection, route = self._pending.pop((event.connection_id, event.request_id), ("unknown", NO_ROUTE))
+        labels = {"command": event.command_name, "collection": collection, "route": route}
+        mongo_commands.inc(**labels)
+        mongo_command_duration.observe(event.duration_micros / 1_000_000, **labels)
+        if failed:
+            mongo_command_failures.inc(**labels)
+
+    def succeeded(self, event: CommandSucceededEvent) -> None:
+        self._finish(event, failed=False)
+
+    def failed(self, event: CommandFailedEvent) -> None:
+        self._finish(event, failed=True)
+
+
+mongo_command_metrics = MongoCommandMetrics()
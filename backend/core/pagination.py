@@ -0,0 +1,95 @@
+import base64
+import binascii
+import json
+from typing import Any, Iterable, List, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING
+from pymongo.asynchronous.collection import AsyncCollection
+from models.drive_models import ListContentQuery, SortOrder
+
+
+def encode_cursor(sort_value: Any, record_id: ObjectId) -> str:
+    payload = json.dumps([sort_value, str(record_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, ObjectId]:
+    try:
+        sort_value, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_value, ObjectId(record_id)
+    except (binascii.Error, ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_query(sort_key: str, ascending: bool, cursor: str) -> dict:
+    # Records strictly after (sort_value, _id); null and missing values sort first
+    sort_value, record_id = decode_cursor(cursor)
+    id_after = {"$gt": record_id} if ascending else {"$lt": record_id}
+    if sort_value is None:
+        if ascending:
+            return {"$or": [{sort_key: None, "_id": id_after}, {sort_key: {"$ne": None}}]}
+        return {sort_key: None, "_id": id_after}
+
+    value_after = {"$gt": sort_value} if ascending else {"$lt": sort_value}
+    clauses = [{sort_key: value_after}, {sort_key: sort_value, "_id": id_after}]
+    if not ascending:
+        clauses.append({sort_key: None})
+    return {"$or": clauses}
+
+
+def build_projection(fields: List[str] | None, sort_key: str, allowed_fields: Iterable[str]) -> dict:
+    if not fields:
+        # Internal fields such as the search n-grams stay out of listings, the sort key builds the cursor
+        return {field: 1 for field in {*allowed_fields, sort_key}}
+
+    unknown_fields = set(fields) - set(allowed_fields)
+    if unknown_fields:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown_fields))}")
+
+    # The sort key is always needed to build the next cursor
+    return {field: 1 for field in {*fields, sort_key}}
+
+
+async def paginate(
+    collection: AsyncCollection,
+    query: dict,
+    param: ListContentQuery,
+    allowed_fields: Iterable[str],
+    sort_key: str | None = None,
+):
+    """
+    :param sort_key: The field to sort on instead of param.sort_by, such as an internal field
+        that an index keeps in order
+    """
+    allowed_fields = list(allowed_fields)
+    sort_key = sort_key or param.sort_by.value
+    ascending = param.order == SortOrder.ASC
+    direction = ASCENDING if ascending else DESCENDING
+
+    if param.cursor:
+        query = {"$and": [query, keyset_query(sort_key, ascending, param.cursor)]}
+    projection = build_projection(param.fields, sort_key, allowed_fields)
+
+    cursor = collection.find(query, projection).sort([(sort_key, direction), ("_id", direction)])
+    if param.limit:
+        # Fetch one extra record to know whether there is a next page
+        cursor = cursor.limit(param.limit + 1)
+
+    result = []
+    async for record in cursor:
+        result.append(record)
+
+    next_cursor = None
+    if param.limit and len(result) > param.limit:
+        result = result[:param.limit]
+        last_record = result[-1]
+        next_cursor = encode_cursor(last_record.get(sort_key), last_record["_id"])
+
+    for record in result:
+        record["_id"] = str(record["_id"])
+        if sort_key not in allowed_fields:
+            record.pop(sort_key, None)
+
+    return {"result": result, "next_cursor": next_cursor}
@@ -0,0 +1,101 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Mapping, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.asynchronous.collection import AsyncCollection
+
+# Folders hold the total size and number of items below them. Every write that adds or
+# removes records adds up what each affected folder gains or loses, then applies it
+# with one $inc per folder.
+
+
+def subtree_totals(record: Mapping) -> Tuple[int, int]:
+    """
+    :return: The size and item count a record adds to each of its ancestors
+    """
+    if record.get("is_folder", False):
+        return record.get("size") or 0, (record.get("item_count") or 0) + 1
+    return record.get("size") or 0, 1
+
+
+def top_level_records(records: Iterable[Mapping]) -> List[Mapping]:
+    # Records below another record of the same operation are already in its totals
+    records = list(records)
+    record_ids = {str(record["_id"]) for record in records}
+    return [record for record in records if not record_ids.intersection(record.get("ancestors", []))]
+
+
+def without_nested_totals(records: Iterable[Mapping]) -> List[dict]:
+    """
+    Take the totals of records below other records of the same operation out of those.
+
+    Used when records leave their ancestors, for example a folder moved together with one
+    of its own descendants: the descendant goes its own way and no longer adds to the folder.
+
+    :return: Copies of the records, their size and item_count without the nested records
+    """
+    records = sorted(records, key=lambda record: len(record.get("ancestors", [])), reverse=True)
+    totals = {str(record["_id"]): [record.get("size") or 0, record.get("item_count") or 0] for record in records}
+    # Deepest first, so that each record's totals are final before they leave its ancestors
+    for record in records:
+        size, item_count = totals[str(record["_id"])]
+        size, item_count = subtree_totals({**record, "size": size, "item_count": item_count})
+        for ancestor_id in record.get("ancestors", []):
+            if ancestor_id in totals:
+                totals[ancestor_id][0] -= size
+                totals[ancestor_id][1] -= item_count
+    return [
+        {**record, "size": totals[str(record["_id"])][0], "item_count": totals[str(record["_id"])][1]}
+        for record in records
+    ]
+
+
+def trashed_ancestors(record: Mapping) -> List[str]:
+    """
+    :return: The ancestors of a trashed record whose totals include it, the ones trashed along with it
+    """
+    ancestors = record.get("ancestors", [])
+    trash_root = record.get("trash_root")
+    if trash_root is None:
+        # Trashed before trash roots were stamped
+        return ancestors
+    if trash_root in ancestors:
+        return ancestors[ancestors.index(trash_root):]
+    return []
+
+
+def rollup_deltas(
+    records: Iterable[Mapping],
+    sign: int = 1,
+    deltas: Dict[str, List[int]] | None = None,
+) -> Dict[str, List[int]]:
+    """
+    Add up the change of every ancestor of the records.
+
+    :param records: Top level records being added or removed
+    :param sign: 1 when the records are added under their ancestors, -1 when removed
+    :param deltas: Deltas to add to, so that several changes go out in one write
+    :return: The [size, item_count] delta by folder id
+    """
+    if deltas is None:
+        deltas = defaultdict(lambda: [0, 0])
+    for record in records:
+        size, item_count = subtree_totals(record)
+        for ancestor_id in record.get("ancestors", []):
+            deltas[ancestor_id][0] += sign * size
+            deltas[ancestor_id][1] += sign * item_count
+    return deltas
+
+
+async def apply_rollup_deltas(collection: AsyncCollection, deltas: Dict[str, List[int]]) -> None:
+    # Pipeline updates, since folders created before rollups have a null size
+    updates = [
+        UpdateOne({"_id": ObjectId(folder_id)}, [{"$set": {
+            "size": {"$add": [{"$ifNull": ["$size", 0]}, size_delta]},
+            "item_count": {"$add": [{"$ifNull": ["$item_count", 0]}, item_count_delta]},
+        }}])
+        for folder_id, (size_delta, item_count_delta) in deltas.items()
+        if size_delta or item_count_delta
+    ]
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
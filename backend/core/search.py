@@ -0,0 +1,74 @@
+import re
+from typing import List
+from bson import ObjectId
+from pydantic import EmailStr
+from core.constants import SEARCH_GRAM_SIZE
+from core.database import mongo
+from models.drive_models import SearchQuery, SortField
+
+# Every files record carries its lowercased name and the distinct n-grams of it. Prefix
+# searches range over the (owner, name_lower, _id) index, substring searches narrow the
+# candidates with the (owner, name_grams) index and confirm them with a regex. Results by
+# name are sorted on name_lower, so that a page of a common substring walks the name_lower
+# index in order instead of sorting every match in memory.
+
+
+def name_grams(name_lower: str) -> List[str]:
+    gram_count = len(name_lower) - SEARCH_GRAM_SIZE + 1
+    return sorted({name_lower[index:index + SEARCH_GRAM_SIZE] for index in range(gram_count)})
+
+
+def search_name_fields(name: str) -> dict:
+    """
+    :return: The search fields to $set along with a new name
+    """
+    return {"name_lower": name.lower(), "name_grams": name_grams(name.lower())}
+
+
+def build_search_query(current_user: EmailStr, param: SearchQuery) -> dict:
+    # Drive roots have an empty parent_id and never show up in results
+    text = param.q.lower()
+    query = {"owner": current_user, "parent_id": {"$gt": ""}}
+    if param.prefix or len(text) < SEARCH_GRAM_SIZE:
+        # Too short to have n-grams, only prefixes can use an index
+        query["name_lower"] = {"$regex": f"^{re.escape(text)}"}
+    else:
+        query["name_grams"] = {"$all": name_grams(text)}
+        query["name_lower"] = {"$regex": re.escape(text)}
+
+    if param.type:
+        query["type"] = {"$regex": f"^{re.escape(param.type)}"} if param.type.endswith("/") else param.type
+    size_range = {
+        operator: bound for operator, bound in (("$gte", param.min_size), ("$lte", param.max_size))
+        if bound is not None
+    }
+    if size_range:
+        query["size"] = size_range
+    modified_range = {
+        operator: bound for operator, bound in (("$gte", param.modified_after), ("$lte", param.modified_before))
+        if bound is not None
+    }
+    if modified_range:
+        query["last_modified"] = modified_range
+    return query
+
+
+def search_sort_key(param: SearchQuery) -> str:
+    return "name_lower" if param.sort_by == SortField.NAME else param.sort_by.value
+
+
+async def attach_parent_paths(records: List[dict]) -> None:
+    """
+    Add the slash separated path of the folder holding each record, from the drive root.
+    """
+    ancestor_ids = {ancestor_id for record in records for ancestor_id in record.get("ancestors", [])}
+    folder_names = {
+        str(folder_row["_id"]): folder_row["name"]
+        async for folder_row in mongo.files.find(
+            {"_id": {"$in": [ObjectId(ancestor_id) for ancestor_id in ancestor_ids]}}, {"name": 1}
+        )
+    }
+    for record in records:
+        # The drive root itself is left out
+        folder_path = [folder_names.get(ancestor_id, "") for ancestor_id in record.get("ancestors", [])[1:]]
+        record["path"] = "/" + "/".join(folder_path)
@@ -1,3 +1,7 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import timedelta, datetime, UTC
 from typing import Optional
 from fastapi import Depends, HTTPException
@@ -5,15 +9,29 @@ from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorization
 from passlib.hash import sha256_crypt
 from jose import jwt, JWTError, ExpiredSignatureError
 from pydantic import EmailStr
-from core.constants import JWT_TOKEN_EXPIRATION, JWT_SECRET_KEY, JWT_ALGORITHM, JwtTokenScope
+from core.constants import JWT_TOKEN_EXPIRATION, JWT_SECRET_KEY, JWT_ALGORITHM, JwtTokenScope, \
+    PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_ADMISSION_TIMEOUT, \
+    TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL
+from core.cache import TTLCache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 bearer_scheme = HTTPBearer(auto_error=True)
 
+def _hash_password(password):
+    return sha256_crypt.hash(password)
+
+
+def _verify_password(password, hashed_password):
+    return sha256_crypt.verify(password, hashed_password)
+
+
 class SecurityManager:
     hasher = sha256_crypt
     jwt_key = JWT_SECRET_KEY
     jwt_algorithm = JWT_ALGORITHM
+    _hash_executor: Executor | None = None
+    _hash_admission: asyncio.Semaphore | None = None
+    token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
 
     def hash_password(self, password):
         return self.hasher.hash(password)
@@ -26,6 +44,56 @@ class SecurityManager:
         """
         return self.hasher.verify(password, hashed_password)
 
+    def start_hash_pool(self):
+        if self._hash_executor is not None:
+            return
+
+        # Made with the pool, so that every lifespan gets a semaphore of its own event loop
+        self._hash_admission = asyncio.Semaphore(PASSWORD_HASH_MAX_PENDING)
+        if PASSWORD_HASH_EXECUTOR == "thread":
+            self._hash_executor = ThreadPoolExecutor(PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+        else:
+            # Spawned workers don't inherit the event loop or open Mongo sockets
+            self._hash_executor = ProcessPoolExecutor(
+                PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def shutdown_hash_pool(self):
+        if self._hash_executor is not None:
+            self._hash_executor.shutdown(wait=False, cancel_futures=True)
+            self._hash_executor = None
+            self._hash_admission = None
+
+    async def _run_in_hash_pool(self, function, *args):
+        # Bound the queue so that a burst of logins can't hold every worker and the loop
+        self.start_hash_pool()
+        hash_admission = self._hash_admission
+        try:
+            await asyncio.wait_for(hash_admission.acquire(), PASSWORD_HASH_ADMISSION_TIMEOUT)
+        except TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many authentication requests, please try again",
+                headers={"Retry-After": "1"},
+            )
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._hash_executor, function, *args)
+        finally:
+            hash_admission.release()
+
+    async def hash_password_async(self, password):
+        return await self._run_in_hash_pool(_hash_password, password)
+
+    async def verify_password_async(self, password, hashed_password):
+        """
+        :param password: The password to verify
+        :param hashed_password: The password on file
+        :return: If the password is valid, checked in the hashing pool
+        """
+        return await self._run_in_hash_pool(_verify_password, password, hashed_password)
+
     def create_access_token(self, user_email: str, scope: str, ttl: Optional[timedelta] = None) -> str:
         expiration = datetime.now(UTC) + (ttl or timedelta(minutes=JWT_TOKEN_EXPIRATION))
         to_encode = {
@@ -37,17 +105,24 @@ class SecurityManager:
         return encoded_jwt
 
     def decode_access_token(self, token: str, require_scope: str) -> EmailStr:
-        try:
-            payload = jwt.decode(token, self.jwt_key, algorithms=[self.jwt_algorithm])
-            user_email = payload.get("sub")
-            scope = payload.get("scope")
-            if not user_email or scope != require_scope:
-                raise HTTPException(status_code=401, detail="Invalid token. Scope doesn't match")
-            return user_email
-        except ExpiredSignatureError:
-            raise HTTPException(status_code=401, detail="Invalid token. Token expired")
-        except JWTError:
-            raise HTTPException(status_code=401, detail="Invalid token. Decoding failed")
+        payload = self.token_cache.get(token)
+        if payload is None:
+            try:
+                payload = jwt.decode(token, self.jwt_key, algorithms=[self.jwt_algorithm])
+            except ExpiredSignatureError:
+                raise HTTPException(status_code=401, detail="Invalid token. Token expired")
+            except JWTError:
+                raise HTTPException(status_code=401, detail="Invalid token. Decoding failed")
+
+            # Only verified claims are cached, and never past their expiration
+            if expiration := payload.get("exp"):
+                self.token_cache.set(token, payload, ttl=expiration - time.time())
+
+        user_email = payload.get("sub")
+        scope = payload.get("scope")
+        if not user_email or scope != require_scope:
+            raise HTTPException(status_code=401, detail="Invalid token. Scope doesn't match")
+        return user_email
 
     def get_current_user(self, credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
         return self.decode_access_token(credentials.credentials, JwtTokenScope.auth)
@@ -0,0 +1,313 @@
+import asyncio
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from gridfs import AsyncGridFSBucket, NoFile
+from core.compression import decompress_chunks, storage_codec
+from core.constants import BUCKETS, STORAGE_BACKEND, STORAGE_LOCAL_ROOT, GRIDFS_CHUNK_SIZE
+from core.database import mongo
+
+# Blob bytes live in a storage engine. Uris name the engine that holds them, so blobs
+# written before a change of STORAGE_BACKEND stay readable: GridFS uris are bare
+# ObjectIds, local uris start with LOCAL_URI_PREFIX.
+
+GRIDFS_BACKEND = "gridfs"
+LOCAL_BACKEND = "local"
+LOCAL_URI_PREFIX = "local:"
+
+
+class StoredBlob:
+    def __init__(self, length: int, metadata: dict, path: Optional[Path] = None):
+        self.length = length
+        self.metadata = metadata
+        # Set when the blob is a plain file that can be sent without reading it in Python
+        self.path = path
+
+
+class BlobWriter(ABC):
+    @abstractmethod
+    async def write(self, chunk: bytes) -> None:
+        ...
+
+    @abstractmethod
+    async def commit(self, content_hash: str) -> str:
+        """
+        :param content_hash: The sha256 hex digest of the original content, already computed by the caller
+        :return: The uri of the written blob
+        """
+
+    @abstractmethod
+    async def abort(self) -> None:
+        ...
+
+
+class StorageEngine(ABC):
+    # Whether blobs may be stored compressed, plain files are served as they are
+    compresses = False
+
+    @abstractmethod
+    def owns(self, file_uri: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def open_writer(self, file_name: str, metadata: dict) -> BlobWriter:
+        ...
+
+    @abstractmethod
+    async def stat(self, file_uri: str) -> StoredBlob:
+        """
+        :raise FileNotFoundError: If there is no such blob
+        """
+
+    @abstractmethod
+    def iter_chunks(self, file_uri: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        :return: The original content from start up to the exclusive end
+        """
+
+    @abstractmethod
+    async def delete(self, file_uris: List[str]) -> None:
+        ...
+
+
+class GridFSWriter(BlobWriter):
+    def __init__(self, upload_stream):
+        self.upload_stream = upload_stream
+
+    async def write(self, chunk: bytes) -> None:
+        await self.upload_stream.write(chunk)
+
+    async def commit(self, content_hash: str) -> str:
+        await self.upload_stream.close()
+        return str(self.upload_stream._id)
+
+    async def abort(self) -> None:
+        await self.upload_stream.abort()
+
+
+class GridFSEngine(StorageEngine):
+    compresses = True
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+
+    @property
+    def bucket(self) -> AsyncGridFSBucket:
+        return mongo.bucket(self.bucket_name)
+
+    def owns(self, file_uri: str) -> bool:
+        return not file_uri.startswith(LOCAL_URI_PREFIX)
+
+    async def open_writer(self, file_name: str, metadata: dict) -> BlobWriter:
+        return GridFSWriter(self.bucket.open_upload_stream(file_name, metadata=metadata))
+
+    async def _open(self, file_uri: str):
+        try:
+            return await self.bucket.open_download_stream(ObjectId(file_uri))
+        except (NoFile, InvalidId):
+            raise FileNotFoundError(file_uri)
+
+    async def stat(self, file_uri: str) -> StoredBlob:
+        download_stream = await self._open(file_uri)
+        await download_stream.close()
+        return StoredBlob(download_stream.length, download_stream.metadata or {})
+
+    async def iter_chunks(self, file_uri: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        download_stream = await self._open(file_uri)
+        try:
+            codec = (download_stream.metadata or {}).get("codec")
+            if codec:
+                chunks = self._iter_decompressed(download_stream, codec, start, end)
+            else:
+                chunks = self._iter_range(download_stream, start, end)
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await download_stream.close()
+
+    @staticmethod
+    async def _iter_range(download_stream, start: int, end: Optional[int]) -> AsyncIterator[bytes]:
+        # Seeking makes the next read start at the chunk holding `start`
+        if start:
+            await download_stream.seek(start)
+        remaining = (end if end is not None else download_stream.length) - start
+        while remaining > 0 and (chunk := await download_stream.readchunk()):
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+
+    @staticmethod
+    async def _iter_decompressed(download_stream, codec: str, start: int, end: Optional[int]) -> AsyncIterator[bytes]:
+        # Compressed blobs can't seek, the bytes before the range are decompressed and skipped
+        async def read_chunks():
+            while chunk := await download_stream.readchunk():
+                yield chunk
+
+        position = 0
+        async for chunk in decompress_chunks(read_chunks(), codec):
+            chunk_start, position = position, position + len(chunk)
+            if position <= start:
+                continue
+            chunk = chunk[max(start - chunk_start, 0):]
+            if end is not None and position >= end:
+                yield chunk[:len(chunk) - (position - end)]
+                return
+            yield chunk
+
+    async def delete(self, file_uris: List[str]) -> None:
+        # Remove the GridFS file documents and all of their chunks in two round trips
+        object_ids = [ObjectId(file_uri) for file_uri in file_uris]
+        await mongo.database[f"{self.bucket_name}.files"].delete_many({"_id": {"$in": object_ids}})
+        await mongo.database[f"{self.bucket_name}.chunks"].delete_many({"files_id": {"$in": object_ids}})
+
+
+class LocalWriter(BlobWriter):
+    def __init__(self, engine: "LocalEngine"):
+        self.engine = engine
+        self.upload_id = str(ObjectId())
+        self.temporary_path = engine.root / "tmp" / self.upload_id
+        self.handle = None
+
+    async def open(self) -> None:
+        self.temporary_path.parent.mkdir(parents=True, exist_ok=True)
+        self.handle = await asyncio.to_thread(open, self.temporary_path, "wb")
+
+    async def write(self, chunk: bytes) -> None:
+        await asyncio.to_thread(self.handle.write, chunk)
+
+    async def commit(self, content_hash: str) -> str:
+        await asyncio.to_thread(self.handle.close)
+        # The upload id keeps a blob being deleted and an identical new one apart
+        relative_path = f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}-{self.upload_id}"
+        final_path = self.engine.root / relative_path
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(os.replace, self.temporary_path, final_path)
+        return LOCAL_URI_PREFIX + relative_path
+
+    async def abort(self) -> None:
+        await asyncio.to_thread(self.handle.close)
+        self.temporary_path.unlink(missing_ok=True)
+
+
+class LocalEngine(StorageEngine):
+    """
+    Blobs as plain files below a root directory, named after the hash of their content.
+    They are stored uncompressed so that downloads can be sent straight from disk.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def owns(self, file_uri: str) -> bool:
+        return file_uri.startswith(LOCAL_URI_PREFIX)
+
+    def path(self, file_uri: str) -> Path:
+        relative_path = Path(file_uri[len(LOCAL_URI_PREFIX):])
+        if relative_path.is_absolute() or ".." in relative_path.parts:
+            raise FileNotFoundError(file_uri)
+        return self.root / relative_path
+
+    async def open_writer(self, file_name: str, metadata: dict) -> BlobWriter:
+        writer = LocalWriter(self)
+        await writer.open()
+        return writer
+
+    async def stat(self, file_uri: str) -> StoredBlob:
+        file_path = self.path(file_uri)
+        stat_result = await asyncio.to_thread(os.stat, file_path)
+        return StoredBlob(stat_result.st_size, {}, file_path)
+
+    async def iter_chunks(self, file_uri: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        handle = await asyncio.to_thread(open, self.path(file_uri), "rb")
+        try:
+            if start:
+                await asyncio.to_thread(handle.seek, start)
+            remaining = end - start if end is not None else None
+            while remaining is None or remaining > 0:
+                read_size = GRIDFS_CHUNK_SIZE if remaining is None else min(GRIDFS_CHUNK_SIZE, remaining)
+                chunk = await asyncio.to_thread(handle.read, read_size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            await asyncio.to_thread(handle.close)
+
+    async def delete(self, file_uris: List[str]) -> None:
+        def unlink_all():
+            for file_uri in file_uris:
+                self.path(file_uri).unlink(missing_ok=True)
+
+        await asyncio.to_thread(unlink_all)
+
+
+class BlobStorage:
+    """
+    Writes go to the configured engine, everything else to the engine named by the uri.
+    """
+
+    def __init__(self, engines: Dict[str, StorageEngine], default_backend: str):
+        if default_backend not in engines:
+            raise ValueError(f"Unknown storage backend {default_backend}")
+        self.engines = engines
+        self.default_engine = engines[default_backend]
+
+    def engine_for(self, file_uri: str) -> StorageEngine:
+        return next(engine for engine in self.engines.values() if engine.owns(file_uri))
+
+    def storage_codec(self, mime_type: str | None) -> str | None:
+        return storage_codec(mime_type) if self.default_engine.compresses else None
+
+    async def open_writer(self, file_name: str, metadata: dict) -> BlobWriter:
+        return await self.default_engine.open_writer(file_name, metadata)
+
+    async def write(self, data: bytes, file_name: str, metadata: dict) -> str:
+        """
+        Store a blob held in memory as is.
+
+        :return: Its uri
+        """
+        writer = await self.open_writer(file_name, metadata)
+        try:
+            await writer.write(data)
+        except BaseException:
+            await writer.abort()
+            raise
+        return await writer.commit(hashlib.sha256(data).hexdigest())
+
+    async def stat(self, file_uri: str) -> StoredBlob:
+        return await self.engine_for(file_uri).stat(file_uri)
+
+    def iter_chunks(self, file_uri: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        return self.engine_for(file_uri).iter_chunks(file_uri, start, end)
+
+    async def read(self, file_uri: str) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_chunks(file_uri)])
+
+    def local_path(self, file_uri: str) -> Optional[Path]:
+        engine = self.engine_for(file_uri)
+        return engine.path(file_uri) if isinstance(engine, LocalEngine) else None
+
+    async def delete(self, file_uris: List[str]) -> None:
+        for engine in self.engines.values():
+            if owned_uris := [file_uri for file_uri in file_uris if engine.owns(file_uri)]:
+                await engine.delete(owned_uris)
+
+
+def create_storage(bucket_name: str) -> BlobStorage:
+    return BlobStorage(
+        {
+            GRIDFS_BACKEND: GridFSEngine(bucket_name),
+            LOCAL_BACKEND: LocalEngine(STORAGE_LOCAL_ROOT / bucket_name),
+        },
+        STORAGE_BACKEND,
+    )
+
+
+file_storage = create_storage(BUCKETS.FILE_STORAGE.name)
+profile_storage = create_storage(BUCKETS.PROFILE_PICTURES.name)
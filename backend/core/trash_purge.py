@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from core.constants import TRASH_RETENTION, TRASH_PURGE_INTERVAL, TRASH_PURGE_MIN_BATCH, TRASH_PURGE_MAX_BATCH, \
+    TRASH_PURGE_TARGET_BATCH_TIME, TRASH_PURGE_DUTY_CYCLE, UPLOAD_SESSION_EXPIRATION
+from core.changes import record_changes
+from core.database import mongo
+from core.file_utils import delete_for_good
+from core.rollups import rollup_deltas, apply_rollup_deltas, top_level_records, trashed_ancestors
+from core.upload_sessions import abort_upload_session
+from models.drive_models import ChangeAction
+
+logger = logging.getLogger(__name__)
+
+
+class TrashPurgeWorker:
+    """
+    Permanently deletes trash older than the retention period, and expired upload sessions.
+
+    Batches grow while they finish under the target time and shrink when they don't, and
+    the worker sleeps between batches so that it only holds a share of the database time.
+    """
+
+    def __init__(self):
+        self.batch_size = TRASH_PURGE_MIN_BATCH
+        self.purged_files = 0
+        self.purged_sessions = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_sweep_started = None
+        self.last_sweep_finished = None
+        self._stop: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # The current batch is allowed to finish so no subtree is left half purged
+        if self._task is None:
+            return
+        self._stop.set()
+        await self._task
+        self._task = None
+
+    async def _sleep(self, seconds: float) -> bool:
+        """
+        :return: Whether the worker was asked to stop while sleeping
+        """
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await self.sweep()
+            except Exception:
+                self.errors += 1
+                logger.exception("Trash purge sweep failed")
+            if await self._sleep(TRASH_PURGE_INTERVAL):
+                break
+
+    @property
+    def _stopping(self) -> bool:
+        return self._stop is not None and self._stop.is_set()
+
+    async def sweep(self) -> None:
+        self.last_sweep_started = int(datetime.now(timezone.utc).timestamp())
+        await self.purge_expired_sessions()
+        while not self._stopping:
+            started = time.monotonic()
+            purged_count = await self.purge_batch()
+            if not purged_count:
+                break
+            elapsed = time.monotonic() - started
+            self._adapt_batch_size(elapsed)
+            if self._stop and await self._sleep(elapsed * (1 - TRASH_PURGE_DUTY_CYCLE) / TRASH_PURGE_DUTY_CYCLE):
+                break
+        self.last_sweep_finished = int(datetime.now(timezone.utc).timestamp())
+        logger.info("Trash purge sweep done, %d files purged so far", self.purged_files)
+
+    async def purge_batch(self) -> int:
+        """
+        Permanently delete one batch of expired trash.
+
+        Subtrees aren't expanded, everything trashed together shares its time_trashed and
+        expires with it, so a batch is never larger than batch_size.
+
+        :return: The number of expired records picked for this batch
+        """
+        cutoff = int(datetime.now(timezone.utc).timestamp()) - TRASH_RETENTION
+        expired_query = {"time_trashed": {"$lt": cutoff}, "deleting": {"$exists": False}}
+        expired_rows = mongo.trash.find(expired_query, {"_id": 1}).sort("time_trashed", 1).limit(self.batch_size)
+        expired_ids = [file_row["_id"] async for file_row in expired_rows]
+        if not expired_ids:
+            return 0
+
+        purged_rows = await delete_for_good(mongo.trash, expired_ids)
+        # Records of a trash operation split across batches leave the folders still in the trash
+        purged_roots = top_level_records(purged_rows)
+        await apply_rollup_deltas(mongo.trash, rollup_deltas(
+            [{**file_row, "ancestors": trashed_ancestors(file_row)} for file_row in purged_roots], sign=-1
+        ))
+        await record_changes(ChangeAction.DELETE, purged_roots)
+        self.purged_files += len(purged_rows)
+        self.batches += 1
+        return len(expired_ids)
+
+    async def purge_expired_sessions(self) -> None:
+        cutoff = int(datetime.now(timezone.utc).timestamp()) - UPLOAD_SESSION_EXPIRATION
+        expired_query = {"created_at": {"$lt": cutoff}}
+        async for session_record in mongo.upload_sessions.find(expired_query, {"uri": 1, "part_attempts": 1}):
+            if self._stopping:
+                return
+            await abort_upload_session(session_record)
+            self.purged_sessions += 1
+
+    def _adapt_batch_size(self, elapsed: float) -> None:
+        if elapsed > TRASH_PURGE_TARGET_BATCH_TIME:
+            self.batch_size = max(TRASH_PURGE_MIN_BATCH, self.batch_size // 2)
+        else:
+            self.batch_size = min(TRASH_PURGE_MAX_BATCH, self.batch_size * 2)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "batch_size": self.batch_size,
+            "batches": self.batches,
+            "purged_files": self.purged_files,
+            "purged_sessions": self.purged_sessions,
+            "errors": self.errors,
+            "last_sweep_started": self.last_sweep_started,
+            "last_sweep_finished": self.last_sweep_finished,
+        }
+
+
+trash_purge_worker = TrashPurgeWorker()
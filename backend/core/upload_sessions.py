@@ -0,0 +1,193 @@
+import math
+from datetime import datetime, timezone
+from typing import AsyncIterator, Mapping
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pydantic import EmailStr
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.blob_store import link_blob, release_blobs, hash_stored_blob
+from core.constants import GRIDFS_CHUNK_SIZE, UPLOAD_PART_CHUNKS, UPLOAD_PART_SIZE, UPLOAD_SESSION_EXPIRATION
+from core.changes import record_changes
+from core.database import mongo
+from core.rollups import rollup_deltas, apply_rollup_deltas
+from core.usage import get_remaining_quota, check_quota, add_usage
+from core.file_utils import get_mime_type, get_child_ancestors
+from models.db_models import UploadSessionModel, DriveModel
+from models.drive_models import ChangeAction
+
+
+async def create_upload_session(parent_record: Mapping, file_name: str, size: int, current_user: EmailStr):
+    # Fail early on name conflicts, the unique index still guards completion
+    if await mongo.files.find_one({"parent_id": str(parent_record["_id"]), "name": file_name}, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="File of the same name already exists")
+
+    new_session = UploadSessionModel(
+        owner=current_user,
+        parent_id=str(parent_record["_id"]),
+        name=file_name,
+        type=get_mime_type(file_name),
+        size=size,
+        part_size=UPLOAD_PART_SIZE,
+        part_count=max(1, math.ceil(size / UPLOAD_PART_SIZE)),
+        uri=str(ObjectId()),
+        created_at=int(datetime.now(timezone.utc).timestamp()),
+    )
+    insertion_result = await mongo.upload_sessions.insert_one(new_session.__dict__)
+    return str(insertion_result.inserted_id), new_session
+
+
+async def get_upload_session(session_id: str, current_user: EmailStr) -> Mapping:
+    try:
+        session_record = await mongo.upload_sessions.find_one({"_id": ObjectId(session_id)})
+    except InvalidId:
+        session_record = None
+    if session_record is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if session_record["owner"] != current_user:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    expires_at = session_record["created_at"] + UPLOAD_SESSION_EXPIRATION
+    if expires_at < datetime.now(timezone.utc).timestamp():
+        await abort_upload_session(session_record)
+        raise HTTPException(status_code=404, detail="Upload session expired")
+
+    return session_record
+
+
+def expected_part_size(session_record: Mapping, part_number: int) -> int:
+    if part_number < 0 or part_number >= session_record["part_count"]:
+        raise HTTPException(status_code=400, detail="Part number out of range")
+    if part_number < session_record["part_count"] - 1:
+        return session_record["part_size"]
+    return session_record["size"] - session_record["part_size"] * (session_record["part_count"] - 1)
+
+
+async def write_upload_part(session_record: Mapping, part_number: int, stream: AsyncIterator[bytes]):
+    expected_size = expected_part_size(session_record, part_number)
+    # Every attempt writes its chunks under an id of its own, so concurrent retries of a
+    # part never touch each other's chunks. The one recorded last wins.
+    attempt_id = ObjectId()
+
+    chunk_number = part_number * UPLOAD_PART_CHUNKS
+    buffer = bytearray()
+    received_size = 0
+    try:
+        async for data in stream:
+            received_size += len(data)
+            if received_size > expected_size:
+                raise HTTPException(status_code=400, detail="Part is larger than expected")
+            buffer.extend(data)
+
+            # Write full GridFS chunks as soon as they are available
+            while len(buffer) >= GRIDFS_CHUNK_SIZE:
+                await mongo.file_bucket_chunks.insert_one(
+                    {"files_id": attempt_id, "n": chunk_number, "data": bytes(buffer[:GRIDFS_CHUNK_SIZE])}
+                )
+                del buffer[:GRIDFS_CHUNK_SIZE]
+                chunk_number += 1
+
+        if received_size != expected_size:
+            raise HTTPException(status_code=400, detail="Part is smaller than expected")
+        if buffer:
+            await mongo.file_bucket_chunks.insert_one({"files_id": attempt_id, "n": chunk_number, "data": bytes(buffer)})
+    except BaseException:
+        await mongo.file_bucket_chunks.delete_many({"files_id": attempt_id})
+        raise
+
+    # Swap the attempt in with one update, then drop the chunks it replaced
+    previous_record = await mongo.upload_sessions.find_one_and_update(
+        {"_id": session_record["_id"], "completing": {"$exists": False}},
+        {"$set": {f"parts.{part_number}": received_size, f"part_attempts.{part_number}": attempt_id}},
+        projection={f"part_attempts.{part_number}": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if previous_record is None:
+        # The session is being completed, or it was completed or aborted meanwhile
+        await mongo.file_bucket_chunks.delete_many({"files_id": attempt_id})
+        raise HTTPException(status_code=409, detail="Upload session no longer accepts parts")
+
+    if (replaced_attempt := previous_record.get("part_attempts", {}).get(str(part_number))) is not None:
+        await mongo.file_bucket_chunks.delete_many({"files_id": replaced_attempt})
+    return received_size
+
+
+def missing_parts(session_record: Mapping):
+    return [
+        part_number for part_number in range(session_record["part_count"])
+        if str(part_number) not in session_record["parts"]
+    ]
+
+
+async def complete_upload_session(session_record: Mapping, parent_record: Mapping):
+    if missing := missing_parts(session_record):
+        raise HTTPException(status_code=409, detail=f"Missing parts: {missing}")
+    check_quota(await get_remaining_quota(session_record["owner"]), session_record["size"])
+
+    # Claim the session, so that a concurrent completion or part retry leaves it alone. The
+    # claimed record holds the attempts recorded last.
+    session_record = await mongo.upload_sessions.find_one_and_update(
+        {"_id": session_record["_id"], "completing": {"$exists": False}},
+        {"$set": {"completing": True}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if session_record is None:
+        raise HTTPException(status_code=409, detail="Upload session is already being completed")
+
+    # Stitch the chunks together: the recorded attempts become chunks of the file, then the
+    # GridFS file document is written
+    try:
+        if attempt_ids := list(session_record.get("part_attempts", {}).values()):
+            await mongo.file_bucket_chunks.update_many(
+                {"files_id": {"$in": attempt_ids}}, {"$set": {"files_id": ObjectId(session_record["uri"])}}
+            )
+        await mongo.file_bucket_files.insert_one({
+            "_id": ObjectId(session_record["uri"]),
+            "length": session_record["size"],
+            "chunkSize": GRIDFS_CHUNK_SIZE,
+            "uploadDate": datetime.now(timezone.utc),
+            "filename": session_record["name"],
+            "metadata": {"contentType": session_record["type"]},
+        })
+    except BaseException:
+        # Nothing links to the file yet, the completion can be retried
+        await mongo.upload_sessions.update_one({"_id": session_record["_id"]}, {"$unset": {"completing": ""}})
+        raise
+
+    # Parts arrive out of order, so the content is hashed once it is complete
+    content_hash = await hash_stored_blob(session_record["uri"])
+    file_uri = await link_blob(content_hash, session_record["uri"], session_record["size"])
+
+    # The drive record only appears once every part is in place
+    new_record = DriveModel(
+        parent_id=session_record["parent_id"],
+        ancestors=get_child_ancestors(parent_record),
+        is_folder=False,
+        name=session_record["name"],
+        type=session_record["type"],
+        owner=session_record["owner"],
+        uri=file_uri,
+        content_hash=content_hash,
+        size=session_record["size"],
+        last_modified=int(datetime.now(timezone.utc).timestamp()),
+    )
+    try:
+        inserted_record = await mongo.files.insert_one(new_record.__dict__)
+    except DuplicateKeyError:
+        await release_blobs({content_hash: 1})
+        await mongo.upload_sessions.delete_one({"_id": session_record["_id"]})
+        raise HTTPException(status_code=400, detail="File of the same name already exists")
+
+    await mongo.upload_sessions.delete_one({"_id": session_record["_id"]})
+    await apply_rollup_deltas(mongo.files, rollup_deltas([new_record.__dict__]))
+    await add_usage(session_record["owner"], session_record["size"], 1)
+    await record_changes(ChangeAction.CREATE, [{**new_record.__dict__, "_id": inserted_record.inserted_id}])
+    return inserted_record.inserted_id, file_uri
+
+
+async def abort_upload_session(session_record: Mapping):
+    file_ids = [ObjectId(session_record["uri"]), *session_record.get("part_attempts", {}).values()]
+    await mongo.file_bucket_chunks.delete_many({"files_id": {"$in": file_ids}})
+    await mongo.upload_sessions.delete_one({"_id": session_record["_id"]})
@@ -0,0 +1,49 @@
+from collections import defaultdict
+from typing import AsyncIterator, Iterable, Mapping
+from fastapi import HTTPException
+from pydantic import EmailStr
+from core.auth_utils import get_user_record, invalidate_user_record
+from core.constants import USER_STORAGE_QUOTA
+from core.database import mongo
+
+
+async def get_remaining_quota(current_user: EmailStr) -> int:
+    user_record = await get_user_record(current_user)
+    if not user_record:
+        raise HTTPException(status_code=404, detail="User not found")
+    return USER_STORAGE_QUOTA - user_record.get("bytes_used", 0)
+
+
+def check_quota(remaining_quota: int, incoming_size: int | None) -> None:
+    if incoming_size is not None and incoming_size > remaining_quota:
+        raise HTTPException(status_code=413, detail="Storage quota exceeded")
+
+
+async def enforce_quota(stream: AsyncIterator[bytes], remaining_quota: int) -> AsyncIterator[bytes]:
+    # Stop reading the request as soon as the upload no longer fits
+    received_size = 0
+    async for chunk in stream:
+        received_size += len(chunk)
+        check_quota(remaining_quota, received_size)
+        yield chunk
+
+
+async def add_usage(owner: EmailStr, bytes_delta: int, file_count_delta: int) -> None:
+    await mongo.users.update_one(
+        {"email": owner},
+        {"$inc": {"bytes_used": bytes_delta, "file_count": file_count_delta}},
+    )
+    invalidate_user_record(owner)
+
+
+async def release_usage(file_records: Iterable[Mapping]) -> None:
+    # One $inc per owner for a batch of permanently deleted records
+    usage_by_owner = defaultdict(lambda: [0, 0])
+    for file_record in file_records:
+        if file_record.get("is_folder", False):
+            continue
+        usage_by_owner[file_record["owner"]][0] += file_record.get("size") or 0
+        usage_by_owner[file_record["owner"]][1] += 1
+
+    for owner, (bytes_released, files_released) in usage_by_owner.items():
+        await add_usage(owner, -bytes_released, -files_released)
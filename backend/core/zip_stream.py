@@ -0,0 +1,237 @@
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator, List, Optional
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# Entries that may grow past this size are written in ZIP64 format
+ZIP64_THRESHOLD = 0xFFFFFFFF - (1 << 24)
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP_ENTRY_LIMIT = 0xFFFF
+
+FLAG_DATA_DESCRIPTOR = 0x0008
+FLAG_UTF8 = 0x0800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+VERSION_MADE_BY = (3 << 8) | VERSION_ZIP64  # Unix
+FILE_ATTRIBUTES = 0o100644 << 16
+
+
+@dataclass
+class ZipEntry:
+    path: str
+    chunks: AsyncIterator[bytes]
+    size: Optional[int] = None
+    last_modified: Optional[int] = None
+    compress: bool = True
+
+
+@dataclass
+class _CentralRecord:
+    name: bytes
+    method: int
+    dos_time: int
+    dos_date: int
+    crc: int
+    compressed_size: int
+    uncompressed_size: int
+    offset: int
+    zip64: bool
+
+
+def _dos_timestamp(timestamp: Optional[int]):
+    local = time.localtime(timestamp if timestamp is not None else time.time())
+    year = max(local.tm_year, 1980)
+    dos_date = ((year - 1980) << 9) | (local.tm_mon << 5) | local.tm_mday
+    dos_time = (local.tm_hour << 11) | (local.tm_min << 5) | (local.tm_sec // 2)
+    return dos_time, dos_date
+
+
+def _local_header(record: _CentralRecord) -> bytes:
+    if record.zip64:
+        # Sizes are unknown up front, they are written in the data descriptor
+        extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+        sizes = (ZIP32_LIMIT, ZIP32_LIMIT)
+        version = VERSION_ZIP64
+    else:
+        extra = b""
+        sizes = (0, 0)
+        version = VERSION_DEFAULT
+
+    header = struct.pack(
+        "<IHHHHHIIIHH",
+        0x04034b50,
+        version,
+        FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+        record.method,
+        record.dos_time,
+        record.dos_date,
+        0,
+        *sizes,
+        len(record.name),
+        len(extra),
+    )
+    return header + record.name + extra
+
+
+def _data_descriptor(record: _CentralRecord) -> bytes:
+    if record.zip64:
+        return struct.pack(
+            "<IIQQ", 0x08074b50, record.crc, record.compressed_size, record.uncompressed_size
+        )
+    return struct.pack(
+        "<IIII", 0x08074b50, record.crc, record.compressed_size, record.uncompressed_size
+    )
+
+
+def _central_header(record: _CentralRecord) -> bytes:
+    # Only the fields that overflow go into the ZIP64 extra field, in spec order
+    zip64_fields = []
+    uncompressed_size = record.uncompressed_size
+    compressed_size = record.compressed_size
+    offset = record.offset
+    if uncompressed_size >= ZIP32_LIMIT:
+        zip64_fields.append(uncompressed_size)
+        uncompressed_size = ZIP32_LIMIT
+    if compressed_size >= ZIP32_LIMIT:
+        zip64_fields.append(compressed_size)
+        compressed_size = ZIP32_LIMIT
+    if offset >= ZIP32_LIMIT:
+        zip64_fields.append(offset)
+        offset = ZIP32_LIMIT
+
+    extra = b""
+    if zip64_fields:
+        extra = struct.pack(f"<HH{len(zip64_fields)}Q", 0x0001, 8 * len(zip64_fields), *zip64_fields)
+    version = VERSION_ZIP64 if record.zip64 or zip64_fields else VERSION_DEFAULT
+
+    header = struct.pack(
+        "<IHHHHHHIIIHHHHHII",
+        0x02014b50,
+        VERSION_MADE_BY,
+        version,
+        FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+        record.method,
+        record.dos_time,
+        record.dos_date,
+        record.crc,
+        compressed_size,
+        uncompressed_size,
+        len(record.name),
+        len(extra),
+        0,
+        0,
+        0,
+        FILE_ATTRIBUTES,
+        offset,
+    )
+    return header + record.name + extra
+
+
+def _end_of_central_directory(entry_count: int, directory_offset: int, directory_size: int) -> bytes:
+    output = b""
+    needs_zip64 = (
+        entry_count >= ZIP_ENTRY_LIMIT
+        or directory_offset >= ZIP32_LIMIT
+        or directory_size >= ZIP32_LIMIT
+    )
+    if needs_zip64:
+        zip64_end_offset = directory_offset + directory_size
+        output += struct.pack(
+            "<IQHHIIQQQQ",
+            0x06064b50,
+            44,
+            VERSION_MADE_BY,
+            VERSION_ZIP64,
+            0,
+            0,
+            entry_count,
+            entry_count,
+            directory_size,
+            directory_offset,
+        )
+        output += struct.pack("<IIQI", 0x07064b50, 0, zip64_end_offset, 1)
+
+    output += struct.pack(
+        "<IHHHHIIH",
+        0x06054b50,
+        0,
+        0,
+        min(entry_count, ZIP_ENTRY_LIMIT),
+        min(entry_count, ZIP_ENTRY_LIMIT),
+        min(directory_size, ZIP32_LIMIT),
+        min(directory_offset, ZIP32_LIMIT),
+        0,
+    )
+    return output
+
+
+async def stream_zip(entries: AsyncIterable[ZipEntry]) -> AsyncIterator[bytes]:
+    """
+    Write a zip archive incrementally.
+
+    Each entry is written with a local header, its (optionally deflated) data and a
+    trailing data descriptor, so nothing but the central directory needs to be kept
+    in memory.
+
+    :param entries: The entries to write, consumed lazily
+    :return: An async generator of archive bytes
+    """
+    central_records: List[_CentralRecord] = []
+    offset = 0
+
+    async for entry in entries:
+        dos_time, dos_date = _dos_timestamp(entry.last_modified)
+        record = _CentralRecord(
+            name=entry.path.encode("utf-8"),
+            method=ZIP_DEFLATED if entry.compress else ZIP_STORED,
+            dos_time=dos_time,
+            dos_date=dos_date,
+            crc=0,
+            compressed_size=0,
+            uncompressed_size=0,
+            offset=offset,
+            zip64=entry.size is None or entry.size >= ZIP64_THRESHOLD,
+        )
+
+        header = _local_header(record)
+        offset += len(header)
+        yield header
+
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15) if entry.compress else None
+        async for chunk in entry.chunks:
+            if not chunk:
+                continue
+            record.crc = zlib.crc32(chunk, record.crc)
+            record.uncompressed_size += len(chunk)
+            output = compressor.compress(chunk) if compressor else chunk
+            if output:
+                record.compressed_size += len(output)
+                offset += len(output)
+                yield output
+
+        if compressor:
+            output = compressor.flush()
+            record.compressed_size += len(output)
+            offset += len(output)
+            yield output
+
+        if not record.zip64 and max(record.compressed_size, record.uncompressed_size) >= ZIP32_LIMIT:
+            raise ValueError(f"Entry {entry.path} exceeded its declared size")
+
+        descriptor = _data_descriptor(record)
+        offset += len(descriptor)
+        yield descriptor
+        central_records.append(record)
+
+    directory_offset = offset
+    directory_size = 0
+    for record in central_records:
+        header = _central_header(record)
+        directory_size += len(header)
+        yield header
+
+    yield _end_of_central_directory(len(central_records), directory_offset, directory_size)
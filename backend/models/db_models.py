@@ -1,4 +1,6 @@
-from pydantic import BaseModel, EmailStr, Field
+from typing import Any, Dict, List
+from pydantic import BaseModel, EmailStr, Field, model_validator
+from core.search import name_grams
 
 
 class UserModel(BaseModel):
@@ -7,16 +9,46 @@ class UserModel(BaseModel):
     password: str = Field(default=None, description="Password")
     drive_root_id: str = Field(default=None, description="Drive root folder ID")
     profile_image_id: str | None = Field(default=None, description="Profile image id")
+    profile_image_type: str | None = Field(default=None, description="Media type of the profile image")
+    profile_variants: Dict[str, str] = Field(default_factory=dict, description="Resized profile image ids by size")
     is_google_account: bool = Field(default=False, description="Is Google account")
     google_profile_url: str | None = Field(default=None, description="Google profile url")
+    bytes_used: int = Field(default=0, description="Bytes used by files and trash")
+    file_count: int = Field(default=0, description="Number of files in files and trash")
 
 
 class DriveModel(BaseModel):
     parent_id: str = Field(default=None, description="Parent ID")
+    ancestors: List[str] = Field(default_factory=list, description="Ancestor folder IDs, starting from the drive root")
     owner: EmailStr = Field(default=EmailStr, description="Owner")
     name: str = Field(default=None, description="File name")
     is_folder: bool = Field(default=False, description="Is folder")
     uri: str | None = Field(default=None, description="File URI")
-    size: int | None = Field(default=None, description="Resource Size")
+    content_hash: str | None = Field(default=None, description="SHA-256 of the content, shared with deduplicated blobs")
+    size: int | None = Field(default=None, description="Resource Size, the total below it for folders")
+    item_count: int | None = Field(default=None, description="Number of files and folders below a folder")
     last_modified: int | None = Field(default=None, description="The UNIX timestamp that the resource was last modified")
     type: str | None = Field(default=None, description="The type of the file")
+    name_lower: str | None = Field(default=None, description="Lowercased name, for prefix search")
+    name_grams: List[str] = Field(default_factory=list, description="N-grams of the lowercased name, for substring search")
+
+    @model_validator(mode="after")
+    def fill_search_fields(self):
+        if self.name is not None:
+            self.name_lower = self.name.lower()
+            self.name_grams = name_grams(self.name_lower)
+        return self
+
+
+class UploadSessionModel(BaseModel):
+    owner: EmailStr = Field(default=EmailStr, description="Owner")
+    parent_id: str = Field(default=None, description="Parent ID")
+    name: str = Field(default=None, description="File name")
+    type: str | None = Field(default=None, description="The type of the file")
+    size: int = Field(default=0, description="Total size of the file")
+    part_size: int = Field(default=0, description="Size of every part but the last")
+    part_count: int = Field(default=1, description="Number of parts")
+    uri: str = Field(default=None, description="GridFS ID the parts are written to")
+    parts: Dict[str, int] = Field(default_factory=dict, description="Received part numbers and their sizes")
+    part_attempts: Dict[str, Any] = Field(default_factory=dict, description="Chunk ids of the attempt kept per part")
+    created_at: int | None = Field(default=None, description="The UNIX timestamp that the session was created")
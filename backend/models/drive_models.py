@@ -1,11 +1,59 @@
+from enum import Enum
 from typing import List
 from pydantic import BaseModel, Field
+from core.constants import MAX_PAGE_SIZE, SEARCH_PAGE_SIZE, CHANGE_MAX_WAIT
 
 
 class ListContentModel(BaseModel):
     parent_id: str = Field(default=None, description="Parent ID")
 
 
+class SortField(str, Enum):
+    NAME = "name"
+    SIZE = "size"
+    LAST_MODIFIED = "last_modified"
+    TYPE = "type"
+
+
+class SortOrder(str, Enum):
+    ASC = "asc"
+    DESC = "desc"
+
+
+class ChangeAction(str, Enum):
+    CREATE = "create"
+    MOVE = "move"
+    TRASH = "trash"
+    RESTORE = "restore"
+    DELETE = "delete"
+
+
+class ListContentQuery(BaseModel):
+    sort_by: SortField = Field(default=SortField.NAME, description="Field to sort by")
+    order: SortOrder = Field(default=SortOrder.ASC, description="Sort order")
+    limit: int | None = Field(default=None, ge=1, le=MAX_PAGE_SIZE, description="Page size, everything if unset")
+    cursor: str | None = Field(default=None, description="Opaque cursor returned as next_cursor")
+    fields: List[str] | None = Field(default=None, description="Fields to return, all if unset")
+
+
+class SearchQuery(ListContentQuery):
+    q: str = Field(min_length=1, max_length=255, description="Text to find in file names, case insensitive")
+    prefix: bool = Field(default=False, description="Only match names starting with q")
+    type: str | None = Field(default=None, description="Mime type, or a prefix of it such as image/")
+    min_size: int | None = Field(default=None, ge=0, description="Smallest size in bytes")
+    max_size: int | None = Field(default=None, ge=0, description="Largest size in bytes")
+    modified_after: int | None = Field(default=None, description="UNIX timestamp")
+    modified_before: int | None = Field(default=None, description="UNIX timestamp")
+    limit: int = Field(default=SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size")
+
+
+class ChangesQuery(BaseModel):
+    since: int = Field(default=0, ge=0, description="next_cursor of the previous call, 0 for everything")
+    limit: int = Field(default=MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Most changes returned at once")
+    wait: float = Field(default=0, ge=0, le=CHANGE_MAX_WAIT, description="Seconds to wait for a change")
+    stream: bool = Field(default=False, description="Send changes as server-sent events")
+
+
 class CreateFolderRequest(BaseModel):
     parent_id: str
     name: str
@@ -20,5 +68,15 @@ class MoveFilesRequest(BaseModel):
     new_parent_id: str
 
 
+class CopyFilesRequest(BaseModel):
+    files: List[str] = Field(default_factory=list)
+    new_parent_id: str
+
+
 class DownloadFilesRequest(BaseModel):
-    files: List[str] = Field(default_factory=list)
\ No newline at end of file
+    files: List[str] = Field(default_factory=list)
+
+class CreateUploadSessionRequest(BaseModel):
+    parent_id: str
+    file_name: str
+    size: int = Field(ge=0, description="Total size of the file in bytes")
@@ -2,11 +2,11 @@ from datetime import datetime
 from typing import Annotated
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
 from fastapi_mail import MessageSchema, MessageType, FastMail
-from core.auth_utils import create_user
+from core.auth_utils import create_user, get_user_record, invalidate_user_record, delete_profile_pictures
 from core.constants import JwtTokenScope, MAIL_CONFIG, jinja_env, TEMPLATE_NAME, \
     COMMON_TEMPLATE_VARIABLES, PASSWORD_RESET_TEMPLATE
 from core.database import mongo
-from core.file_utils import move_files_to_trash
+from core.file_utils import delete_owner_records
 from core.security import security_manager
 from models.auth_models import (
     AuthLoginModel, Token,
@@ -14,7 +14,6 @@ from models.auth_models import (
     AuthResetPasswordModel
 )
 from models.db_models import UserModel
-from bson import ObjectId
 
 auth_router = APIRouter(
     prefix="/auth",
@@ -30,7 +29,7 @@ async def login_user(param: AuthLoginModel):
     user_obj = UserModel(**user_record)
     if user_obj.is_google_account:
         raise HTTPException(status_code=403, detail="Please login using Google account")
-    if not security_manager.verify_password(param.password, user_obj.password):
+    if not await security_manager.verify_password_async(param.password, user_obj.password):
         raise HTTPException(status_code=401, detail="Password incorrect")
 
     token = security_manager.create_access_token(user_obj.email, JwtTokenScope.auth)
@@ -38,7 +37,7 @@ async def login_user(param: AuthLoginModel):
 
 @auth_router.post("/register")
 async def register_user(param: AuthRegisterModel):
-    hashed_password = security_manager.hash_password(param.password)
+    hashed_password = await security_manager.hash_password_async(param.password)
     inserted = UserModel(**param.model_dump())
     inserted.password = hashed_password
     insertion_result = await create_user(inserted)
@@ -88,11 +87,12 @@ async def reset_password(
     param: AuthResetPasswordModel,
     current_user_email: Annotated[str, Depends(security_manager.verify_reset_token)]
 ):
-    new_hashed_password = security_manager.hash_password(param.new_password)
+    new_hashed_password = await security_manager.hash_password_async(param.new_password)
     result = await mongo.users.update_one(
         {"email": current_user_email},
         {"$set": {"password": new_hashed_password}}
     )
+    invalidate_user_record(current_user_email)
 
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
@@ -104,18 +104,16 @@ async def reset_password(
 async def delete_account(
     current_user_email: Annotated[str, Depends(security_manager.get_current_user)]
 ):
-    user_record = await mongo.users.find_one({"email": current_user_email})
+    user_record = await get_user_record(current_user_email)
     if not user_record:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Delete user files
-    drive_root_id = user_record.get("drive_root_id")
-    await move_files_to_trash([drive_root_id], permanent=False)
-    await move_files_to_trash([drive_root_id], permanent=True)
+    # Delete user files, the trash included
+    await delete_owner_records(current_user_email)
 
     # Delete user data
     deleted_record = await mongo.users.find_one_and_delete({"email": current_user_email})
-    if profile_id := deleted_record.get("profile_image_id", None):
-        await mongo.profile_bucket.delete(ObjectId(profile_id))
+    invalidate_user_record(current_user_email)
+    await delete_profile_pictures(deleted_record)
 
     return {"message": "Account deleted successfully"}
\ No newline at end of file
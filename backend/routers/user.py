@@ -1,12 +1,15 @@
-from typing import Annotated
-from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException, UploadFile
-from fastapi.responses import FileResponse, StreamingResponse
-from gridfs import NoFile
-from core.constants import PROFILE_PICTURES_TEMPLATE, FALLBACK_PROFILE_PICTURE, JwtTokenScope
+import asyncio
+from typing import Annotated, Tuple
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, Query, Header
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from core.auth_utils import get_user_record, invalidate_user_record, delete_profile_pictures, profile_cache
+from core.constants import PROFILE_PICTURES_TEMPLATE, FALLBACK_PROFILE_PICTURE, JwtTokenScope, USER_STORAGE_QUOTA, \
+    PROFILE_CACHE_MAX_VARIANT, PROFILE_CACHE_CONTROL
 from core.database import mongo
 from core.file_utils import get_mime_type
+from core.image_utils import create_profile_variants, PROFILE_VARIANT_MEDIA_TYPE
 from core.security import security_manager
+from core.storage import profile_storage
 from models.db_models import UserModel
 from models.user_models import UserChangeNameRequest
 
@@ -14,12 +17,15 @@ user_router = APIRouter(prefix="/user", tags=["user"])
 
 @user_router.get("/")
 async def read_users_me(param: Annotated[str, Depends(security_manager.get_current_user)]):
-    user_record = await mongo.users.find_one({"email": param})
+    user_record = await get_user_record(param)
     if not user_record:
         raise HTTPException(status_code=404, detail="User not found")
 
     user_record.pop("password")
     user_record.pop("_id")
+    user_record.setdefault("bytes_used", 0)
+    user_record.setdefault("file_count", 0)
+    user_record["storage_quota"] = USER_STORAGE_QUOTA
     return user_record
 
 @user_router.post("/change-username")
@@ -32,6 +38,7 @@ async def change_username(
         {"email": user_email},
         {"$set": {"username": param.new_name}}
     )
+    invalidate_user_record(user_email)
     if update_result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Username not found")
 
@@ -46,52 +53,86 @@ async def upload_profile(
     file: UploadFile,
     current_user: Annotated[str, Depends(security_manager.get_current_user)]
 ):
-    bucket = mongo.profile_bucket
     bucket_file_name = PROFILE_PICTURES_TEMPLATE.format(current_user)
 
-    # Find and remove existing profile picture
+    # Find and remove existing profile picture, read fresh since it is about to change
     user_record = await mongo.users.find_one({"email": current_user})
     if not user_record:
         raise HTTPException(status_code=404, detail="User not found")
-    user_obj = UserModel(**user_record)
-    if user_obj.profile_image_id:
-        try:
-            await bucket.delete(ObjectId(user_obj.profile_image_id))
-        except NoFile:
-            ...
+    await delete_profile_pictures(user_record)
 
     media_type = get_mime_type(file.filename)
+    image_data = await file.read()
+
+    file_id = await profile_storage.write(image_data, bucket_file_name, {"contentType": media_type})
 
-    async with bucket.open_upload_stream(bucket_file_name, metadata={"contentType": media_type}) as stream:
-        await stream.write(file.file)
-        file_id = str(stream._id)
+    # Store the resized avatars next to the original
+    profile_variants = {}
+    variants = await asyncio.to_thread(create_profile_variants, image_data)
+    for size, variant_data in variants.items():
+        variant_metadata = {"contentType": PROFILE_VARIANT_MEDIA_TYPE, "original_id": file_id, "size": size}
+        profile_variants[str(size)] = await profile_storage.write(
+            variant_data, f"{bucket_file_name}-{size}", variant_metadata
+        )
 
     await mongo.users.update_one(
         {"email": current_user},
-        {"$set": {"profile_image_id": file_id}},
+        {"$set": {"profile_image_id": file_id, "profile_image_type": media_type, "profile_variants": profile_variants}},
     )
+    invalidate_user_record(current_user)
     return {"profile_image_id": file_id}
 
 
+def pick_profile_variant(user_obj: UserModel, size: int | None) -> Tuple[str, str]:
+    # The smallest variant at least as large as requested, or the original
+    if size is not None:
+        for variant_size in sorted(int(variant_size) for variant_size in user_obj.profile_variants):
+            if variant_size >= size:
+                return user_obj.profile_variants[str(variant_size)], str(variant_size)
+    return user_obj.profile_image_id, "original"
+
+
 @user_router.get("/profile/{file_id}")
 async def get_profile_picture(
     file_id: str,
-    token: str
+    token: str,
+    size: Annotated[int | None, Query(ge=1)] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
     # Make sure the current_user owns the file
     current_user = security_manager.decode_access_token(token, JwtTokenScope.auth)
-    user_record = await mongo.users.find_one({"email": current_user})
+    user_record = await get_user_record(current_user)
     if not user_record:
         raise HTTPException(status_code=404, detail="User not found")
     user_obj = UserModel(**user_record)
     if user_obj.profile_image_id != file_id:
         return FileResponse(FALLBACK_PROFILE_PICTURE, media_type=get_mime_type(FALLBACK_PROFILE_PICTURE))
 
+    # Pictures never change under the same id, so the id and variant make a strong validator
+    variant_id, variant_name = pick_profile_variant(user_obj, size)
+    etag = f'"{file_id}-{variant_name}"'
+    headers = {"ETag": etag, "Cache-Control": PROFILE_CACHE_CONTROL}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    if cached_variant := profile_cache.get(variant_id):
+        content, media_type = cached_variant
+        return Response(content, media_type=media_type, headers=headers)
+
     # Retrieve the file
-    bucket = mongo.profile_bucket
     try:
-        download_stream = await bucket.open_download_stream(ObjectId(file_id))
-    except NoFile:
+        stored_picture = await profile_storage.stat(variant_id)
+    except FileNotFoundError:
         return FileResponse(FALLBACK_PROFILE_PICTURE, media_type=get_mime_type(FALLBACK_PROFILE_PICTURE))
 
-    return StreamingResponse(download_stream, media_type=download_stream.metadata["contentType"])
+    is_variant = variant_name != "original"
+    media_type = stored_picture.metadata.get("contentType") or \
+        (PROFILE_VARIANT_MEDIA_TYPE if is_variant else user_obj.profile_image_type) or "application/octet-stream"
+    if is_variant and int(variant_name) <= PROFILE_CACHE_MAX_VARIANT:
+        content = await profile_storage.read(variant_id)
+        profile_cache.set(variant_id, (content, media_type))
+        return Response(content, media_type=media_type, headers=headers)
+
+    if stored_picture.path is not None:
+        return FileResponse(stored_picture.path, media_type=media_type, headers=headers)
+    return StreamingResponse(profile_storage.iter_chunks(variant_id), media_type=media_type, headers=headers)
@@ -0,0 +1,92 @@
+"""
+Backfill the materialized ``ancestors`` field on existing files and trash records.
+
+Loads the parent links of both collections, resolves every chain in memory and
+only rewrites the records whose stored ancestors differ, then ensures the indexes.
+
+    python -m scripts.backfill_ancestors [--dry-run]
+"""
+import argparse
+import asyncio
+from typing import Dict, List
+from bson import ObjectId
+from pymongo import UpdateOne
+from core.database import mongo
+
+BATCH_SIZE = 1000
+
+
+def resolve_ancestors(parent_links: Dict[str, str]) -> Dict[str, List[str]]:
+    resolved: Dict[str, List[str]] = {}
+    for file_id in parent_links:
+        # Walk up until a resolved record, the drive root or a missing parent
+        chain = []
+        current_id = file_id
+        while current_id in parent_links and current_id not in resolved and current_id not in chain:
+            chain.append(current_id)
+            current_id = parent_links[current_id]
+
+        if current_id in resolved:
+            ancestors = [*resolved[current_id], current_id]
+        elif current_id in chain:
+            # A cycle in the stored parent links, cut it at this record
+            ancestors = []
+        elif current_id:
+            # The parent no longer exists, keep the dangling link as the only ancestor
+            ancestors = [current_id]
+        else:
+            ancestors = []
+
+        for chain_id in reversed(chain):
+            resolved[chain_id] = ancestors
+            ancestors = [*ancestors, chain_id]
+    return resolved
+
+
+async def backfill(dry_run: bool):
+    parent_links: Dict[str, str] = {}
+    stored_ancestors: Dict[str, List[str]] = {}
+    for collection in (mongo.files, mongo.trash):
+        async for file_row in collection.find({}, {"parent_id": 1, "ancestors": 1}):
+            parent_links[str(file_row["_id"])] = file_row.get("parent_id") or ""
+            stored_ancestors[str(file_row["_id"])] = file_row.get("ancestors")
+
+    resolved = resolve_ancestors(parent_links)
+    for collection in (mongo.files, mongo.trash):
+        updates = []
+        updated_count = 0
+        async for file_row in collection.find({}, {"_id": 1}):
+            file_id = str(file_row["_id"])
+            if stored_ancestors.get(file_id) == resolved[file_id]:
+                continue
+            updates.append(UpdateOne({"_id": ObjectId(file_id)}, {"$set": {"ancestors": resolved[file_id]}}))
+            if len(updates) >= BATCH_SIZE:
+                updated_count += await _flush(collection, updates, dry_run)
+                updates = []
+        updated_count += await _flush(collection, updates, dry_run)
+        print(f"{collection.name}: {updated_count} records {'to update' if dry_run else 'updated'}")
+
+    if not dry_run:
+        await mongo.ensure_indexes()
+
+
+async def _flush(collection, updates, dry_run: bool) -> int:
+    if updates and not dry_run:
+        await collection.bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many records would change")
+    args = parser.parse_args()
+
+    await mongo.connect()
+    try:
+        await backfill(args.dry_run)
+    finally:
+        await mongo.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+"""
+Backfill the ``name_lower`` and ``name_grams`` search fields on existing files and
+trash records.
+
+Only rewrites the records whose stored fields differ from their name, in bulk, then
+ensures the indexes.
+
+    python -m scripts.backfill_search [--dry-run]
+"""
+import argparse
+import asyncio
+from pymongo import UpdateOne
+from core.database import mongo
+from core.search import search_name_fields
+
+BATCH_SIZE = 1000
+
+
+async def backfill(dry_run: bool):
+    for collection in (mongo.files, mongo.trash):
+        updates = []
+        stale_count = 0
+        projection = {"name": 1, "name_lower": 1, "name_grams": 1}
+        async for file_row in collection.find({"name": {"$type": "string"}}, projection):
+            search_fields = search_name_fields(file_row["name"])
+            if all(file_row.get(field) == value for field, value in search_fields.items()):
+                continue
+
+            stale_count += 1
+            updates.append(UpdateOne({"_id": file_row["_id"]}, {"$set": search_fields}))
+            if len(updates) >= BATCH_SIZE and not dry_run:
+                await collection.bulk_write(updates, ordered=False)
+                updates = []
+
+        if updates and not dry_run:
+            await collection.bulk_write(updates, ordered=False)
+        print(f"{collection.name}: {stale_count} records {'stale' if dry_run else 'updated'}")
+
+    if not dry_run:
+        await mongo.ensure_indexes()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dry-run", action="store_true", help="Only count the stale records")
+    args = parser.parse_args()
+
+    await mongo.connect()
+    try:
+        await backfill(args.dry_run)
+    finally:
+        await mongo.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""
+Verify, and rebuild, the ``size`` and ``item_count`` totals of every folder.
+
+Recomputes the totals of both collections with one aggregation each and rewrites
+only the folders that drifted, in bulk.
+
+    python -m scripts.rebuild_folder_sizes [--dry-run]
+"""
+import argparse
+import asyncio
+from pymongo import UpdateOne
+from core.database import mongo
+
+BATCH_SIZE = 1000
+
+# Every record adds its own size and one item to each of its ancestors. In the trash only
+# the ancestors trashed along with it count, from its trash_root down, see trashed_ancestors.
+ROLLUP_PIPELINE = [
+    {"$project": {
+        "ancestors": {"$switch": {
+            "branches": [
+                {"case": {"$eq": [{"$ifNull": ["$trash_root", None]}, None]}, "then": "$ancestors"},
+                {"case": {"$in": ["$trash_root", {"$ifNull": ["$ancestors", []]}]}, "then": {"$slice": [
+                    "$ancestors", {"$indexOfArray": ["$ancestors", "$trash_root"]}, {"$size": "$ancestors"},
+                ]}},
+            ],
+            "default": [],
+        }},
+        "own_size": {"$cond": [{"$eq": ["$is_folder", True]}, 0, {"$ifNull": ["$size", 0]}]},
+    }},
+    {"$unwind": "$ancestors"},
+    {"$group": {"_id": "$ancestors", "size": {"$sum": "$own_size"}, "item_count": {"$sum": 1}}},
+]
+
+
+async def rebuild(dry_run: bool):
+    for collection in (mongo.files, mongo.trash):
+        actual_totals = {
+            totals["_id"]: {"size": totals["size"], "item_count": totals["item_count"]}
+            async for totals in await collection.aggregate(ROLLUP_PIPELINE, allowDiskUse=True)
+        }
+
+        updates = []
+        drifted_count = 0
+        async for folder_row in collection.find({"is_folder": True}, {"size": 1, "item_count": 1}):
+            totals = actual_totals.get(str(folder_row["_id"]), {"size": 0, "item_count": 0})
+            if folder_row.get("size") == totals["size"] and folder_row.get("item_count") == totals["item_count"]:
+                continue
+
+            drifted_count += 1
+            updates.append(UpdateOne({"_id": folder_row["_id"]}, {"$set": totals}))
+            if len(updates) >= BATCH_SIZE and not dry_run:
+                await collection.bulk_write(updates, ordered=False)
+                updates = []
+
+        if updates and not dry_run:
+            await collection.bulk_write(updates, ordered=False)
+        print(f"{collection.name}: {drifted_count} folders {'drifted' if dry_run else 'rebuilt'}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dry-run", action="store_true", help="Only report the drifted folders")
+    args = parser.parse_args()
+
+    await mongo.connect()
+    try:
+        await rebuild(args.dry_run)
+    finally:
+        await mongo.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
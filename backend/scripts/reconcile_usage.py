@@ -0,0 +1,69 @@
+"""
+Recompute every user's bytes_used and file_count from their files and trash.
+
+Aggregates both collections by owner and rewrites only the counters that drifted,
+in bulk.
+
+    python -m scripts.reconcile_usage [--dry-run]
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from pymongo import UpdateOne
+from core.database import mongo
+
+BATCH_SIZE = 1000
+
+USAGE_PIPELINE = [
+    {"$match": {"is_folder": False}},
+    {"$group": {
+        "_id": "$owner",
+        "bytes_used": {"$sum": {"$ifNull": ["$size", 0]}},
+        "file_count": {"$sum": 1},
+    }},
+]
+
+
+async def reconcile(dry_run: bool):
+    actual_usage = defaultdict(lambda: {"bytes_used": 0, "file_count": 0})
+    for collection in (mongo.files, mongo.trash):
+        async for usage in await collection.aggregate(USAGE_PIPELINE):
+            actual_usage[usage["_id"]]["bytes_used"] += usage["bytes_used"]
+            actual_usage[usage["_id"]]["file_count"] += usage["file_count"]
+
+    updates = []
+    drifted_count = 0
+    async for user_record in mongo.users.find({}, {"email": 1, "bytes_used": 1, "file_count": 1}):
+        usage = actual_usage[user_record["email"]]
+        if user_record.get("bytes_used") == usage["bytes_used"] and user_record.get("file_count") == usage["file_count"]:
+            continue
+
+        drifted_count += 1
+        print(
+            f"{user_record['email']}: bytes_used {user_record.get('bytes_used')} -> {usage['bytes_used']}, "
+            f"file_count {user_record.get('file_count')} -> {usage['file_count']}"
+        )
+        updates.append(UpdateOne({"_id": user_record["_id"]}, {"$set": usage}))
+        if len(updates) >= BATCH_SIZE and not dry_run:
+            await mongo.users.bulk_write(updates, ordered=False)
+            updates = []
+
+    if updates and not dry_run:
+        await mongo.users.bulk_write(updates, ordered=False)
+    print(f"{drifted_count} users {'drifted' if dry_run else 'reconciled'}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dry-run", action="store_true", help="Only report the drifted counters")
+    args = parser.parse_args()
+
+    await mongo.connect()
+    try:
+        await reconcile(args.dry_run)
+    finally:
+        await mongo.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,7 +1,9 @@
 import unittest
+import uuid
+from pymongo import MongoClient
 from starlette.testclient import TestClient
 from app import app
-from core.constants import JwtTokenScope
+from core.constants import JwtTokenScope, DATABASE_URL, DATABASE_NAME, COLLECTIONS
 from core.security import security_manager
 from tests.config import TEST_USER, DNE_USER
 
@@ -51,5 +53,31 @@ class AuthTest(unittest.TestCase):
         )
         self.assertEqual(result.status_code, 200)
 
+    def test_delete_account_removes_trash(self):
+        email = f"deleted-{uuid.uuid4().hex}@clouddrive.com"
+        register_response = self._client.post(
+            "/auth/register", json={"email": email, "username": "deleted", "password": "random_password"}
+        )
+        self.assertEqual(register_response.status_code, 200)
+        headers = {"Authorization": f"Bearer {register_response.json()['access_token']}"}
+        drive_root_id = self._client.get("/user", headers=headers).json()["drive_root_id"]
+
+        # A folder in the drive and a file trashed on its own before the account goes
+        folder_id = self._client.post(
+            "/drive/create-folder", headers=headers, json={"parent_id": drive_root_id, "name": "kept"}
+        ).json()["new_folder"]
+        file_id = self._client.post(
+            f"/drive/upload-file/{folder_id}?file_name=trashed.txt", headers=headers, content=uuid.uuid4().bytes
+        ).json()["result"]
+        self.assertEqual(
+            self._client.post("/drive/move-to-trash", headers=headers, json={"files": [file_id]}).status_code, 200
+        )
+
+        self.assertEqual(self._client.post("/auth/delete-account", headers=headers).status_code, 200)
+        with MongoClient(DATABASE_URL) as mongo_client:
+            database = mongo_client[DATABASE_NAME]
+            for collection_name in (COLLECTIONS.FILES, COLLECTIONS.TRASH):
+                self.assertEqual(database[collection_name].count_documents({"owner": email}), 0)
+
 if __name__ == '__main__':
     unittest.main()
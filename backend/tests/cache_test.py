@@ -0,0 +1,31 @@
+import time
+import unittest
+from core.cache import TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats(), {"size": 2, "hits": 3, "misses": 1})
+
+    def test_entries_expire(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("short", 1, ttl=0.01)
+        cache.set("expired", 2, ttl=-1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get("short"))
+        self.assertIsNone(cache.get("expired"))
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
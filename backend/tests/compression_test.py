@@ -0,0 +1,39 @@
+import asyncio
+import unittest
+from core.compression import storage_codec, is_precompressed, compressor, decompress_chunks, ZLIB_CODEC
+
+
+class CompressionTest(unittest.TestCase):
+    def test_codec_by_type(self):
+        self.assertEqual(storage_codec("text/csv"), ZLIB_CODEC)
+        self.assertEqual(storage_codec("application/json"), ZLIB_CODEC)
+        self.assertIsNone(storage_codec("image/png"))
+        self.assertIsNone(storage_codec("application/octet-stream"))
+
+    def test_precompressed_types(self):
+        self.assertTrue(is_precompressed("image/jpeg"))
+        self.assertTrue(is_precompressed("application/zip"))
+        self.assertTrue(is_precompressed("application/vnd.openxmlformats-officedocument.wordprocessingml.document"))
+        self.assertFalse(is_precompressed("image/svg+xml"))
+        self.assertFalse(is_precompressed("text/plain"))
+        self.assertFalse(is_precompressed(None))
+
+    def test_round_trip(self):
+        payload = b"timestamp,level,message\n" + b"2024-01-01,INFO,hello\n" * 10000
+        chunk_compressor = compressor(ZLIB_CODEC)
+        compressed = [chunk_compressor.compress(payload[start:start + 4096]) for start in range(0, len(payload), 4096)]
+        compressed.append(chunk_compressor.flush())
+        self.assertLess(sum(map(len, compressed)), len(payload) // 10)
+
+        async def chunks():
+            for chunk in compressed:
+                yield chunk
+
+        async def decompress():
+            return b"".join([chunk async for chunk in decompress_chunks(chunks(), ZLIB_CODEC)])
+
+        self.assertEqual(asyncio.run(decompress()), payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
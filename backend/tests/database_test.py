@@ -0,0 +1,29 @@
+import unittest
+from unittest.mock import patch
+from core import database
+from core.database import client_options
+
+
+class ClientOptionsTest(unittest.TestCase):
+    def test_unset_settings_are_dropped(self):
+        with patch.object(database, "MONGO_SOCKET_TIMEOUT_MS", None), \
+                patch.object(database, "MONGO_WAIT_QUEUE_TIMEOUT_MS", 500), \
+                patch.object(database, "MONGO_COMPRESSORS", ""):
+            options = client_options()
+        self.assertNotIn("socketTimeoutMS", options)
+        self.assertEqual(options["waitQueueTimeoutMS"], 500)
+        self.assertNotIn(None, options.values())
+        # Compression is only negotiated when configured
+        self.assertNotIn("compressors", options)
+        self.assertNotIn("zlibCompressionLevel", options)
+
+    def test_compressors_when_configured(self):
+        with patch.object(database, "MONGO_COMPRESSORS", "zstd,zlib"), \
+                patch.object(database, "MONGO_ZLIB_COMPRESSION_LEVEL", 6):
+            options = client_options()
+        self.assertEqual(options["compressors"], "zstd,zlib")
+        self.assertEqual(options["zlibCompressionLevel"], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
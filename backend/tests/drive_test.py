@@ -1,12 +1,20 @@
+import asyncio
+import tempfile
 import unittest
 import uuid
+from pathlib import Path
 from bson import ObjectId
-from gridfs import GridFSBucket, NoFile
+from fastapi import HTTPException
+from gridfs import GridFSBucket
 from pymongo import MongoClient
 from starlette.testclient import TestClient
 from app import app
 from core.constants import JwtTokenScope, DATABASE_URL, COLLECTIONS, DATABASE_NAME, BUCKETS
+from core.file_utils import verify_parent_folder
 from core.security import security_manager
+from core.storage import file_storage, LocalEngine, LOCAL_BACKEND, LOCAL_URI_PREFIX
+from core.trash_purge import trash_purge_worker, TrashPurgeWorker
+from core.upload_sessions import get_upload_session, complete_upload_session
 from tests.config import TEST_USER
 
 
@@ -24,27 +32,28 @@ class DriveTest(unittest.TestCase):
         cls.files_collection = cls.database[COLLECTIONS.FILES]
         cls.trash_collection = cls.database[COLLECTIONS.TRASH]
         cls.file_bucket = GridFSBucket(cls.database, BUCKETS.FILE_STORAGE.name)
+        cls.local_root = tempfile.TemporaryDirectory()
 
     @classmethod
     def tearDownClass(cls):
-        for file_record in cls.files_collection.find({"owner": TEST_USER}):
-            if str(file_record["_id"]) != cls.user_record["drive_root_id"]:
-                cls.files_collection.delete_one({"_id": file_record["_id"]})
-        for file_record in cls.trash_collection.find({"owner": TEST_USER}):
-            cls.trash_collection.delete_one({"_id": file_record["_id"]})
-
-            if file_uri := file_record.get("uri"):
-                try:
-                    cls.file_bucket.delete(ObjectId(file_uri))
-                except NoFile:
-                    pass
+        # Go through the API so that shared blobs are reference counted correctly
+        headers = {"Authorization": f"Bearer {cls.auth_token}"}
+        root_children = [
+            str(file_record["_id"])
+            for file_record in cls.files_collection.find({"parent_id": cls.user_record["drive_root_id"]})
+        ]
+        if root_children:
+            cls._client.post("/drive/move-to-trash", headers=headers, json={"files": root_children})
+        trashed_files = [str(file_record["_id"]) for file_record in cls.trash_collection.find({"owner": TEST_USER})]
+        if trashed_files:
+            cls._client.post("/drive/delete-from-trash", headers=headers, json={"files": trashed_files})
 
         cls.mongo_client.close()
+        cls.local_root.cleanup()
         cls._client.__exit__(None, None, None)
 
-    def _upload_test_file(self, parent_id, file_name):
+    def _upload_test_file(self, parent_id, file_name, fake_payload=b"Hello world"):
         auth_token = self.auth_token
-        fake_payload = b"Hello world"
 
         endpoint = f"/drive/upload-file/{parent_id}?file_name={file_name}"
         headers = {
@@ -90,13 +99,211 @@ class DriveTest(unittest.TestCase):
             f"/drive/list-content/{drive_root_id}",
             headers={"Authorization": f"Bearer {auth_token}"},
         )
-        files = list_content_response.json()["result"]
-        for file in files:
-            self.files_collection.delete_one({"_id": ObjectId(file["_id"])})
-            try:
-                self.file_bucket.delete(ObjectId(file["uri"]))
-            except NoFile:
-                ...
+        files = [file["_id"] for file in list_content_response.json()["result"]]
+        for endpoint in ("/drive/move-to-trash", "/drive/delete-from-trash"):
+            self._client.post(endpoint, headers={"Authorization": f"Bearer {auth_token}"}, json={"files": files})
+
+    def test_upload_file_deduplicated(self):
+        parent_id = self._create_folder(self.user_record["drive_root_id"], "dedup-" + uuid.uuid4().hex)
+        file_id1, file_uri1 = self._upload_test_file(parent_id, uuid.uuid4().hex + ".txt")
+        file_id2, file_uri2 = self._upload_test_file(parent_id, uuid.uuid4().hex + ".txt")
+        self.assertEqual(file_uri1, file_uri2)
+
+        content_hash = self.files_collection.find_one({"_id": ObjectId(file_id1)})["content_hash"]
+        blob_record = self.database[COLLECTIONS.BLOBS].find_one({"_id": content_hash})
+        self.assertGreaterEqual(blob_record["ref_count"], 2)
+
+    def test_upload_file_updates_usage(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        usage_before = self._client.get("/user", headers=headers).json()
+        self._upload_test_file(self.user_record["drive_root_id"], uuid.uuid4().hex + ".txt")
+        usage_after = self._client.get("/user", headers=headers).json()
+
+        self.assertEqual(usage_after["bytes_used"], usage_before["bytes_used"] + len(b"Hello world"))
+        self.assertEqual(usage_after["file_count"], usage_before["file_count"] + 1)
+
+    def test_list_content_paginated(self):
+        auth_token = self.auth_token
+        parent_id = self._create_folder(self.user_record["drive_root_id"], "paginated-" + uuid.uuid4().hex)
+        child_names = sorted("child-" + uuid.uuid4().hex for _ in range(5))
+        for child_name in child_names:
+            self._create_folder(parent_id, child_name)
+
+        listed_names = []
+        cursor = None
+        while True:
+            params = {"sort_by": "name", "limit": 2, "fields": ["name"]}
+            if cursor:
+                params["cursor"] = cursor
+            response = self._client.get(
+                f"/drive/list-content/{parent_id}",
+                headers={"Authorization": f"Bearer {auth_token}"},
+                params=params,
+            )
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertLessEqual(len(body["result"]), 2)
+            listed_names.extend(file["name"] for file in body["result"])
+            self.assertTrue(all(set(file) == {"_id", "name"} for file in body["result"]))
+            cursor = body["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(listed_names, child_names)
+
+    def test_upload_session(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        file_name = uuid.uuid4().hex + ".txt"
+        payload = b"Hello world"
+
+        session = self._client.post(
+            "/drive/upload-sessions",
+            headers=headers,
+            json={"parent_id": self.user_record["drive_root_id"], "file_name": file_name, "size": len(payload)},
+        ).json()
+        self.assertEqual(session["part_count"], 1)
+
+        # Nothing is visible until the upload is completed
+        self.assertIsNone(self.files_collection.find_one({"name": file_name}))
+        complete_response = self._client.post(f"/drive/upload-sessions/{session['session_id']}/complete", headers=headers)
+        self.assertEqual(complete_response.status_code, 409)
+
+        out_of_range_response = self._client.put(
+            f"/drive/upload-sessions/{session['session_id']}/parts/1",
+            headers=headers,
+            content=payload,
+        )
+        self.assertEqual(out_of_range_response.status_code, 400)
+
+        # A retried part replaces the attempt before it
+        for part_payload in (b"Hello there", payload):
+            part_response = self._client.put(
+                f"/drive/upload-sessions/{session['session_id']}/parts/0",
+                headers=headers,
+                content=part_payload,
+            )
+            self.assertEqual(part_response.status_code, 200)
+        status = self._client.get(f"/drive/upload-sessions/{session['session_id']}", headers=headers).json()
+        self.assertEqual(status["received_parts"], [0])
+
+        complete_response = self._client.post(f"/drive/upload-sessions/{session['session_id']}/complete", headers=headers)
+        self.assertEqual(complete_response.status_code, 200)
+        file_uri = complete_response.json()["file_uri"]
+        with self.file_bucket.open_download_stream(ObjectId(file_uri)) as download_stream:
+            self.assertEqual(download_stream.read(), payload)
+
+    def test_concurrent_upload_session_completion(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        payload = uuid.uuid4().bytes
+        session_id = self._client.post(
+            "/drive/upload-sessions",
+            headers=headers,
+            json={"parent_id": self.user_record["drive_root_id"], "file_name": uuid.uuid4().hex, "size": len(payload)},
+        ).json()["session_id"]
+        part_response = self._client.put(f"/drive/upload-sessions/{session_id}/parts/0", headers=headers, content=payload)
+        self.assertEqual(part_response.status_code, 200)
+
+        async def complete_twice():
+            session_record = await get_upload_session(session_id, TEST_USER)
+            parent_record = await verify_parent_folder(session_record["parent_id"], TEST_USER)
+            return await asyncio.gather(
+                complete_upload_session(session_record, parent_record),
+                complete_upload_session(session_record, parent_record),
+                return_exceptions=True,
+            )
+
+        outcomes = self._client.portal.call(complete_twice)
+        failures = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+        self.assertEqual(len(failures), 1)
+        self.assertIsInstance(failures[0], HTTPException)
+        self.assertEqual(failures[0].status_code, 409)
+
+    def test_download_file_range(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        file_id, file_uri = self._upload_test_file(self.user_record["drive_root_id"], uuid.uuid4().hex + ".txt")
+
+        full_response = self._client.get(f"/drive/download/{file_id}", headers=headers)
+        self.assertEqual(full_response.status_code, 200)
+        self.assertEqual(full_response.content, b"Hello world")
+        etag = full_response.headers["ETag"]
+
+        range_response = self._client.get(f"/drive/download/{file_id}", headers={**headers, "Range": "bytes=6-"})
+        self.assertEqual(range_response.status_code, 206)
+        self.assertEqual(range_response.content, b"world")
+        self.assertEqual(range_response.headers["Content-Range"], "bytes 6-10/11")
+
+        cached_response = self._client.get(f"/drive/download/{file_id}", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(cached_response.status_code, 304)
+
+        unsatisfiable_response = self._client.get(f"/drive/download/{file_id}", headers={**headers, "Range": "bytes=20-"})
+        self.assertEqual(unsatisfiable_response.status_code, 416)
+        self.assertEqual(unsatisfiable_response.headers["Content-Range"], "bytes */11")
+
+        # An invalid range is ignored and the whole file is sent
+        invalid_response = self._client.get(f"/drive/download/{file_id}", headers={**headers, "Range": "bytes=5-3"})
+        self.assertEqual(invalid_response.status_code, 200)
+        self.assertEqual(invalid_response.content, b"Hello world")
+
+    def test_download_local_file_range(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        local_engine = LocalEngine(Path(self.local_root.name))
+        file_storage.engines[LOCAL_BACKEND], default_engine = local_engine, file_storage.default_engine
+        file_storage.default_engine = local_engine
+        try:
+            payload = uuid.uuid4().hex.encode()
+            file_id, file_uri = self._upload_test_file(self.user_record["drive_root_id"], uuid.uuid4().hex, payload)
+            self.assertTrue(file_uri.startswith(LOCAL_URI_PREFIX))
+
+            def download(range_header):
+                return self._client.get(f"/drive/download/{file_id}", headers={**headers, "Range": range_header})
+
+            range_response = download("bytes=0-4")
+            self.assertEqual((range_response.status_code, range_response.content), (206, payload[:5]))
+            # Answered like the GridFS engine: invalid and multiple ranges get the whole file
+            for ignored_range in ("bytes=5-3", "bytes=abc", "items=0-1", "bytes=0-1,3-4"):
+                response = download(ignored_range)
+                self.assertEqual((response.status_code, response.content), (200, payload))
+            self.assertEqual(download(f"bytes={len(payload)}-").status_code, 416)
+        finally:
+            file_storage.default_engine = default_engine
+
+    def test_download_compressed_file(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        payload = uuid.uuid4().hex.encode() + b"id,name,size\n" * 5000
+        file_id, file_uri = self._upload_test_file(self.user_record["drive_root_id"], uuid.uuid4().hex + ".csv", payload)
+
+        gridfs_file = self.file_bucket._files.find_one({"_id": ObjectId(file_uri)})
+        self.assertEqual(gridfs_file["metadata"]["codec"], "zlib")
+        self.assertLess(gridfs_file["length"], len(payload))
+        self.assertEqual(self.files_collection.find_one({"_id": ObjectId(file_id)})["size"], len(payload))
+
+        full_response = self._client.get(f"/drive/download/{file_id}", headers=headers)
+        self.assertEqual(full_response.content, payload)
+        range_response = self._client.get(f"/drive/download/{file_id}", headers={**headers, "Range": "bytes=100-199"})
+        self.assertEqual(range_response.status_code, 206)
+        self.assertEqual(range_response.content, payload[100:200])
+
+    def test_search(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        token = uuid.uuid4().hex[:12]
+        folder_name = f"Quarterly-{token}"
+        folder_id = self._create_folder(self.user_record["drive_root_id"], folder_name)
+        file_id, _ = self._upload_test_file(folder_id, f"Report-{token}.txt")
+
+        substring_response = self._client.get("/drive/search", headers=headers, params={"q": f"ORT-{token}"})
+        self.assertEqual(substring_response.status_code, 200)
+        hits = substring_response.json()["result"]
+        self.assertEqual([hit["_id"] for hit in hits], [file_id])
+        self.assertEqual(hits[0]["path"], f"/{folder_name}")
+        self.assertNotIn("name_grams", hits[0])
+
+        prefix_response = self._client.get("/drive/search", headers=headers, params={"q": "ort-", "prefix": True})
+        self.assertNotIn(file_id, [hit["_id"] for hit in prefix_response.json()["result"]])
+
+        folder_response = self._client.get(
+            "/drive/search", headers=headers, params={"q": token, "type": "Folder", "fields": ["name"]}
+        )
+        self.assertEqual([hit["_id"] for hit in folder_response.json()["result"]], [folder_id])
 
     def test_upload_file_invalid_parent(self):
         auth_token = self.auth_token
@@ -167,8 +374,9 @@ class DriveTest(unittest.TestCase):
 
         outer_parent_id = self._create_folder(self.user_record["drive_root_id"], parent_name)
         inner_parent_id = self._create_folder(outer_parent_id, child_name)
-        child_file_id1, child_file_uri1 = self._upload_test_file(inner_parent_id, child_file_name1)
-        child_file_id2, child_file_uri2 = self._upload_test_file(inner_parent_id, child_file_name2)
+        # Unique contents so that the blobs aren't shared with other tests
+        child_file_id1, child_file_uri1 = self._upload_test_file(inner_parent_id, child_file_name1, uuid.uuid4().bytes)
+        child_file_id2, child_file_uri2 = self._upload_test_file(inner_parent_id, child_file_name2, uuid.uuid4().bytes)
 
         assert self._client.post(
         "/drive/move-to-trash",
@@ -193,6 +401,101 @@ class DriveTest(unittest.TestCase):
             find_file_object_response = self.file_bucket._files.find_one({"_id": ObjectId(file_uri)})
             self.assertIsNone(find_file_object_response)
 
+    def test_purge_expired_trash(self):
+        folder_id = self._create_folder(self.user_record["drive_root_id"], "expired-" + uuid.uuid4().hex)
+        file_id, file_uri = self._upload_test_file(folder_id, uuid.uuid4().hex + ".txt", uuid.uuid4().bytes)
+        assert self._client.post(
+            "/drive/move-to-trash",
+            headers={"Authorization": f"Bearer {self.auth_token}"},
+            json={"files": [folder_id]},
+        ).status_code == 200
+
+        # Pretend it was trashed long before the retention period
+        self.trash_collection.update_many(
+            {"_id": {"$in": [ObjectId(folder_id), ObjectId(file_id)]}},
+            {"$set": {"time_trashed": 0}},
+        )
+        # A batch holds at most batch_size records, subtrees are not expanded into it
+        purge_worker = TrashPurgeWorker()
+        purge_worker.batch_size = 1
+        self.assertEqual(self._client.portal.call(purge_worker.purge_batch), 1)
+        self.assertEqual(purge_worker.purged_files, 1)
+        while self._client.portal.call(trash_purge_worker.purge_batch):
+            ...
+
+        for trashed_id in [folder_id, file_id]:
+            self.assertIsNone(self.trash_collection.find_one({"_id": ObjectId(trashed_id)}))
+        self.assertIsNone(self.file_bucket._files.find_one({"_id": ObjectId(file_uri)}))
+
+    def test_overlapping_purges_release_once(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        payload = uuid.uuid4().bytes
+        kept_id, file_uri = self._upload_test_file(self.user_record["drive_root_id"], uuid.uuid4().hex + ".txt", payload)
+        purged_id, _ = self._upload_test_file(self.user_record["drive_root_id"], uuid.uuid4().hex + ".txt", payload)
+        content_hash = self.files_collection.find_one({"_id": ObjectId(kept_id)})["content_hash"]
+        assert self._client.post("/drive/move-to-trash", headers=headers, json={"files": [purged_id]}).status_code == 200
+        self.trash_collection.update_one({"_id": ObjectId(purged_id)}, {"$set": {"time_trashed": 0}})
+
+        # Two app processes sweeping the same expired records
+        async def purge_concurrently():
+            await asyncio.gather(TrashPurgeWorker().purge_batch(), TrashPurgeWorker().purge_batch())
+
+        self._client.portal.call(purge_concurrently)
+        self.assertIsNone(self.trash_collection.find_one({"_id": ObjectId(purged_id)}))
+        self.assertEqual(self.database[COLLECTIONS.BLOBS].find_one({"_id": content_hash})["ref_count"], 1)
+        self.assertIsNotNone(self.file_bucket._files.find_one({"_id": ObjectId(file_uri)}))
+
+    def test_restore_from_trash(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        folder_name = "restored-" + uuid.uuid4().hex
+        folder_id = self._create_folder(self.user_record["drive_root_id"], folder_name)
+        child_folder_id = self._create_folder(folder_id, "child")
+        file_id, _ = self._upload_test_file(child_folder_id, "hello.txt")
+        assert self._client.post("/drive/move-to-trash", headers=headers, json={"files": [folder_id]}).status_code == 200
+
+        # Take the name while the folder is in the trash
+        self._create_folder(self.user_record["drive_root_id"], folder_name)
+        restore_response = self._client.post("/drive/restore-from-trash", headers=headers, json={"files": [folder_id]})
+        self.assertEqual(restore_response.status_code, 200)
+        self.assertEqual(restore_response.json()["restored"], [{
+            "file_id": folder_id, "parent_id": self.user_record["drive_root_id"], "name": f"{folder_name} (1)",
+        }])
+
+        for restored_id in [folder_id, child_folder_id, file_id]:
+            self.assertIsNone(self.trash_collection.find_one({"_id": ObjectId(restored_id)}))
+        file_record = self.files_collection.find_one({"_id": ObjectId(file_id)})
+        self.assertEqual(file_record["ancestors"], [self.user_record["drive_root_id"], folder_id, child_folder_id])
+        self.assertNotIn("time_trashed", file_record)
+
+    def test_restore_from_trash_without_parent(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        folder_id = self._create_folder(self.user_record["drive_root_id"], "gone-" + uuid.uuid4().hex)
+        file_id, _ = self._upload_test_file(folder_id, uuid.uuid4().hex + ".txt")
+        assert self._client.post("/drive/move-to-trash", headers=headers, json={"files": [folder_id]}).status_code == 200
+
+        # Only the file comes back, its folder stays in the trash
+        restore_response = self._client.post("/drive/restore-from-trash", headers=headers, json={"files": [file_id]})
+        self.assertEqual(restore_response.status_code, 200)
+        file_record = self.files_collection.find_one({"_id": ObjectId(file_id)})
+        self.assertEqual(file_record["parent_id"], self.user_record["drive_root_id"])
+        self.assertEqual(file_record["ancestors"], [self.user_record["drive_root_id"]])
+
+    def test_restore_leaves_separately_trashed_children(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        folder_id = self._create_folder(self.user_record["drive_root_id"], "stamped-" + uuid.uuid4().hex)
+        kept_id = self._create_folder(folder_id, "kept")
+        trashed_id, _ = self._upload_test_file(folder_id, "trashed.txt", uuid.uuid4().bytes)
+        assert self._client.post("/drive/move-to-trash", headers=headers, json={"files": [trashed_id]}).status_code == 200
+        assert self._client.post("/drive/move-to-trash", headers=headers, json={"files": [folder_id]}).status_code == 200
+
+        restore_response = self._client.post("/drive/restore-from-trash", headers=headers, json={"files": [folder_id]})
+        self.assertEqual(restore_response.status_code, 200)
+        self.assertIsNotNone(self.files_collection.find_one({"_id": ObjectId(kept_id)}))
+        self.assertIsNone(self.files_collection.find_one({"_id": ObjectId(trashed_id)}))
+        self.assertEqual(self.trash_collection.find_one({"_id": ObjectId(trashed_id)})["trash_root"], trashed_id)
+        folder_record = self.files_collection.find_one({"_id": ObjectId(folder_id)})
+        self.assertEqual((folder_record["size"], folder_record["item_count"]), (0, 1))
+
     def test_move_directory(self):
         auth_token = self.auth_token
         parent_name1 = "outer_parent1-" + uuid.uuid4().hex
@@ -212,6 +515,178 @@ class DriveTest(unittest.TestCase):
         child_record = self.files_collection.find_one({"_id": ObjectId(child_id)})
         self.assertEqual(child_record["parent_id"], parent_id2)
 
+    def test_move_directory_updates_ancestors(self):
+        auth_token = self.auth_token
+        drive_root_id = self.user_record["drive_root_id"]
+        parent_id1 = self._create_folder(drive_root_id, "outer_parent1-" + uuid.uuid4().hex)
+        parent_id2 = self._create_folder(drive_root_id, "outer_parent2-" + uuid.uuid4().hex)
+        child_id = self._create_folder(parent_id1, "inner_child-" + uuid.uuid4().hex)
+        grandchild_id, _ = self._upload_test_file(child_id, "inner_file-" + uuid.uuid4().hex + ".txt")
+
+        assert self._client.post(
+            "/drive/move-directory",
+            headers={"Authorization": f"Bearer {auth_token}"},
+            json={"files": [child_id], "new_parent_id": parent_id2},
+        ).status_code == 200
+
+        child_record = self.files_collection.find_one({"_id": ObjectId(child_id)})
+        self.assertEqual(child_record["ancestors"], [drive_root_id, parent_id2])
+        grandchild_record = self.files_collection.find_one({"_id": ObjectId(grandchild_id)})
+        self.assertEqual(grandchild_record["ancestors"], [drive_root_id, parent_id2, child_id])
+
+    def test_folder_size_rollups(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        drive_root_id = self.user_record["drive_root_id"]
+        parent_id1 = self._create_folder(drive_root_id, "rollup1-" + uuid.uuid4().hex)
+        parent_id2 = self._create_folder(drive_root_id, "rollup2-" + uuid.uuid4().hex)
+        child_id = self._create_folder(parent_id1, "child")
+        file_id, _ = self._upload_test_file(child_id, "hello.txt")
+
+        def totals(folder_id):
+            folder_record = self.files_collection.find_one({"_id": ObjectId(folder_id)})
+            return folder_record["size"], folder_record["item_count"]
+
+        file_size = len(b"Hello world")
+        self.assertEqual(totals(parent_id1), (file_size, 2))
+        self.assertEqual(totals(child_id), (file_size, 1))
+
+        assert self._client.post(
+            "/drive/move-directory", headers=headers, json={"files": [child_id], "new_parent_id": parent_id2}
+        ).status_code == 200
+        self.assertEqual(totals(parent_id1), (0, 0))
+        self.assertEqual(totals(parent_id2), (file_size, 2))
+
+        assert self._client.post("/drive/move-to-trash", headers=headers, json={"files": [file_id]}).status_code == 200
+        self.assertEqual(totals(parent_id2), (0, 1))
+
+        assert self._client.post("/drive/restore-from-trash", headers=headers, json={"files": [file_id]}).status_code == 200
+        self.assertEqual(totals(parent_id2), (file_size, 2))
+
+    def test_copy_folder(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        drive_root_id = self.user_record["drive_root_id"]
+        folder_name = "copied-" + uuid.uuid4().hex
+        folder_id = self._create_folder(drive_root_id, folder_name)
+        file_id, file_uri = self._upload_test_file(folder_id, "hello.txt", uuid.uuid4().bytes)
+        content_hash = self.files_collection.find_one({"_id": ObjectId(file_id)})["content_hash"]
+
+        copy_response = self._client.post(
+            "/drive/copy", headers=headers, json={"files": [folder_id], "new_parent_id": drive_root_id}
+        )
+        self.assertEqual(copy_response.status_code, 200)
+        [copied_folder] = copy_response.json()["copied"]
+        self.assertNotEqual(copied_folder["file_id"], folder_id)
+        self.assertEqual(copied_folder["name"], f"{folder_name} (1)")
+
+        copied_file = self.files_collection.find_one({"parent_id": copied_folder["file_id"]})
+        self.assertEqual(copied_file["name"], "hello.txt")
+        self.assertEqual(copied_file["uri"], file_uri)
+        self.assertEqual(copied_file["ancestors"], [drive_root_id, copied_folder["file_id"]])
+        self.assertEqual(self.database[COLLECTIONS.BLOBS].find_one({"_id": content_hash})["ref_count"], 2)
+
+    def test_copy_folder_into_itself(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        folder_id = self._create_folder(self.user_record["drive_root_id"], "self-copy-" + uuid.uuid4().hex)
+        child_id = self._create_folder(folder_id, "child")
+        copy_response = self._client.post(
+            "/drive/copy", headers=headers, json={"files": [folder_id], "new_parent_id": child_id}
+        )
+        self.assertEqual(copy_response.status_code, 409)
+
+    def test_move_directory_name_conflict(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        drive_root_id = self.user_record["drive_root_id"]
+        parent_id1 = self._create_folder(drive_root_id, "conflict1-" + uuid.uuid4().hex)
+        parent_id2 = self._create_folder(drive_root_id, "conflict2-" + uuid.uuid4().hex)
+        self._create_folder(parent_id2, "same")
+        moved_id = self._create_folder(parent_id1, "same")
+
+        move_response = self._client.post(
+            "/drive/move-directory", headers=headers, json={"files": [moved_id], "new_parent_id": parent_id2}
+        )
+        self.assertEqual(move_response.status_code, 400)
+        self.assertEqual(self.files_collection.find_one({"_id": ObjectId(moved_id)})["parent_id"], parent_id1)
+
+    def test_path(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        drive_root_id = self.user_record["drive_root_id"]
+        folder_name = "path-" + uuid.uuid4().hex
+        folder_id = self._create_folder(drive_root_id, folder_name)
+        child_id = self._create_folder(folder_id, "child")
+        file_id, _ = self._upload_test_file(child_id, "hello.txt")
+
+        path_response = self._client.get(f"/drive/path/{file_id}", headers=headers)
+        self.assertEqual(path_response.status_code, 200)
+        self.assertEqual(path_response.json()["path"], [
+            {"_id": drive_root_id, "name": "My Drive"},
+            {"_id": folder_id, "name": folder_name},
+            {"_id": child_id, "name": "child"},
+            {"_id": file_id, "name": "hello.txt"},
+        ])
+
+    def test_upload_files(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        folder_id = self._create_folder(self.user_record["drive_root_id"], "bulk-" + uuid.uuid4().hex)
+        self._create_folder(folder_id, "docs")
+        upload_response = self._client.post(
+            f"/drive/upload-files/{folder_id}",
+            headers=headers,
+            files=[
+                ("files", ("docs/a.txt", uuid.uuid4().bytes)),
+                ("files", ("docs/nested/b.txt", uuid.uuid4().bytes)),
+                ("files", ("docs/a.txt", uuid.uuid4().bytes)),
+                ("files", ("../escape.txt", b"outside")),
+            ],
+        )
+        self.assertEqual(upload_response.status_code, 200)
+        results = upload_response.json()["results"]
+        self.assertEqual([result.get("name") for result in results], ["a.txt", "b.txt", "a (1).txt", None])
+        self.assertIn("error", results[3])
+
+        # The existing folder is reused and the nested one is created
+        docs_folders = list(self.files_collection.find({"parent_id": folder_id, "name": "docs"}))
+        self.assertEqual(len(docs_folders), 1)
+        docs_id = str(docs_folders[0]["_id"])
+        nested_folder = self.files_collection.find_one({"parent_id": docs_id, "name": "nested"})
+        self.assertEqual(nested_folder["ancestors"], [self.user_record["drive_root_id"], folder_id, docs_id])
+        nested_file = self.files_collection.find_one({"_id": ObjectId(results[1]["file_id"])})
+        self.assertEqual(nested_file["parent_id"], str(nested_folder["_id"]))
+        self.assertEqual(self.files_collection.find_one({"_id": ObjectId(folder_id)})["item_count"], 5)
+
+    def test_change_feed(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        since = self.database[COLLECTIONS.USERS].find_one({"email": TEST_USER}).get("change_seq", 0)
+        folder_id = self._create_folder(self.user_record["drive_root_id"], "changes-" + uuid.uuid4().hex)
+        assert self._client.post("/drive/move-to-trash", headers=headers, json={"files": [folder_id]}).status_code == 200
+
+        changes_response = self._client.get("/drive/changes", headers=headers, params={"since": since})
+        self.assertEqual(changes_response.status_code, 200)
+        changes_body = changes_response.json()
+        self.assertFalse(changes_body["reset"])
+        self.assertEqual(
+            [(change["seq"], change["action"], change["file_id"]) for change in changes_body["changes"]],
+            [(since + 1, "create", folder_id), (since + 2, "trash", folder_id)],
+        )
+        self.assertEqual(changes_body["next_cursor"], since + 2)
+
+    def test_change_feed_reset_when_everything_expired(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        self._create_folder(self.user_record["drive_root_id"], "expiring-" + uuid.uuid4().hex)
+        since = self.database[COLLECTIONS.USERS].find_one({"email": TEST_USER})["change_seq"]
+        self._create_folder(self.user_record["drive_root_id"], "expiring-" + uuid.uuid4().hex)
+
+        # Stand in for the TTL index removing every change, including the one after the cursor
+        self.database[COLLECTIONS.CHANGES].delete_many({"owner": TEST_USER})
+        changes_body = self._client.get("/drive/changes", headers=headers, params={"since": since}).json()
+        self.assertTrue(changes_body["reset"])
+        self.assertEqual(changes_body["changes"], [])
+        # The client resyncs and continues from the latest change instead of resetting again
+        self.assertEqual(changes_body["next_cursor"], since + 1)
+        changes_body = self._client.get(
+            "/drive/changes", headers=headers, params={"since": changes_body["next_cursor"]}
+        ).json()
+        self.assertFalse(changes_body["reset"])
+
     def test_move_directory_invalid(self):
         auth_token = self.auth_token
         parent_name = "outer_parent1-" + uuid.uuid4().hex
@@ -227,5 +702,44 @@ class DriveTest(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 409)
 
+    def test_move_folder_with_its_descendant(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        folder_id = self._create_folder(self.user_record["drive_root_id"], "moved-" + uuid.uuid4().hex)
+        target_id = self._create_folder(self.user_record["drive_root_id"], "target-" + uuid.uuid4().hex)
+        moved_file_id, _ = self._upload_test_file(folder_id, "moved.txt")
+        self._upload_test_file(folder_id, "kept.txt")
+
+        response = self._client.post(
+            "/drive/move-directory",
+            headers=headers,
+            json={"files": [folder_id, moved_file_id], "new_parent_id": target_id},
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # The file left the folder, the target holds both once
+        folder_record = self.files_collection.find_one({"_id": ObjectId(folder_id)})
+        self.assertEqual((folder_record["size"], folder_record["item_count"]), (11, 1))
+        target_record = self.files_collection.find_one({"_id": ObjectId(target_id)})
+        self.assertEqual((target_record["size"], target_record["item_count"]), (22, 3))
+
+    def test_move_same_names_together(self):
+        headers = {"Authorization": f"Bearer {self.auth_token}"}
+        first_folder_id = self._create_folder(self.user_record["drive_root_id"], "first-" + uuid.uuid4().hex)
+        second_folder_id = self._create_folder(self.user_record["drive_root_id"], "second-" + uuid.uuid4().hex)
+        target_id = self._create_folder(self.user_record["drive_root_id"], "target-" + uuid.uuid4().hex)
+        first_file_id, _ = self._upload_test_file(first_folder_id, "a.txt")
+        second_file_id, _ = self._upload_test_file(second_folder_id, "a.txt")
+
+        response = self._client.post(
+            "/drive/move-directory",
+            headers=headers,
+            json={"files": [first_file_id, second_file_id], "new_parent_id": target_id},
+        )
+        self.assertEqual(response.status_code, 400)
+        # Nothing was moved
+        for file_id, folder_id in [(first_file_id, first_folder_id), (second_file_id, second_folder_id)]:
+            self.assertEqual(self.files_collection.find_one({"_id": ObjectId(file_id)})["parent_id"], folder_id)
+        self.assertEqual(self.files_collection.find_one({"_id": ObjectId(target_id)})["item_count"], 0)
+
 if __name__ == '__main__':
     unittest.main()
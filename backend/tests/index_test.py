@@ -0,0 +1,80 @@
+import unittest
+from bson import ObjectId
+from pymongo import MongoClient
+from starlette.testclient import TestClient
+from app import app
+from core.constants import DATABASE_URL, DATABASE_NAME, COLLECTIONS, BUCKETS
+from tests.config import TEST_USER
+
+
+def _find_stages(plan, stage_name):
+    if isinstance(plan, dict):
+        if plan.get("stage") == stage_name:
+            yield plan
+        for value in plan.values():
+            yield from _find_stages(value, stage_name)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _find_stages(value, stage_name)
+
+
+class IndexTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Starting the app ensures the indexes
+        cls._client = TestClient(app).__enter__()
+        cls.mongo_client = MongoClient(DATABASE_URL)
+        cls.database = cls.mongo_client[DATABASE_NAME]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mongo_client.close()
+        cls._client.__exit__(None, None, None)
+
+    def _winning_plan(self, collection_name, query, sort=None, limit=0):
+        cursor = self.database[collection_name].find(query).limit(limit)
+        if sort:
+            cursor = cursor.sort(sort)
+        return cursor.explain()["queryPlanner"]["winningPlan"]
+
+    def _assert_no_collscan(self, collection_name, query, sort=None):
+        collscans = list(_find_stages(self._winning_plan(collection_name, query, sort), "COLLSCAN"))
+        self.assertEqual(collscans, [], f"COLLSCAN on {collection_name} for {query}")
+
+    def test_hot_queries_use_indexes(self):
+        file_id = str(ObjectId())
+        hot_queries = [
+            (COLLECTIONS.USERS, {"email": TEST_USER}, None),
+            (COLLECTIONS.FILES, {"_id": ObjectId(file_id)}, None),
+            (COLLECTIONS.FILES, {"owner": TEST_USER, "parent_id": file_id}, None),
+            (COLLECTIONS.FILES, {"parent_id": file_id, "name": "hello.txt"}, None),
+            (COLLECTIONS.FILES, {"ancestors": {"$in": [file_id]}, "is_folder": True}, None),
+            (COLLECTIONS.FILES, {"owner": TEST_USER, "name_lower": {"$regex": "^rep"}}, None),
+            (
+                COLLECTIONS.FILES,
+                {"owner": TEST_USER, "parent_id": {"$gt": ""}, "name_grams": {"$all": ["epo", "por", "rep"]},
+                 "name_lower": {"$regex": "repo"}},
+                [("name_lower", 1), ("_id", 1)],
+            ),
+            (COLLECTIONS.FILES, {"owner": TEST_USER, "name_grams": {"$all": ["epo", "por", "rep"]}}, None),
+            (COLLECTIONS.FILES, {"$or": [{"_id": {"$in": [ObjectId(file_id)]}}, {"ancestors": {"$in": [file_id]}}]}, None),
+            (COLLECTIONS.TRASH, {"owner": TEST_USER}, None),
+            (COLLECTIONS.TRASH, {"time_trashed": {"$lt": 0}, "owner": TEST_USER}, None),
+            (COLLECTIONS.TRASH, {"$or": [{"_id": {"$in": [ObjectId(file_id)]}}, {"ancestors": {"$in": [file_id]}}]}, None),
+            (f"{BUCKETS.FILE_STORAGE.name}.chunks", {"files_id": ObjectId(file_id)}, [("n", 1)]),
+            (f"{BUCKETS.FILE_STORAGE.name}.chunks", {"files_id": {"$in": [ObjectId(file_id)]}}, None),
+        ]
+        for collection_name, query, sort in hot_queries:
+            with self.subTest(collection=collection_name, query=query):
+                self._assert_no_collscan(collection_name, query, sort)
+
+    def test_search_by_name_is_sorted_by_the_index(self):
+        # A page of prefix search results by name comes off the index in order
+        prefix_query = {"owner": TEST_USER, "parent_id": {"$gt": ""}, "name_lower": {"$regex": "^rep"}}
+        winning_plan = self._winning_plan(COLLECTIONS.FILES, prefix_query, [("name_lower", 1), ("_id", 1)], 51)
+        self.assertEqual(list(_find_stages(winning_plan, "SORT")), [])
+        self.assertEqual(list(_find_stages(winning_plan, "COLLSCAN")), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
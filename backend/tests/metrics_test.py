@@ -0,0 +1,50 @@
+import unittest
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+from core.metrics import MetricsRegistry, MetricsMiddleware, current_route, http_requests, http_request_duration
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        latency = registry.histogram("latency_seconds", "Latency", ("route",))
+        for value in (0.001, 0.02, 3):
+            latency.observe(value, route="/a")
+
+        rendered = registry.render()
+        self.assertIn('latency_seconds_bucket{route="/a",le="0.001"} 1', rendered)
+        self.assertIn('latency_seconds_bucket{route="/a",le="0.025"} 2', rendered)
+        self.assertIn('latency_seconds_bucket{route="/a",le="+Inf"} 3', rendered)
+        self.assertIn('latency_seconds_count{route="/a"} 3', rendered)
+
+    def test_collectors_run_before_render(self):
+        registry = MetricsRegistry()
+        entries = registry.gauge("entries", "Entries", ("cache",))
+        registry.add_collector(lambda: entries.set(7, cache='quoted "name"'))
+
+        self.assertIn('entries{cache="quoted \\"name\\""} 7', registry.render())
+
+
+class MetricsMiddlewareTest(unittest.TestCase):
+    def test_requests_are_labelled_by_route_template(self):
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+        seen_routes = []
+
+        @app.get("/items/{item_id}")
+        async def get_item(item_id: str):
+            seen_routes.append(current_route.get())
+            return {"item_id": item_id}
+
+        with TestClient(app) as client:
+            self.assertEqual(client.get("/items/abc").status_code, 200)
+            self.assertEqual(client.get("/missing").status_code, 404)
+
+        self.assertEqual(seen_routes, ["/items/{item_id}"])
+        self.assertGreaterEqual(http_requests.values[("GET", "/items/{item_id}", "200")], 1)
+        self.assertGreaterEqual(http_requests.values[("GET", "unmatched", "404")], 1)
+        self.assertIn(("GET", "/items/{item_id}"), http_request_duration.observations)
+
+
+if __name__ == '__main__':
+    unittest.main()
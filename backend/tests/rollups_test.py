@@ -0,0 +1,22 @@
+import unittest
+from core.rollups import rollup_deltas, without_nested_totals
+
+
+class RollupsTest(unittest.TestCase):
+    def test_nested_records_leave_their_moved_ancestors(self):
+        # outer holds inner and a 10 byte file, inner holds the 20 byte file moved along
+        outer = {"_id": "outer", "ancestors": ["root"], "is_folder": True, "size": 30, "item_count": 3}
+        inner = {"_id": "inner", "ancestors": ["root", "outer"], "is_folder": True, "size": 20, "item_count": 1}
+        moved_file = {"_id": "file", "ancestors": ["root", "outer", "inner"], "size": 20}
+
+        moved_totals = without_nested_totals([outer, moved_file, inner])
+        deltas = rollup_deltas(moved_totals, sign=-1)
+        rollup_deltas([{**record, "ancestors": ["target"]} for record in moved_totals], deltas=deltas)
+
+        self.assertEqual(dict(deltas), {
+            "root": [-30, -4], "outer": [-20, -2], "inner": [-20, -1], "target": [30, 4],
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+from fastapi import HTTPException
+from core.constants import PASSWORD_HASH_MAX_PENDING
+from core.security import SecurityManager
+
+
+class HashAdmissionTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = SecurityManager()
+
+    def tearDown(self):
+        self.manager.shutdown_hash_pool()
+
+    def test_saturated_admission_is_rejected(self):
+        async def hash_while_saturated():
+            self.manager.start_hash_pool()
+            for _ in range(PASSWORD_HASH_MAX_PENDING):
+                await self.manager._hash_admission.acquire()
+            await self.manager.hash_password_async("password")
+
+        with patch("core.security.PASSWORD_HASH_ADMISSION_TIMEOUT", 0.01):
+            with self.assertRaises(HTTPException) as raised:
+                asyncio.run(hash_while_saturated())
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(raised.exception.headers, {"Retry-After": "1"})
+
+    def test_admission_follows_the_pool(self):
+        async def acquire_once():
+            self.manager.start_hash_pool()
+            async with self.manager._hash_admission:
+                pass
+            return self.manager._hash_admission
+
+        # A restarted pool on a new event loop doesn't reuse the semaphore of the old one
+        first_admission = asyncio.run(acquire_once())
+        self.manager.shutdown_hash_pool()
+        self.assertIsNone(self.manager._hash_admission)
+        self.assertIsNot(asyncio.run(acquire_once()), first_admission)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from core.storage import BlobStorage, GridFSEngine, LocalEngine, StorageEngine, LOCAL_URI_PREFIX, GRIDFS_BACKEND, \
+    LOCAL_BACKEND
+
+
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.storage = BlobStorage(
+            {GRIDFS_BACKEND: GridFSEngine("file_storage"), LOCAL_BACKEND: LocalEngine(Path(self.root.name))},
+            LOCAL_BACKEND,
+        )
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_engine_by_uri(self):
+        self.assertIsInstance(self.storage.engine_for("65f1c0ffee0000000000abcd"), GridFSEngine)
+        self.assertIsInstance(self.storage.engine_for(LOCAL_URI_PREFIX + "ab/cd/abcd"), LocalEngine)
+        self.assertIsNone(self.storage.local_path("65f1c0ffee0000000000abcd"))
+        # Local uris never leave the root
+        with self.assertRaises(FileNotFoundError):
+            self.storage.local_path(LOCAL_URI_PREFIX + "../outside")
+
+    def test_incomplete_engine_is_rejected(self):
+        class ReadOnlyEngine(StorageEngine):
+            def owns(self, file_uri: str) -> bool:
+                return True
+
+        with self.assertRaises(TypeError):
+            ReadOnlyEngine()
+
+    def test_local_round_trip(self):
+        payload = os.urandom(700 * 1024)
+
+        async def round_trip():
+            file_uri = await self.storage.write(payload, "payload.bin", {})
+            stored_blob = await self.storage.stat(file_uri)
+            whole = await self.storage.read(file_uri)
+            partial = b"".join([chunk async for chunk in self.storage.iter_chunks(file_uri, 1000, 300000)])
+            await self.storage.delete([file_uri])
+            return file_uri, stored_blob, whole, partial
+
+        file_uri, stored_blob, whole, partial = asyncio.run(round_trip())
+        content_hash = hashlib.sha256(payload).hexdigest()
+        self.assertTrue(file_uri.startswith(f"{LOCAL_URI_PREFIX}{content_hash[:2]}/{content_hash[2:4]}/{content_hash}"))
+        self.assertEqual(stored_blob.length, len(payload))
+        self.assertEqual(whole, payload)
+        self.assertEqual(partial, payload[1000:300000])
+        self.assertFalse(stored_blob.path.exists())
+        # Nothing is left behind in the temporary directory
+        self.assertEqual(list((Path(self.root.name) / "tmp").iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
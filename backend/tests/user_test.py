@@ -0,0 +1,92 @@
+import asyncio
+import unittest
+from starlette.testclient import TestClient
+from app import app
+from core.auth_utils import delete_profile_pictures, profile_cache
+from core.constants import JwtTokenScope, FALLBACK_PROFILE_PICTURE, PROFILE_CACHE_CONTROL
+from core.security import security_manager
+from core.storage import LOCAL_URI_PREFIX
+from models.db_models import UserModel
+from routers.user import pick_profile_variant
+from tests.config import TEST_USER
+
+
+class ProfileVariantTest(unittest.TestCase):
+    def test_smallest_covering_variant(self):
+        user_obj = UserModel(
+            username="test", email=TEST_USER, password="",
+            profile_image_id="original-id", profile_variants={"32": "small-id", "64": "medium-id", "256": "large-id"},
+        )
+        self.assertEqual(pick_profile_variant(user_obj, 64), ("medium-id", "64"))
+        self.assertEqual(pick_profile_variant(user_obj, 65), ("large-id", "256"))
+        self.assertEqual(pick_profile_variant(user_obj, 1), ("small-id", "32"))
+        # Larger than every variant, or no size at all, gets the original
+        self.assertEqual(pick_profile_variant(user_obj, 512), ("original-id", "original"))
+        self.assertEqual(pick_profile_variant(user_obj, None), ("original-id", "original"))
+
+    def test_deleted_pictures_leave_the_cache(self):
+        variant_id = LOCAL_URI_PREFIX + "ab/cd/variant"
+        profile_cache.set(variant_id, (b"cached", "image/png"))
+        asyncio.run(delete_profile_pictures({"profile_image_id": LOCAL_URI_PREFIX + "ab/cd/original",
+                                             "profile_variants": {"32": variant_id}}))
+        self.assertIsNone(profile_cache.get(variant_id))
+
+
+class ProfilePictureTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._client = TestClient(app).__enter__()
+        cls.auth_token = security_manager.create_access_token(TEST_USER, JwtTokenScope.auth)
+        cls.headers = {"Authorization": f"Bearer {cls.auth_token}"}
+        cls.picture = FALLBACK_PROFILE_PICTURE.read_bytes()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._client.__exit__(None, None, None)
+
+    def _upload_profile(self) -> str:
+        response = self._client.post(
+            "/user/upload-profile", headers=self.headers, files={"file": ("avatar.png", self.picture, "image/png")}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["profile_image_id"]
+
+    def _get_profile(self, file_id: str, size: int | None = None, etag: str | None = None):
+        params = {"token": self.auth_token, **({"size": size} if size is not None else {})}
+        headers = {"If-None-Match": etag} if etag else {}
+        return self._client.get(f"/user/profile/{file_id}", params=params, headers=headers)
+
+    def test_variant_etag_and_not_modified(self):
+        file_id = self._upload_profile()
+
+        response = self._get_profile(file_id, size=48)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["etag"], f'"{file_id}-64"')
+        self.assertEqual(response.headers["cache-control"], PROFILE_CACHE_CONTROL)
+        self.assertEqual(self._get_profile(file_id).headers["etag"], f'"{file_id}-original"')
+
+        revalidated = self._get_profile(file_id, size=48, etag=response.headers["etag"])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b"")
+        self.assertEqual(revalidated.headers["etag"], response.headers["etag"])
+
+        # A validator of another variant doesn't match
+        self.assertEqual(self._get_profile(file_id, size=200, etag=response.headers["etag"]).status_code, 200)
+
+    def test_update_invalidates_cached_variants(self):
+        file_id = self._upload_profile()
+        self.assertEqual(self._get_profile(file_id, size=32).status_code, 200)
+        variant_id = self._client.get("/user", headers=self.headers).json()["profile_variants"]["32"]
+        self.assertIsNotNone(profile_cache.get(variant_id))
+
+        new_file_id = self._upload_profile()
+        self.assertIsNone(profile_cache.get(variant_id))
+        # The old id is no longer the user's picture, the fallback isn't cached as immutable
+        response = self._get_profile(file_id, size=32)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers.get("cache-control"), PROFILE_CACHE_CONTROL)
+        self.assertEqual(self._get_profile(new_file_id, size=32).headers["etag"], f'"{new_file_id}-32"')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import asyncio
+import io
+import os
+import unittest
+from zipfile import ZipFile
+from core.zip_stream import ZipEntry, stream_zip
+
+
+async def _chunks(payload: bytes, chunk_size: int = 1024):
+    for start in range(0, len(payload), chunk_size):
+        yield payload[start:start + chunk_size]
+
+
+async def _entries(files):
+    for path, payload, compress in files:
+        yield ZipEntry(path=path, chunks=_chunks(payload), size=len(payload), compress=compress)
+
+
+def _build_archive(files) -> bytes:
+    async def collect():
+        return b"".join([part async for part in stream_zip(_entries(files))])
+    return asyncio.run(collect())
+
+
+class ZipStreamTest(unittest.TestCase):
+    def test_round_trip(self):
+        files = [
+            ("hello.txt", b"Hello world" * 1000, True),
+            ("folder/random.bin", os.urandom(10_000), False),
+            ("folder/nested/empty.txt", b"", True),
+            ("folder/ünïcode.txt", b"unicode", True),
+        ]
+        with ZipFile(io.BytesIO(_build_archive(files))) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            for path, payload, _ in files:
+                self.assertEqual(zip_file.read(path), payload)
+
+    def test_empty_archive(self):
+        with ZipFile(io.BytesIO(_build_archive([]))) as zip_file:
+            self.assertEqual(zip_file.namelist(), [])
+
+    def test_unknown_size_uses_zip64(self):
+        async def collect():
+            entry = ZipEntry(path="unknown.txt", chunks=_chunks(b"abc" * 100))
+            async def entries():
+                yield entry
+            return b"".join([part async for part in stream_zip(entries())])
+
+        with ZipFile(io.BytesIO(asyncio.run(collect()))) as zip_file:
+            self.assertEqual(zip_file.read("unknown.txt"), b"abc" * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()